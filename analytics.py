@@ -0,0 +1,107 @@
+GROUPINGS = {
+    "cfop": "CFOP",
+    "codigo": "Código do Produto",
+    "unidade": "Unidade",
+    "emitida": "Data de Emissão",
+}
+
+# Ordem das chaves de cada combinação em aggregate_products
+_COMBO_FIELDS = ("cfop", "codigo", "unidade", "emitida")
+
+class ProductAggregates:
+    """
+    Totais dos produtos de um conjunto de notas, agrupados por cada chave de
+    GROUPINGS: quantidade de itens, soma das quantidades e soma do valor total.
+    Para "codigo", a descrição é o primeiro nome de produto visto com aquele código.
+    """
+
+    def __init__(self, groups: dict, total_notas: int):
+        self.groups = groups
+        self.total_notas = total_notas
+
+    def rows(self, grouping: str, by: str = "valor_total") -> list:
+        """
+        Linhas do agrupamento em ordem decrescente de by (valor_total, quantidade ou itens).
+        """
+        rows = [
+            {
+                "chave": key,
+                "descricao": descricao,
+                "itens": itens,
+                "quantidade": quantidade,
+                "valor_total": valor,
+            }
+            for key, (itens, quantidade, valor, descricao) in self.groups[grouping].items()
+        ]
+        rows.sort(key=lambda r: r[by], reverse=True)
+        return rows
+
+    def top(self, grouping: str, n: int = 10, by: str = "valor_total") -> list:
+        return self.rows(grouping, by)[:n]
+
+def aggregate_products(notas: list) -> ProductAggregates:
+    """
+    Agrega os produtos de todas as notas numa única passada: os itens são
+    somados por combinação (cfop, codigo, unidade, emitida), que se repete
+    muito, e só as combinações são depois distribuídas pelos agrupamentos.
+    """
+    combos = {}
+    for nota in notas:
+        emitida = nota.get("emitida") or ""
+        for p in nota.get("produtos", []):
+            key = (p.get("cfop") or "", p.get("codigo") or "", p.get("unidade") or "", emitida)
+            acc = combos.get(key)
+            if acc is None:
+                acc = combos[key] = [0, 0.0, 0.0, p.get("nome") or ""]
+            acc[0] += 1
+            acc[1] += p.get("quantidade") or 0.0
+            acc[2] += p.get("valor_total") or 0.0
+
+    groups = {name: {} for name in GROUPINGS}
+    for key, (itens, quantidade, valor, nome) in combos.items():
+        for field, value in zip(_COMBO_FIELDS, key):
+            group = groups[field]
+            acc = group.get(value)
+            if acc is None:
+                group[value] = [itens, quantidade, valor, nome if field == "codigo" else ""]
+            else:
+                acc[0] += itens
+                acc[1] += quantidade
+                acc[2] += valor
+    return ProductAggregates(groups, len(notas))
+
+def cached_product_aggregates(report: dict):
+    """
+    ProductAggregates guardado no relatório por store_product_aggregates,
+    ou None se a lista de notas mudou desde então (outro filtro ou notas novas
+    do monitoramento de pasta).
+    """
+    notas = report.get("notas", [])
+    cached = report.get("product_aggregates")
+    if cached is not None and cached[0] is notas and cached[1] == len(notas):
+        return cached[2]
+    return None
+
+def store_product_aggregates(report: dict, notas: list, aggregates: ProductAggregates) -> None:
+    """
+    Guarda no relatório os totais calculados sobre as primeiras
+    aggregates.total_notas notas de notas, se ela ainda for a lista do relatório.
+    Deve ser chamada na thread dona do relatório (a da interface).
+    """
+    if report.get("notas") is notas:
+        report["product_aggregates"] = (notas, aggregates.total_notas, aggregates)
+
+def product_aggregates(report: dict) -> ProductAggregates:
+    """
+    aggregate_products das notas do relatório, guardado no próprio relatório
+    e recalculado só se a lista de notas mudar (ver cached_product_aggregates).
+    """
+    aggregates = cached_product_aggregates(report)
+    if aggregates is None:
+        notas = report.get("notas", [])
+        # Sobre uma cópia: notas incluídas durante a agregação tornam o
+        # resultado antigo no próximo uso, em vez de ficarem de fora dele.
+        # Sequências somente leitura (warehouse.WarehouseNotes) não são copiadas.
+        aggregates = aggregate_products(list(notas) if isinstance(notas, list) else notas)
+        store_product_aggregates(report, notas, aggregates)
+    return aggregates
@@ -0,0 +1,337 @@
+"""
+Benchmarks dos pontos críticos da análise de notas.
+
+Uso:
+    python benchmark.py [--tamanhos 1000,10000] [--etapas csv,pdf,...] [--workers N] [--parser NOME]
+                        [--json resultado.json] [--base referencia.json] [--tolerancia 0.25]
+                        [--corpus-dir PASTA] [--extratores] [--memoria]
+
+Sem --extratores/--memoria, roda o benchmark do pipeline: para cada tamanho
+gera um corpus sintético (ver gerar_corpus) e mede cada etapa de ETAPAS em
+um processo novo, registrando tempo, itens/s e pico de memória (RSS). O
+parsing usa o backend de resolve_parser (--parser ou settings.ini), o mesmo
+de analyze_files, e cada medição guarda qual foi.
+Com --base, compara com um --json anterior e termina com código 1 se alguma
+etapa ficar mais lenta que a tolerância, para pegar regressões.
+
+Os XMLs são sintéticos e gerados de forma determinística (semente fixa), então
+o resultado não depende de arquivos reais. Os tempos dos micro-benchmarks
+(--extratores, --memoria) são o melhor de algumas repetições.
+"""
+import os
+import sys
+import json
+import time
+import random
+import zipfile
+import argparse
+import tempfile
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from processing import NFE_NS, EXTRACTORS, LET, resolve_parser
+from records import compact_note
+
+ETAPAS = ("extract_files", "extract_note_details", "process_xml_files", "filtros", "csv", "xlsx", "txt", "pdf")
+TAMANHOS = (1000, 10000)
+
+def gerar_nfe(numero: int, itens: int = 10, modelo: str = "55", cstat: str = "100", protocolo: bool = True,
+              data: str = "2024-05-10") -> bytes:
+    """
+    Gera o XML de uma NF-e/NFC-e sintética com a quantidade de <det> informada.
+    """
+    dets = []
+    for i in range(itens):
+        quantidade = i % 5 + 1
+        dets.append(
+            f'<det nItem="{i + 1}"><prod>'
+            f'<cProd>{i:06d}</cProd><xProd>PRODUTO SINTETICO {i}</xProd>'
+            f'<CFOP>{5102 + i % 3}</CFOP><uCom>UN</uCom>'
+            f'<qCom>{quantidade}.0000</qCom><vUnCom>2.50</vUnCom><vProd>{quantidade * 2.5:.2f}</vProd>'
+            f'</prod><imposto><ICMS><ICMS00><orig>0</orig><CST>00</CST></ICMS00></ICMS></imposto></det>'
+        )
+    prot = ""
+    if protocolo:
+        prot = (
+            f'<protNFe versao="4.00"><infProt><chNFe>3524{numero:040d}</chNFe>'
+            f'<dhRecbto>{data}T10:00:00-03:00</dhRecbto><cStat>{cstat}</cStat></infProt></protNFe>'
+        )
+    total = sum((i % 5 + 1) * 2.5 for i in range(itens))
+    xml = (
+        f'<?xml version="1.0" encoding="UTF-8"?>'
+        f'<nfeProc xmlns="{NFE_NS}" versao="4.00"><NFe>'
+        f'<infNFe Id="NFe3524{numero:040d}" versao="4.00">'
+        f'<ide><cUF>35</cUF><cNF>{numero * 7 % 100000000:08d}</cNF><mod>{modelo}</mod>'
+        f'<nNF>{numero}</nNF><dhEmi>{data}T09:00:00-03:00</dhEmi></ide>'
+        f'<emit><CNPJ>12345678000199</CNPJ><xNome>EMPRESA SINTETICA LTDA</xNome>'
+        f'<enderEmit><xLgr>RUA A</xLgr><nro>1</nro><xBairro>CENTRO</xBairro>'
+        f'<xMun>SAO PAULO</xMun><UF>SP</UF></enderEmit></emit>'
+        f'{"".join(dets)}'
+        f'<total><ICMSTot><vProd>{total:.2f}</vProd><vNF>{total:.2f}</vNF></ICMSTot></total>'
+        f'</infNFe></NFe>{prot}</nfeProc>'
+    )
+    return xml.encode("utf-8")
+
+def _melhor_tempo(func, repeticoes: int = 5) -> float:
+    melhor = float("inf")
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        func()
+        melhor = min(melhor, time.perf_counter() - inicio)
+    return melhor
+
+def bench_extractors(itens_por_nota=(5, 50, 500, 5000), notas: int = 20) -> None:
+    """
+    Compara os backends de EXTRACTORS: "etree" (buscas ".//" na árvore),
+    "iterparse" (uma passada) e "lxml" (XPath compilado, se instalado).
+    """
+    backends = [nome for nome in ("etree", "iterparse", "lxml") if nome != "lxml" or LET is not None]
+    print("Extratores (ms por nota)")
+    print("{:>8}".format("itens") + "".join("{:>12}".format(nome) for nome in backends))
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for itens in itens_por_nota:
+            paths = []
+            for numero in range(notas):
+                path = os.path.join(temp_dir, f"{itens}_{numero}.xml")
+                with open(path, "wb") as f:
+                    f.write(gerar_nfe(numero, itens))
+                paths.append(path)
+            for path in paths:
+                resultados = [EXTRACTORS[nome](path) for nome in backends]
+                if any(r != resultados[0] for r in resultados):
+                    sys.exit(f"Resultado divergente em {path}")
+            linha = "{:>8}".format(itens)
+            for nome in backends:
+                extrator = EXTRACTORS[nome]
+                tempo = _melhor_tempo(lambda: [extrator(p) for p in paths]) / notas
+                linha += "{:>12.3f}".format(tempo * 1000)
+            print(linha)
+
+def _memoria_alocada(construir) -> tuple:
+    """
+    Executa construir() e devolve (resultado, bytes ainda alocados por ele).
+    """
+    tracemalloc.start()
+    inicio = tracemalloc.get_traced_memory()[0]
+    resultado = construir()
+    usado = tracemalloc.get_traced_memory()[0] - inicio
+    tracemalloc.stop()
+    return resultado, usado
+
+def bench_memoria(notas: int = 20000, itens: int = 8) -> None:
+    """
+    Compara a memória de um relatório guardado como lista de dicts (formato
+    de extract_note_details) e como lista de NoteRecord (records.py).
+    """
+    extrator = EXTRACTORS["iterparse"]
+    xmls = [gerar_nfe(numero, itens, modelo="65") for numero in range(notas)]
+
+    dicts, mem_dicts = _memoria_alocada(
+        lambda: [extrator(f"{numero}.xml", xml) for numero, xml in enumerate(xmls)]
+    )
+    del dicts
+    records, mem_records = _memoria_alocada(
+        lambda: [compact_note(extrator(f"{numero}.xml", xml)) for numero, xml in enumerate(xmls)]
+    )
+    del records
+
+    print(f"Memória do relatório ({notas} notas, {itens} itens cada)")
+    print("{:>12} {:>12} {:>14}".format("formato", "MB", "bytes/nota"))
+    for nome, usado in (("dict", mem_dicts), ("NoteRecord", mem_records)):
+        print("{:>12} {:>12.1f} {:>14.0f}".format(nome, usado / 1024 / 1024, usado / notas))
+
+def gerar_corpus(destino: str, notas: int, semente: int = 42, canceladas: float = 0.05,
+                 sem_protocolo: float = 0.03, malformados: float = 0.01) -> str:
+    """
+    Grava em destino (um .zip) um corpus sintético com notas NF-e (mod 55) e
+    NFC-e (mod 65) misturadas. A maioria das notas tem de 1 a 20 itens e 1% tem
+    até 300. As frações informadas saem canceladas (cStat 101), sem protocolo
+    ou truncadas (XML inválido). As datas se espalham por 2024.
+    A mesma semente gera sempre o mesmo corpus.
+    """
+    rng = random.Random(semente)
+    with zipfile.ZipFile(destino, "w", zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+        for numero in range(1, notas + 1):
+            itens = rng.randint(1, 300) if rng.random() < 0.01 else rng.randint(1, 20)
+            sorteio = rng.random()
+            cstat = "101" if sorteio < canceladas else "100"
+            protocolo = not (canceladas <= sorteio < canceladas + sem_protocolo)
+            dia = rng.randrange(366)
+            data = time.strftime("%Y-%m-%d", time.gmtime(1704067200 + dia * 86400))
+            xml = gerar_nfe(numero, itens, rng.choice(("55", "65")), cstat, protocolo, data)
+            if rng.random() < malformados:
+                xml = xml[:len(xml) // 2]
+            zf.writestr(f"nota_{numero:07d}.xml", xml)
+    return destino
+
+def _rss_pico_mb() -> float:
+    import resource
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss vem em KB no Linux e em bytes no macOS
+    return pico / 1024 / 1024 if sys.platform == "darwin" else pico / 1024
+
+def _carregar_relatorio(corpus: str, notas: int, workers: int, parser: str) -> dict:
+    from processing import process_xml_files, iter_xml_sources
+    return process_xml_files(iter_xml_sources([corpus]), total=notas, workers=workers, parser=parser, cache=False)
+
+def _executar_etapa(etapa: str, corpus: str, notas: int, workers: int, parser: str) -> dict:
+    """
+    Roda uma etapa em um processo novo (ver bench_pipeline) e devolve tempo,
+    quantidade de itens e memória. A preparação (como montar o relatório para
+    filtros e exportadores) não entra no tempo, mas entra na memória base.
+    """
+    from processing import process_xml_files, iter_xml_sources, extract_files
+    from filters import NoteIndex
+    import export
+    import datetime
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        relatorio = None
+        if etapa in ("filtros", "csv", "xlsx", "txt", "pdf"):
+            relatorio = _carregar_relatorio(corpus, notas, workers, parser)
+        base = _rss_pico_mb()
+
+        inicio = time.perf_counter()
+        if etapa == "extract_files":
+            itens = len(extract_files([corpus], temp_dir))
+        elif etapa == "extract_note_details":
+            extrator = EXTRACTORS[parser]
+            itens = 0
+            gasto = 0.0
+            for caminho, conteudo in iter_xml_sources([corpus]):
+                t = time.perf_counter()
+                try:
+                    extrator(caminho, conteudo)
+                except Exception:
+                    pass
+                gasto += time.perf_counter() - t
+                itens += 1
+            inicio = time.perf_counter() - gasto
+        elif etapa == "process_xml_files":
+            itens = len(process_xml_files(iter_xml_sources([corpus]), total=notas, workers=workers, parser=parser,
+                                          cache=False)["notas"])
+        elif etapa == "filtros":
+            indice = NoteIndex(relatorio["notas"])
+            consultas = [
+                {"status": "cancelada"},
+                {"cfop": "5102"},
+                {"product": "sintetico 1"},
+                {"start_date": datetime.date(2024, 3, 1), "end_date": datetime.date(2024, 3, 31)},
+                {"min_val": 10.0, "max_val": 20.0},
+                {"status": "autorizada", "cfop": "5103", "min_val": 5.0, "nNF": "1"},
+            ]
+            for criterios in consultas:
+                indice.query(**criterios)
+            itens = len(relatorio["notas"]) * len(consultas)
+        else:
+            saida = os.path.join(temp_dir, f"relatorio.{etapa}")
+            exportador = {
+                "csv": export.export_to_csv,
+                "xlsx": export.export_to_excel,
+                "txt": export.export_to_txt,
+                "pdf": export.export_to_pdf,
+            }[etapa]
+            exportador(relatorio, saida)
+            itens = len(relatorio["notas"])
+        segundos = time.perf_counter() - inicio
+
+    return {
+        "segundos": segundos,
+        "itens": itens,
+        "itens_por_segundo": itens / segundos if segundos > 0 else 0.0,
+        "rss_base_mb": base,
+        "rss_pico_mb": _rss_pico_mb()
+    }
+
+def bench_pipeline(tamanhos=TAMANHOS, etapas=ETAPAS, workers: int = 1, corpus_dir: str = None,
+                   parser: str = None) -> list:
+    """
+    Mede cada etapa do pipeline para cada tamanho de corpus. Cada medição roda
+    em um processo novo (spawn), para que o pico de RSS seja só daquela etapa.
+    Corpora em corpus_dir são reaproveitados entre execuções. parser é
+    resolvido aqui (resolve_parser), para que todas as etapas usem o mesmo.
+    """
+    resultados = []
+    contexto = get_context("spawn")
+    parser = resolve_parser(parser)
+    print(f"parser: {parser}")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        pasta = corpus_dir or temp_dir
+        os.makedirs(pasta, exist_ok=True)
+        print("{:>9} {:<22} {:>10} {:>12} {:>10} {:>10}".format(
+            "notas", "etapa", "segundos", "itens/s", "RSS base", "RSS pico"
+        ))
+        for notas in tamanhos:
+            corpus = os.path.join(pasta, f"corpus_{notas}.zip")
+            if not os.path.exists(corpus):
+                gerar_corpus(corpus, notas)
+            for etapa in etapas:
+                with ProcessPoolExecutor(max_workers=1, mp_context=contexto) as executor:
+                    medida = executor.submit(_executar_etapa, etapa, corpus, notas, workers, parser).result()
+                medida.update({"notas": notas, "etapa": etapa, "workers": workers, "parser": parser})
+                resultados.append(medida)
+                print("{:>9} {:<22} {:>10.2f} {:>12.0f} {:>9.0f}M {:>9.0f}M".format(
+                    notas, etapa, medida["segundos"], medida["itens_por_segundo"],
+                    medida["rss_base_mb"], medida["rss_pico_mb"]
+                ))
+    return resultados
+
+def comparar(resultados: list, base: list, tolerancia: float) -> list:
+    """
+    Devolve as medições mais lentas que a base além da tolerância (0.25 = 25%).
+    Só são comparadas medições feitas com o mesmo parser.
+    """
+    referencia = {(m["notas"], m["etapa"], m.get("parser")): m for m in base}
+    regressoes = []
+    for medida in resultados:
+        anterior = referencia.get((medida["notas"], medida["etapa"], medida.get("parser")))
+        if anterior and medida["segundos"] > anterior["segundos"] * (1 + tolerancia):
+            regressoes.append((medida, anterior))
+    return regressoes
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks da análise de NF-e/NFC-e com corpus sintético.")
+    parser.add_argument("--tamanhos", default=",".join(str(t) for t in TAMANHOS),
+                        help="quantidades de notas, separadas por vírgula (ex.: 1000,10000,100000,1000000)")
+    parser.add_argument("--etapas", default=",".join(ETAPAS), help="etapas medidas: " + ",".join(ETAPAS))
+    parser.add_argument("--workers", type=int, default=1, help="processos de parsing em process_xml_files")
+    parser.add_argument("--parser", default=None,
+                        help="backend de parsing (padrão: settings.ini): " + ",".join(EXTRACTORS))
+    parser.add_argument("--corpus-dir", default=None, help="pasta para guardar e reaproveitar os corpora gerados")
+    parser.add_argument("--json", default=None, help="grava as medições neste arquivo")
+    parser.add_argument("--base", default=None, help="JSON de uma execução anterior para comparar")
+    parser.add_argument("--tolerancia", type=float, default=0.25, help="folga aceita contra a base (0.25 = 25%%)")
+    parser.add_argument("--extratores", action="store_true", help="roda só o micro-benchmark dos extratores")
+    parser.add_argument("--memoria", action="store_true", help="roda só o micro-benchmark de memória do relatório")
+    args = parser.parse_args(argv)
+
+    if args.extratores or args.memoria:
+        if args.extratores:
+            bench_extractors()
+        if args.memoria:
+            bench_memoria()
+        return 0
+
+    etapas = [e.strip() for e in args.etapas.split(",") if e.strip()]
+    invalidas = [e for e in etapas if e not in ETAPAS]
+    if invalidas:
+        parser.error(f"etapa inválida: {', '.join(invalidas)}")
+    tamanhos = [int(t) for t in args.tamanhos.split(",") if t.strip()]
+
+    resultados = bench_pipeline(tamanhos, etapas, args.workers, args.corpus_dir, args.parser)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, ensure_ascii=False, indent=2)
+    if args.base:
+        with open(args.base, encoding="utf-8") as f:
+            regressoes = comparar(resultados, json.load(f), args.tolerancia)
+        for medida, anterior in regressoes:
+            print(f"REGRESSÃO: {medida['etapa']} com {medida['notas']} notas: "
+                  f"{anterior['segundos']:.2f}s -> {medida['segundos']:.2f}s")
+        if regressoes:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+import os
+import json
+import sqlite3
+import hashlib
+import logging
+
+# Incrementar quando o formato de detalhes mudar, para descartar o cache antigo
+CACHE_VERSION = 1
+
+DEFAULT_CACHE_FILE = "parse_cache.db"
+DEFAULT_CACHE_MAX_MB = 512
+
+class ParseCache:
+    """
+    Cache em disco (SQLite) dos resultados de extract_note_details.
+
+    A chave de um arquivo solto é caminho + tamanho + mtime (não exige leitura);
+    a de um XML lido de ZIP é o hash do conteúdo. Quando o arquivo passa de
+    max_bytes, as entradas usadas há mais tempo são removidas.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_FILE, max_bytes: int = DEFAULT_CACHE_MAX_MB * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS notas ("
+            "chave TEXT PRIMARY KEY, detalhes TEXT NOT NULL, "
+            "tamanho INTEGER NOT NULL, uso INTEGER NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_notas_uso ON notas (uso)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (nome TEXT PRIMARY KEY, valor TEXT)")
+        row = self.conn.execute("SELECT valor FROM meta WHERE nome = 'versao'").fetchone()
+        if row is None or row[0] != str(CACHE_VERSION):
+            self.conn.execute("DELETE FROM notas")
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('versao', ?)", (str(CACHE_VERSION),))
+        row = self.conn.execute("SELECT MAX(uso), COALESCE(SUM(tamanho), 0) FROM notas").fetchone()
+        # Cada execução recebe um número maior que o anterior, usado na remoção por LRU
+        self.generation = (row[0] or 0) + 1
+        self.total_bytes = row[1]
+        self.conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key_for(xml_file) -> str:
+        """
+        Chave do cache para um item de iter_xml_sources: caminho ou (caminho, conteúdo).
+        Retorna None (arquivo fora do cache) se o arquivo sumiu ou não pode ser lido;
+        o erro fica para o parsing registrar.
+        """
+        if isinstance(xml_file, tuple):
+            return "sha1:" + hashlib.sha1(xml_file[1]).hexdigest()
+        try:
+            st = os.stat(xml_file)
+        except OSError:
+            return None
+        return f"file:{os.path.abspath(xml_file)}|{st.st_size}|{st.st_mtime_ns}"
+
+    def get_many(self, keys: list) -> dict:
+        """
+        Busca várias chaves de uma vez; devolve {chave: detalhes} só das encontradas.
+        """
+        found = {}
+        unique = list(set(keys))
+        for i in range(0, len(unique), 500):
+            batch = unique[i:i + 500]
+            marks = ",".join("?" * len(batch))
+            rows = self.conn.execute(f"SELECT chave, detalhes FROM notas WHERE chave IN ({marks})", batch).fetchall()
+            for chave, detalhes in rows:
+                found[chave] = json.loads(detalhes)
+            if rows:
+                self.conn.execute(
+                    f"UPDATE notas SET uso = ? WHERE chave IN ({marks})", [self.generation] + batch
+                )
+        self.hits += sum(1 for k in keys if k in found)
+        self.misses += sum(1 for k in keys if k not in found)
+        return found
+
+    def put_many(self, entries: list) -> None:
+        """
+        Grava uma lista de (chave, detalhes) e aplica o limite de tamanho.
+        """
+        if not entries:
+            return
+        rows = []
+        for chave, detalhes in entries:
+            data = json.dumps(detalhes, ensure_ascii=False)
+            rows.append((chave, data, len(data), self.generation))
+            self.total_bytes += len(data)
+        self.conn.executemany("INSERT OR REPLACE INTO notas VALUES (?, ?, ?, ?)", rows)
+        if self.total_bytes > self.max_bytes:
+            self._evict()
+        self.conn.commit()
+
+    def _evict(self) -> None:
+        # Remove as entradas menos usadas até ficar em 90% do limite
+        target = int(self.max_bytes * 0.9)
+        removed = 0
+        cursor = self.conn.execute("SELECT chave, tamanho FROM notas ORDER BY uso")
+        to_remove = []
+        for chave, tamanho in cursor:
+            if self.total_bytes - removed <= target:
+                break
+            to_remove.append((chave,))
+            removed += tamanho
+        self.conn.executemany("DELETE FROM notas WHERE chave = ?", to_remove)
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(tamanho), 0) FROM notas").fetchone()[0]
+        logging.info(f"Cache de parsing: {len(to_remove)} entradas removidas por limite de tamanho.")
+
+    def clear(self) -> None:
+        """
+        Invalida o cache inteiro.
+        """
+        self.conn.execute("DELETE FROM notas")
+        self.conn.commit()
+        self.conn.execute("VACUUM")
+        self.total_bytes = 0
+
+    def close(self) -> None:
+        self.conn.commit()
+        self.conn.close()
@@ -0,0 +1,241 @@
+"""
+Análise em lote sem interface gráfica.
+
+Uso:
+    python cli.py ENTRADA [ENTRADA ...] [-o PASTA] [-f csv,xlsx,pdf,txt,db] [-j N] [--metrics] [--profile] [--base [ARQUIVO]] [--juntar NOME]
+
+Cada ENTRADA (ZIP, XML ou diretório) é analisada com analyze_files e exportada
+para PASTA/<nome da entrada>.<formato>. As entradas são processadas em paralelo
+(-j processos). Não importa Qt, então roda em servidores sem display.
+As entradas são conferidas com o histórico de chaves na ordem da linha de
+comando qualquer que seja -j: cada uma grava suas chaves só depois da
+anterior, então as notas repetidas entre entradas aparecem nos mesmos
+relatórios que numa execução serial.
+--metrics grava os tempos por etapa em PASTA/<nome>.metrics.json e --profile
+grava um perfil cProfile da análise em PASTA/<nome>.prof. O formato db
+salva o relatório completo (snapshot.py), que pode ser reaberto na interface.
+--base inclui as notas de cada entrada na base SQLite de warehouse.py (padrão:
+opção warehouse_file do settings.ini), consultável depois pela interface.
+--juntar analisa todas as entradas num único relatório, PASTA/NOME.<formato>,
+com os totais somados e duplicadas procuradas entre as entradas.
+
+Códigos de saída:
+    0 - todas as entradas analisadas sem erros
+    1 - análise concluída, mas algum XML teve erro de leitura
+    2 - argumentos inválidos
+    3 - alguma entrada não pôde ser analisada ou exportada
+"""
+import os
+import sys
+import time
+import argparse
+import logging
+from multiprocessing import Manager
+from concurrent.futures import ProcessPoolExecutor
+
+from processing import analyze_files, load_setting, open_key_history
+from history import CrossArchiveCheck
+from metrics import profiled
+
+EXIT_OK = 0
+EXIT_XML_ERRORS = 1
+EXIT_USAGE = 2
+EXIT_FAILED = 3
+
+FORMATS = ("csv", "xlsx", "pdf", "txt", "db")
+
+def _export(report: dict, output_base: str, formats: list) -> list:
+    # Importado aqui para que só os processos que exportam carreguem reportlab/openpyxl
+    from export import export_to_pdf, export_to_txt, export_to_csv, export_to_excel
+    from snapshot import save_snapshot
+    exporters = {
+        "csv": export_to_csv,
+        "xlsx": export_to_excel,
+        "pdf": export_to_pdf,
+        "txt": export_to_txt,
+        "db": save_snapshot,
+    }
+    outputs = []
+    for fmt in formats:
+        output_file = f"{output_base}.{fmt}"
+        exporters[fmt](report, output_file)
+        outputs.append(output_file)
+    return outputs
+
+class _OrderedHistory:
+    """
+    Histórico de chaves de uma entrada processada em paralelo com outras:
+    confere e grava só depois que previous (Event da entrada anterior) é
+    sinalizado.
+    """
+
+    def __init__(self, history, previous):
+        self.history = history
+        self.previous = previous
+
+    def check(self, origem: str) -> CrossArchiveCheck:
+        return CrossArchiveCheck(self, origem)
+
+    def check_and_record(self, keys_by_origin: dict) -> tuple:
+        if self.previous is not None:
+            self.previous.wait()
+        return self.history.check_and_record(keys_by_origin)
+
+def run_input(input_path, output_base: str, formats: list, workers=None, parser=None,
+              write_metrics: bool = False, profile: bool = False, warehouse_file: str = None,
+              history_turn: tuple = None) -> dict:
+    """
+    Analisa e exporta uma entrada (ou uma lista delas, num único relatório);
+    devolve só o resumo (o relatório fica no processo).
+    history_turn, com -j, é o par de Events (entrada anterior, esta) que
+    ordena a gravação no histórico de chaves; o desta entrada é sinalizado
+    quando a análise termina, ou falha.
+    """
+    start = time.perf_counter()
+    input_paths = [input_path] if isinstance(input_path, str) else list(input_path)
+    summary = {"entrada": input_path if isinstance(input_path, str) else output_base, "ok": False}
+    history = None
+    try:
+        for path in input_paths:
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"Entrada não encontrada: {path}")
+        options = {}
+        if history_turn is not None:
+            history = open_key_history()
+            options["history"] = _OrderedHistory(history, history_turn[0]) if history is not None else False
+        with profiled(f"{output_base}.prof" if profile else ""):
+            report = analyze_files(input_paths, workers=workers, parser=parser, metrics_file="", profile_file="",
+                                   **options)
+        if history_turn is not None:
+            # As entradas seguintes não precisam esperar a exportação desta
+            history_turn[1].set()
+        metrics = report["metrics"]
+        summary.update({
+            "notas": report["resumo"]["total_notas"],
+            "valor_total": report["resumo"]["valor_total"],
+            "erros": len(report["errors"]),
+            "duplicadas": len(report["duplicates"]),
+            "ausentes": len(report.get("missing_keys", [])),
+            "nao_oficiais": len(report.get("unofficial_keys", [])),
+            "outros_arquivos": len(report.get("cross_duplicates", [])),
+        })
+        with metrics.stage("export"):
+            summary["arquivos"] = _export(report, output_base, formats)
+        if warehouse_file:
+            from warehouse import NoteWarehouse
+            with metrics.stage("warehouse"), NoteWarehouse(warehouse_file) as warehouse:
+                # Cada nota traz a entrada de onde veio (NoteRecord.origem)
+                summary["na_base"] = warehouse.ingest(report)[0]
+        if write_metrics:
+            # Tempo total inclui a exportação e a base de notas
+            metrics.finish()
+            metrics.write_json(f"{output_base}.metrics.json")
+        summary["ok"] = True
+    except Exception as e:
+        logging.error(f"Falha ao processar '{input_path}': {e}")
+        summary["falha"] = str(e)
+    finally:
+        if history_turn is not None:
+            history_turn[1].set()
+        if history is not None:
+            history.close()
+    summary["tempo"] = time.perf_counter() - start
+    return summary
+
+def _output_bases(inputs: list, output_dir: str) -> list:
+    # Nome da entrada sem extensão; entradas com o mesmo nome recebem um sufixo
+    bases = []
+    used = {}
+    for input_path in inputs:
+        name = os.path.splitext(os.path.basename(os.path.normpath(input_path)))[0] or "relatorio"
+        count = used.get(name, 0)
+        used[name] = count + 1
+        if count:
+            name = f"{name}_{count + 1}"
+        bases.append(os.path.join(output_dir, name))
+    return bases
+
+def _print_summary(summaries: list) -> None:
+    print("{:<40} {:>8} {:>14} {:>6} {:>6} {:>8} {:>10} {:>10} {:>8}".format(
+        "Entrada", "Notas", "Valor", "Erros", "Dupl.", "Ausentes", "Não ofic.", "Outros arq", "Tempo"
+    ))
+    for s in summaries:
+        name = os.path.basename(os.path.normpath(s["entrada"]))[:40]
+        if s["ok"]:
+            print("{:<40} {:>8} {:>14,.2f} {:>6} {:>6} {:>8} {:>10} {:>10} {:>7.1f}s".format(
+                name, s["notas"], s["valor_total"], s["erros"], s["duplicadas"], s["ausentes"],
+                s["nao_oficiais"], s["outros_arquivos"], s["tempo"]
+            ))
+        else:
+            print(f"{name:<40} FALHA: {s['falha']}")
+    ok = [s for s in summaries if s["ok"]]
+    print(f"Total: {len(summaries)} entradas | {sum(s['notas'] for s in ok)} notas | "
+          f"{sum(s['erros'] for s in ok)} erros | {len(summaries) - len(ok)} falhas")
+    if any("na_base" in s for s in ok):
+        print(f"Notas novas incluídas na base: {sum(s.get('na_base', 0) for s in ok)}")
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Analisa ZIPs/diretórios de NF-e/NFC-e sem interface gráfica.")
+    parser.add_argument("inputs", nargs="+", help="ZIPs, XMLs ou diretórios a analisar")
+    parser.add_argument("-o", "--output-dir", default=".", help="pasta de saída dos relatórios (padrão: atual)")
+    parser.add_argument("-f", "--formats", default="csv", help="formatos separados por vírgula: csv,xlsx,pdf,txt,db")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="entradas processadas ao mesmo tempo")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="processos de parsing por entrada (padrão: settings.ini)")
+    parser.add_argument("--parser", default=None, help="backend de parsing: lxml, iterparse ou etree")
+    parser.add_argument("--metrics", action="store_true", help="grava <nome>.metrics.json com tempos e contadores")
+    parser.add_argument("--profile", action="store_true", help="grava <nome>.prof com o perfil cProfile da análise")
+    parser.add_argument("--base", nargs="?", const="", default=None, metavar="ARQUIVO",
+                        help="inclui as notas na base SQLite (padrão: warehouse_file do settings.ini)")
+    parser.add_argument("--juntar", default=None, metavar="NOME",
+                        help="analisa todas as entradas num único relatório NOME.<formato>")
+    args = parser.parse_args(argv)
+
+    formats = [f.strip().lower() for f in args.formats.split(",") if f.strip()]
+    invalid = [f for f in formats if f not in FORMATS]
+    if invalid:
+        parser.error(f"formato inválido: {', '.join(invalid)}")
+    os.makedirs(args.output_dir, exist_ok=True)
+    warehouse_file = args.base
+    if warehouse_file == "":
+        from warehouse import DEFAULT_WAREHOUSE_FILE
+        warehouse_file = load_setting("warehouse_file", DEFAULT_WAREHOUSE_FILE) or DEFAULT_WAREHOUSE_FILE
+    if warehouse_file:
+        warehouse_file = os.path.abspath(warehouse_file)
+
+    inputs = [os.path.abspath(p) for p in args.inputs]
+    bases = _output_bases(inputs, args.output_dir)
+    if args.juntar:
+        inputs = [inputs]
+        bases = [os.path.join(args.output_dir, args.juntar)]
+    jobs = max(1, min(args.jobs, len(inputs)))
+    if jobs == 1:
+        summaries = [
+            run_input(i, b, formats, args.workers, args.parser, args.metrics, args.profile, warehouse_file)
+            for i, b in zip(inputs, bases)
+        ]
+    else:
+        # O histórico é criado antes dos processos: vários deles passando o
+        # arquivo novo para WAL ao mesmo tempo falham com "database is locked"
+        history = open_key_history()
+        if history is not None:
+            history.close()
+        # O pool começa as entradas na ordem em que foram enviadas, então a
+        # anterior, que uma entrada espera para gravar o histórico, já está em andamento
+        with Manager() as manager, ProcessPoolExecutor(max_workers=jobs) as executor:
+            turns = [manager.Event() for _ in inputs]
+            futures = [
+                executor.submit(run_input, i, b, formats, args.workers, args.parser, args.metrics, args.profile,
+                                warehouse_file, (turns[n - 1] if n else None, turns[n]))
+                for n, (i, b) in enumerate(zip(inputs, bases))
+            ]
+            summaries = [f.result() for f in futures]
+
+    _print_summary(summaries)
+    if any(not s["ok"] for s in summaries):
+        return EXIT_FAILED
+    if any(s["erros"] for s in summaries):
+        return EXIT_XML_ERRORS
+    return EXIT_OK
+
+if __name__ == "__main__":
+    sys.exit(main())
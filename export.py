@@ -1,13 +1,90 @@
+import os
+import csv
 import locale
 import logging
-import pandas as pd
+from itertools import islice
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, Side
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
 from reportlab.lib import colors
 
+from analytics import GROUPINGS, product_aggregates
+from summary import report_summary
+
 locale.setlocale(locale.LC_ALL, '')
 
+# Linhas por tabela na lista de notas do PDF; tabelas menores evitam que o
+# reportlab refaça o layout de uma tabela gigante a cada quebra de página
+PDF_TABLE_CHUNK = 1000
+# Quantos flowables do PDF ficam montados à frente do que já foi desenhado
+PDF_STORY_AHEAD = 200
+
+# Estilos compartilhados por todas as tabelas do PDF
+_SUMMARY_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.darkblue),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (1, 1), (-1, -1), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 9),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
+    ('GRID', (0, 0), (-1, -1), 0.5, colors.grey)
+])
+_NOTES_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.darkblue),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 9),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
+    ('GRID', (0, 0), (-1, -1), 0.5, colors.grey)
+])
+_PRODUCTS_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 8),
+    ('GRID', (0, 0), (-1, -1), 0.5, colors.grey)
+])
+
+class _StreamingDocTemplate(SimpleDocTemplate):
+    """
+    SimpleDocTemplate que consome a história de um gerador: só os próximos
+    PDF_STORY_AHEAD flowables ficam em memória, em vez do relatório inteiro.
+    """
+
+    def __init__(self, filename, story_source, **kw):
+        super().__init__(filename, **kw)
+        self._story_source = story_source
+        self._story = None
+
+    def _fill_story(self) -> None:
+        if len(self._story) < PDF_STORY_AHEAD:
+            self._story.extend(islice(self._story_source, PDF_STORY_AHEAD))
+
+    def build(self, flowables=None, **kw):
+        self._story = flowables if flowables is not None else []
+        self._fill_story()
+        super().build(self._story, **kw)
+
+    def handle_flowable(self, flowables):
+        super().handle_flowable(flowables)
+        # handle_flowable também é chamado para outras listas internas do reportlab
+        if flowables is self._story:
+            self._fill_story()
+
+def _currency(value: float) -> str:
+    """
+    Formata um valor monetário conforme a localidade; sem localidade configurada
+    (ex.: execução em servidor com locale "C"), usa o formato "R$ 1,234.56".
+    """
+    try:
+        return locale.currency(value, grouping=True)
+    except ValueError:
+        return f"R$ {value:,.2f}"
+
 def _determine_header(notas: list) -> str:
     """
     Determina o cabeçalho da primeira coluna conforme o modelo da nota.
@@ -18,24 +95,37 @@ def _determine_header(notas: list) -> str:
         return "Número NF-e" if modelo.upper() == "NFE" else "Número NFC-e"
     return "Número NFC-e"
 
-def export_to_pdf(report: dict, output_file: str) -> None:
+def export_to_pdf(report: dict, output_file: str, progress_dialog=None) -> None:
     """
     Exporta o relatório para PDF contendo:
       - Um resumo com Total de Notas e Notas Transmitidas;
       - Uma tabela principal com os campos:
           Número NF-e/NFC-e, Chave, Valor, Status, Emissão, Autorização;
       - Para cada nota, o detalhamento dos produtos.
+    A história é gerada sob demanda enquanto o documento é montado e a tabela
+    principal é dividida em blocos de PDF_TABLE_CHUNK linhas, então a memória
+    não cresce com o tamanho do relatório. Se progress_dialog for informado,
+    recebe o andamento (0 a 100) via setValue.
     """
-    doc = SimpleDocTemplate(
+    doc = _StreamingDocTemplate(
         output_file,
+        _pdf_story(report, progress_dialog),
         pagesize=A4,
         rightMargin=20,
         leftMargin=20,
         topMargin=20,
         bottomMargin=20
     )
+    doc.build()
+    if progress_dialog:
+        progress_dialog.setValue(100)
+
+def _pdf_story(report: dict, progress_dialog=None):
+    """
+    Gera os flowables do PDF na ordem do documento.
+    """
     styles = getSampleStyleSheet()
-    
+
     title_style = ParagraphStyle(
         'TitleStyle',
         parent=styles["Title"],
@@ -49,86 +139,77 @@ def export_to_pdf(report: dict, output_file: str) -> None:
     )
     normal_style = styles["Normal"]
 
-    story = []
-    
     title = Paragraph("Relatório de NFC-e", title_style)
-    story.append(title)
-    story.append(Spacer(1, 12))
-    
+    yield title
+    yield Spacer(1, 12)
+
     # Totais
     notas = report.get("notas", [])
     total_notas = len(notas)
-    valor_total = sum(n.get("valor", 0) for n in notas)
-    notas_transmitidas = [n for n in notas if (n.get("status") or "").lower() == "autorizada"]
-    total_transmitidas = len(notas_transmitidas)
-    valor_transmitidas = sum(n.get("valor", 0) for n in notas_transmitidas)
-    
+    resumo = report_summary(report)
+    valor_total = resumo["valor_total"]
+    total_transmitidas = resumo["notas_autorizadas"]
+    valor_transmitidas = resumo["valor_autorizadas"]
+
     summary_header = Paragraph("Resumo", heading_style)
-    story.append(summary_header)
-    story.append(Spacer(1, 6))
+    yield summary_header
+    yield Spacer(1, 6)
     summary_data = [
         ["", "Quantidade", "Valor"],
-        ["Total de Notas", total_notas, locale.currency(valor_total or 0, grouping=True)],
-        ["Notas Transmitidas", total_transmitidas, locale.currency(valor_transmitidas or 0, grouping=True)]
+        ["Total de Notas", total_notas, _currency(valor_total or 0)],
+        ["Notas Transmitidas", total_transmitidas, _currency(valor_transmitidas or 0)]
     ]
     summary_table = Table(summary_data, colWidths=[150, 100, 150])
-    summary_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.darkblue),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (1, 1), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 9),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
-        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey)
-    ]))
-    story.append(summary_table)
-    story.append(Spacer(1, 12))
-    
+    summary_table.setStyle(_SUMMARY_TABLE_STYLE)
+    yield summary_table
+    yield Spacer(1, 12)
+
     # Cabeçalho da tabela principal
     num_header = _determine_header(notas)
     main_header = Paragraph("Notas", heading_style)
-    story.append(main_header)
-    story.append(Spacer(1, 6))
+    yield main_header
+    yield Spacer(1, 6)
     table_header = [num_header, "Chave", "Valor", "Status", "Emissão", "Autorização"]
-    table_data = [table_header]
-    for nota in notas:
-        nNF = nota.get("nNF", "N/A")
-        chave = nota.get("chNFe") or "N/A"
-        valor = locale.currency(nota.get("valor") or 0, grouping=True)
-        status = nota.get("status") or ""
-        emissao = nota.get("emitida") or ""
-        autorizacao = nota.get("autorizada") or ""
-        table_data.append([nNF, chave, valor, status, emissao, autorizacao])
-    
-    notes_table = Table(table_data, repeatRows=1, hAlign="CENTER")
-    notes_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.darkblue),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 9),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
-        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey)
-    ]))
-    story.append(notes_table)
-    story.append(Spacer(1, 12))
-    
+    # O andamento conta cada nota duas vezes: na tabela principal e nos produtos
+    progress_total = max(2 * total_notas, 1)
+    for start in range(0, total_notas, PDF_TABLE_CHUNK):
+        table_data = [table_header]
+        for nota in notas[start:start + PDF_TABLE_CHUNK]:
+            nNF = nota.get("nNF", "N/A")
+            chave = nota.get("chNFe") or "N/A"
+            valor = _currency(nota.get("valor") or 0)
+            status = nota.get("status") or ""
+            emissao = nota.get("emitida") or ""
+            autorizacao = nota.get("autorizada") or ""
+            table_data.append([nNF, chave, valor, status, emissao, autorizacao])
+
+        notes_table = Table(table_data, repeatRows=1, hAlign="CENTER")
+        notes_table.setStyle(_NOTES_TABLE_STYLE)
+        yield notes_table
+        if progress_dialog:
+            progress_dialog.setValue(int(min(start + PDF_TABLE_CHUNK, total_notas) / progress_total * 100))
+    if not notas:
+        notes_table = Table([table_header], repeatRows=1, hAlign="CENTER")
+        notes_table.setStyle(_NOTES_TABLE_STYLE)
+        yield notes_table
+    yield Spacer(1, 12)
+
     # Produtos de cada nota
-    for nota in notas:
-        story.append(Spacer(1, 12))
+    prod_header = ["Nome", "Código", "CFOP", "Qtd", "V. Unit", "V. Total"]
+    for i, nota in enumerate(notas):
+        yield Spacer(1, 12)
         nota_header = Paragraph(
             f"Produtos da Nota {nota.get('nNF', 'N/A')} - Chave: {nota.get('chNFe','N/A')}",
             styles["Heading3"]
         )
-        story.append(nota_header)
+        yield nota_header
         produtos = nota.get("produtos", [])
         if produtos:
             prod_data = []
-            prod_header = ["Nome", "Código", "CFOP", "Qtd", "V. Unit", "V. Total"]
             prod_data.append(prod_header)
             for prod in produtos:
-                v_unit = locale.currency(prod.get("valor_unitario") or 0, grouping=True)
-                v_total = locale.currency(prod.get("valor_total") or 0, grouping=True)
+                v_unit = _currency(prod.get("valor_unitario") or 0)
+                v_total = _currency(prod.get("valor_total") or 0)
                 prod_row = [
                     prod.get("nome", "N/A"),
                     prod.get("codigo", "N/A"),
@@ -139,25 +220,20 @@ def export_to_pdf(report: dict, output_file: str) -> None:
                 ]
                 prod_data.append(prod_row)
             prod_table = Table(prod_data, repeatRows=1, hAlign="CENTER")
-            prod_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, -1), 8),
-                ('GRID', (0, 0), (-1, -1), 0.5, colors.grey)
-            ]))
-            story.append(prod_table)
+            prod_table.setStyle(_PRODUCTS_TABLE_STYLE)
+            yield prod_table
         else:
-            story.append(Paragraph("Nenhum produto registrado.", normal_style))
-    
-    doc.build(story)
+            yield Paragraph("Nenhum produto registrado.", normal_style)
+        if progress_dialog and i % 100 == 0:
+            progress_dialog.setValue(int((total_notas + i) / progress_total * 100))
 
-def export_to_txt(report: dict, output_file: str) -> None:
+def export_to_txt(report: dict, output_file: str, progress_dialog=None) -> None:
     """
     Exporta o relatório para um arquivo TXT contendo:
       - Um resumo com Total de Notas e Notas Transmitidas (quantidade e valor);
       - Uma tabela com os campos: Número NF-e/NFC-e, Chave, Valor, Status, Emissão, Autorização;
       - Para cada nota, o detalhamento dos produtos.
+    Se progress_dialog for informado, recebe o andamento (0 a 100) via setValue.
     """
     lines = []
     lines.append("RELATÓRIO DE NFC-e")
@@ -166,14 +242,14 @@ def export_to_txt(report: dict, output_file: str) -> None:
     # Totais
     notas = report.get("notas", [])
     total_notas = len(notas)
-    valor_total = sum(n.get("valor", 0) for n in notas)
-    notas_transmitidas = [n for n in notas if (n.get("status") or "").lower() == "autorizada"]
-    total_transmitidas = len(notas_transmitidas)
-    valor_transmitidas = sum(n.get("valor", 0) for n in notas_transmitidas)
+    resumo = report_summary(report)
+    valor_total = resumo["valor_total"]
+    total_transmitidas = resumo["notas_autorizadas"]
+    valor_transmitidas = resumo["valor_autorizadas"]
     
     lines.append("Resumo:")
-    lines.append(f"  Total de Notas: {total_notas} | Valor Total: {locale.currency(valor_total or 0, grouping=True)}")
-    lines.append(f"  Notas Transmitidas: {total_transmitidas} | Valor Transmitido: {locale.currency(valor_transmitidas or 0, grouping=True)}")
+    lines.append(f"  Total de Notas: {total_notas} | Valor Total: {_currency(valor_total or 0)}")
+    lines.append(f"  Notas Transmitidas: {total_transmitidas} | Valor Transmitido: {_currency(valor_transmitidas or 0)}")
     lines.append("")
     
     if notas:
@@ -188,7 +264,9 @@ def export_to_txt(report: dict, output_file: str) -> None:
     lines.append(header)
     lines.append("-" * len(header))
     
-    for nota in notas:
+    for i, nota in enumerate(notas):
+        if progress_dialog and i % 100 == 0:
+            progress_dialog.setValue(int(i / total_notas * 100))
         nNF = nota.get("nNF", "N/A")
         chave = nota.get("chNFe") or "N/A"
         try:
@@ -231,49 +309,146 @@ def export_to_txt(report: dict, output_file: str) -> None:
     text_report = "\n".join(lines)
     with open(output_file, "w", encoding="utf-8") as f:
         f.write(text_report)
+    if progress_dialog:
+        progress_dialog.setValue(100)
 
-def export_to_csv(report: dict, output_file: str) -> None:
+def _table_header(notas: list, by_product: bool = False) -> list:
+    num_header = _determine_header(notas)
+    if by_product:
+        return [num_header, "Chave", "Emissão", "Status", "Produto", "Código", "CFOP",
+                "Quantidade", "Unidade", "Valor Unitário", "Valor Total"]
+    return [num_header, "Chave", "Valor", "Status", "Emissão", "Autorização"]
+
+def _table_rows(notas: list, by_product: bool = False, fmt=None, progress_dialog=None):
+    """
+    Gera as linhas das exportações tabulares direto das notas, sem montar
+    uma tabela intermediária. fmt é aplicado a cada valor float.
+    Com by_product, gera uma linha por item em vez de uma por nota.
+    progress_dialog recebe o andamento (0 a 100) via setValue.
     """
-    Exporta o relatório para CSV utilizando pandas, com as colunas:
+    if fmt is None:
+        fmt = lambda v: v
+    total_notas = len(notas)
+    for i, nota in enumerate(notas):
+        if progress_dialog and i % 500 == 0:
+            progress_dialog.setValue(int(i / total_notas * 100))
+        if by_product:
+            for prod in nota.get("produtos", []):
+                yield [
+                    nota.get("nNF"),
+                    nota.get("chNFe"),
+                    nota.get("emitida"),
+                    nota.get("status"),
+                    prod.get("nome"),
+                    prod.get("codigo"),
+                    prod.get("cfop"),
+                    prod.get("quantidade"),
+                    prod.get("unidade"),
+                    fmt(prod.get("valor_unitario")),
+                    fmt(prod.get("valor_total"))
+                ]
+        else:
+            yield [
+                nota.get("nNF"),
+                nota.get("chNFe"),
+                fmt(nota.get("valor")),
+                nota.get("status"),
+                nota.get("emitida"),
+                nota.get("autorizada")
+            ]
+
+def export_to_csv(report: dict, output_file: str, by_product: bool = False, progress_dialog=None) -> None:
+    """
+    Exporta o relatório para CSV (separador ";"), gravando linha a linha, com as colunas:
       Número NF-e/NFC-e, Chave, Valor, Status, Emissão, Autorização.
+    Com by_product=True, gera uma linha por produto, com os dados do item.
+    Se progress_dialog for informado, recebe o andamento (0 a 100) via setValue.
     """
     notas = report.get("notas", [])
-    if notas:
-        modelo = notas[0].get("modelo", "NFC-E")
-    else:
-        modelo = "NFC-E"
-    num_header = "Número NF-e" if modelo.upper() == "NFE" else "Número NFC-e"
-    df = pd.DataFrame(notas)
-    df = df.rename(columns={
-        "nNF": num_header,
-        "chNFe": "Chave",
-        "valor": "Valor",
-        "status": "Status",
-        "emitida": "Emissão",
-        "autorizada": "Autorização"
-    })
-    df = df[[num_header, "Chave", "Valor", "Status", "Emissão", "Autorização"]]
-    df.to_csv(output_file, sep=";", index=False, float_format="%.2f", encoding="utf-8")
-
-def export_to_excel(report: dict, output_file: str) -> None:
+
+    def fmt(value):
+        return f"{value:.2f}" if isinstance(value, float) else value
+
+    with open(output_file, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f, delimiter=";", lineterminator=os.linesep)
+        writer.writerow(_table_header(notas, by_product))
+        writer.writerows(_table_rows(notas, by_product, fmt, progress_dialog))
+    if progress_dialog:
+        progress_dialog.setValue(100)
+
+def export_to_excel(report: dict, output_file: str, by_product: bool = False, progress_dialog=None) -> None:
     """
-    Exporta o relatório para Excel utilizando pandas, com as colunas:
+    Exporta o relatório para Excel com uma planilha em modo write-only do openpyxl
+    (as linhas vão direto para o arquivo), com as colunas:
       Número NF-e/NFC-e, Chave, Valor, Status, Emissão, Autorização.
+    Com by_product=True, gera uma linha por produto, com os dados do item.
+    Se progress_dialog for informado, recebe o andamento (0 a 100) via setValue.
     """
     notas = report.get("notas", [])
-    if notas:
-        modelo = notas[0].get("modelo", "NFC-E")
+
+    def fmt(value):
+        return round(value, 2) if isinstance(value, float) else value
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Relatorio")
+    ws.append(_styled_header(ws, _table_header(notas, by_product)))
+    for row in _table_rows(notas, by_product, fmt, progress_dialog):
+        ws.append(row)
+    wb.save(output_file)
+    if progress_dialog:
+        progress_dialog.setValue(100)
+
+def _styled_header(ws, titles: list) -> list:
+    # Cabeçalho em negrito, com borda e centralizado, para planilhas write-only
+    side = Side(style="thin")
+    header_font = Font(bold=True)
+    header_border = Border(left=side, right=side, top=side, bottom=side)
+    header_alignment = Alignment(horizontal="center", vertical="top")
+    header = []
+    for title in titles:
+        cell = WriteOnlyCell(ws, value=title)
+        cell.font = header_font
+        cell.border = header_border
+        cell.alignment = header_alignment
+        header.append(cell)
+    return header
+
+_PRODUCT_SUMMARY_HEADER = ["Chave", "Descrição", "Itens", "Quantidade", "Valor Total"]
+
+def export_product_summary(report: dict, output_file: str, progress_dialog=None) -> None:
+    """
+    Exporta os totais de produtos (analytics.product_aggregates) agrupados por
+    CFOP, código, unidade e data de emissão, do maior para o menor valor.
+    Em .xlsx, cada agrupamento vai para uma planilha; nos demais casos, gera
+    um CSV (separador ";") com a coluna Agrupamento antes das demais.
+    """
+    aggregates = product_aggregates(report)
+    if progress_dialog:
+        progress_dialog.setValue(50)
+    if output_file.lower().endswith(".xlsx"):
+        wb = Workbook(write_only=True)
+        for grouping, title in GROUPINGS.items():
+            ws = wb.create_sheet(title[:31])
+            ws.append(_styled_header(ws, _PRODUCT_SUMMARY_HEADER))
+            for row in aggregates.rows(grouping):
+                ws.append([row["chave"], row["descricao"], row["itens"],
+                           round(row["quantidade"], 4), round(row["valor_total"], 2)])
+        wb.save(output_file)
     else:
-        modelo = "NFC-E"
-    num_header = "Número NF-e" if modelo.upper() == "NFE" else "Número NFC-e"
-    df = pd.DataFrame(notas)
-    df = df.rename(columns={
-        "nNF": num_header,
-        "chNFe": "Chave",
-        "valor": "Valor",
-        "status": "Status",
-        "emitida": "Emissão",
-        "autorizada": "Autorização"
-    })
-    df = df[[num_header, "Chave", "Valor", "Status", "Emissão", "Autorização"]]
-    df.to_excel(output_file, sheet_name="Relatorio", index=False, float_format="%.2f")
+        with open(output_file, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f, delimiter=";", lineterminator=os.linesep)
+            writer.writerow(["Agrupamento"] + _PRODUCT_SUMMARY_HEADER)
+            for grouping, title in GROUPINGS.items():
+                for row in aggregates.rows(grouping):
+                    writer.writerow([title, row["chave"], row["descricao"], row["itens"],
+                                     f"{row['quantidade']:.4f}", f"{row['valor_total']:.2f}"])
+    if progress_dialog:
+        progress_dialog.setValue(100)
+
+def snapshot_report(report: dict) -> dict:
+    """
+    Cópia rasa do relatório para exportar em segundo plano: listas e dicts
+    são copiados (filtros e o monitoramento de pasta podem alterá-los), as
+    notas não, pois não são modificadas depois de lidas.
+    """
+    return {key: value.copy() if isinstance(value, (list, dict)) else value for key, value in report.items()}
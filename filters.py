@@ -0,0 +1,163 @@
+import datetime
+from bisect import bisect_left, bisect_right
+from summary import ReportSummary, report_summary
+
+class NoteIndex:
+    """
+    Índices de um relatório para os filtros da interface, montados uma única vez:
+      - status e CFOP -> conjunto de notas (índices invertidos);
+      - nome de produto distinto -> conjunto de notas;
+      - data de autorização e valor ordenados, consultados por bisect.
+    query() combina os filtros por interseção de conjuntos, começando pelo menor,
+    e devolve as notas na ordem original, com o mesmo resultado do filtro linear
+    que havia em NFCeAnalyzerApp.apply_filters.
+    """
+
+    def __init__(self, notas: list):
+        self.notas = list(notas)
+        self.by_status = {}
+        self.by_cfop = {}
+        self.by_product = {}
+        self.nnf = []
+        self.values = []
+        # None quando a nota não tem data de autorização válida (nunca é filtrada por data)
+        self.dates = []
+
+        parsed_dates = {}
+        dated = []
+        for i, nota in enumerate(self.notas):
+            self.by_status.setdefault((nota.get("status") or "").lower(), set()).add(i)
+            for p in nota.get("produtos", []):
+                self.by_cfop.setdefault((p.get("cfop") or "").lower(), set()).add(i)
+                self.by_product.setdefault((p.get("nome") or "").lower(), set()).add(i)
+            self.nnf.append((nota.get("nNF") or "").lower())
+            self.values.append(nota.get("valor", 0))
+
+            autorizada = nota.get("autorizada")
+            auth_date = None
+            if autorizada:
+                if autorizada not in parsed_dates:
+                    try:
+                        parsed_dates[autorizada] = datetime.datetime.strptime(autorizada, "%Y-%m-%d").date()
+                    except Exception:
+                        parsed_dates[autorizada] = None
+                auth_date = parsed_dates[autorizada]
+            self.dates.append(auth_date)
+            if auth_date is not None:
+                dated.append((auth_date, i))
+
+        dated.sort()
+        self.sorted_dates = [d for d, _ in dated]
+        self.date_ids = [i for _, i in dated]
+        self.undated = {i for i, d in enumerate(self.dates) if d is None}
+
+        by_value = sorted(range(len(self.values)), key=self.values.__getitem__)
+        self.sorted_values = [self.values[i] for i in by_value]
+        self.value_ids = by_value
+
+    def _date_candidates(self, start_date, end_date) -> set:
+        lo = bisect_left(self.sorted_dates, start_date) if start_date else 0
+        hi = bisect_right(self.sorted_dates, end_date) if end_date else len(self.sorted_dates)
+        return set(self.date_ids[lo:hi]) | self.undated
+
+    def _value_candidates(self, min_val, max_val) -> set:
+        lo = bisect_left(self.sorted_values, min_val) if min_val is not None else 0
+        hi = bisect_right(self.sorted_values, max_val) if max_val is not None else len(self.sorted_values)
+        return set(self.value_ids[lo:hi])
+
+    def _product_candidates(self, product: str) -> set:
+        # A busca é por substring, como no filtro original; como os nomes se repetem
+        # muito, basta percorrer os nomes distintos e unir as notas de cada um.
+        found = set()
+        for nome, ids in self.by_product.items():
+            if product in nome:
+                found |= ids
+        return found
+
+    def query(self, **criteria) -> list:
+        """
+        Devolve as notas que atendem a todos os filtros informados (None = sem filtro).
+        status, cfop, nNF e product não diferenciam maiúsculas; datas são datetime.date.
+        """
+        return [self.notas[i] for i in self.query_ids(**criteria)]
+
+    def query_ids(self, status=None, cfop=None, nNF=None, start_date=None, end_date=None,
+                  min_val=None, max_val=None, product=None) -> list:
+        """
+        Como query(), mas devolve as posições das notas em self.notas, em ordem crescente.
+        """
+        sets = []
+        if status:
+            sets.append(self.by_status.get(status.lower(), set()))
+        if cfop:
+            sets.append(self.by_cfop.get(cfop.lower(), set()))
+        if product:
+            sets.append(self._product_candidates(product.lower()))
+
+        has_dates = start_date is not None or end_date is not None
+        has_values = min_val is not None or max_val is not None
+        if sets:
+            sets.sort(key=len)
+            candidates = sets[0].intersection(*sets[1:])
+        elif has_dates:
+            candidates = self._date_candidates(start_date, end_date)
+            has_dates = False
+        elif has_values:
+            candidates = self._value_candidates(min_val, max_val)
+            has_values = False
+        else:
+            candidates = range(len(self.notas))
+
+        # Filtros de faixa restantes são conferidos nota a nota sobre os candidatos
+        if has_dates:
+            dates = self.dates
+            candidates = [
+                i for i in candidates
+                if dates[i] is None
+                or ((start_date is None or start_date <= dates[i]) and (end_date is None or dates[i] <= end_date))
+            ]
+        if has_values:
+            values = self.values
+            candidates = [
+                i for i in candidates
+                if (min_val is None or values[i] >= min_val) and (max_val is None or values[i] <= max_val)
+            ]
+        if nNF:
+            nNF = nNF.lower()
+            nnf = self.nnf
+            candidates = [i for i in candidates if nNF in nnf[i]]
+
+        return sorted(candidates)
+
+def filter_report(report: dict, index: NoteIndex, **criteria) -> dict:
+    """
+    Aplica NoteIndex.query e monta o relatório filtrado, mantendo erros,
+    duplicadas e a conferência com o keys.csv do relatório original.
+    """
+    return subset_report(report, index, index.query_ids(**criteria))
+
+def subset_report(report: dict, index: NoteIndex, ids: list) -> dict:
+    """
+    Relatório com as notas de index.notas nas posições ids (ver NoteIndex.query_ids).
+    """
+    # Sem filtro efetivo, os totais do relatório original continuam valendo
+    if len(ids) == len(index.notas) == len(report.get("notas", [])):
+        filtered_notas = list(index.notas)
+        filtered_resumo = report_summary(report)
+    else:
+        filtered_notas = []
+        summary = ReportSummary()
+        for i in ids:
+            nota = index.notas[i]
+            filtered_notas.append(nota)
+            summary.add(nota)
+        filtered_resumo = summary.to_dict()
+    return {
+        "resumo": filtered_resumo,
+        "notas": filtered_notas,
+        "errors": report.get("errors", []),
+        "duplicates": report.get("duplicates", []),
+        "missing_keys": report.get("missing_keys", []),
+        "unofficial_keys": report.get("unofficial_keys", []),
+        "cross_duplicates": report.get("cross_duplicates", [])
+    }
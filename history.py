@@ -0,0 +1,214 @@
+import sqlite3
+import logging
+from contextlib import contextmanager
+
+from official import _key_hash
+
+DEFAULT_HISTORY_FILE = "chaves_vistas.db"
+
+# Incrementar quando o formato do arquivo mudar
+HISTORY_VERSION = 1
+
+# Filtro de Bloom: ~1% de falsos positivos com 10 bits e 7 funções por chave
+BLOOM_BITS_PER_KEY = 10
+BLOOM_HASHES = 7
+BLOOM_MIN_KEYS = 1 << 20
+
+def _signed(h: int) -> int:
+    # INTEGER do SQLite é de 64 bits com sinal
+    return h - (1 << 64) if h >= 1 << 63 else h
+
+class KeyHistory:
+    """
+    Chaves (nNF, cNF, cnpj) de todas as análises anteriores, com o arquivo em
+    que cada uma apareceu primeiro, para detectar notas repetidas entre ZIPs
+    analisados em momentos diferentes.
+
+    As chaves ficam numa tabela SQLite indexada pelo hash de 64 bits da chave
+    (o mesmo de OfficialKeyIndex), consultada por ponto. Na frente dela há um
+    filtro de Bloom em memória (BLOOM_BITS_PER_KEY bits por chave): a maioria
+    das chaves novas é descartada sem acessar o disco, e um positivo do filtro
+    é sempre conferido com a chave completa gravada na tabela. O filtro é
+    salvo junto com as chaves e refeito com o dobro da capacidade quando fica cheio.
+
+    Vários processos podem usar o mesmo arquivo (cli -j): cada gravação é uma
+    transação exclusiva que antes recarrega o filtro se outro processo gravou
+    chaves desde a abertura.
+    """
+
+    def __init__(self, path: str = DEFAULT_HISTORY_FILE, timeout: float = 60.0):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=timeout)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS chaves ("
+            "hash INTEGER PRIMARY KEY, nNF TEXT, cNF TEXT, cnpj TEXT, origem TEXT)"
+        )
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (nome TEXT PRIMARY KEY, valor)")
+        self.conn.commit()
+        self._load()
+
+    def _load(self) -> None:
+        meta = dict(self.conn.execute("SELECT nome, valor FROM meta"))
+        self.count = self.conn.execute("SELECT COUNT(*) FROM chaves").fetchone()[0]
+        bloom = meta.get("bloom")
+        if meta.get("versao") != HISTORY_VERSION or meta.get("chaves") != self.count or bloom is None:
+            self._rebuild_bloom(max(BLOOM_MIN_KEYS, 2 * self.count))
+        else:
+            self.capacity = meta["capacidade"]
+            self.bits = bytearray(bloom)
+            self.nbits = len(self.bits) * 8
+
+    @contextmanager
+    def _write(self):
+        # BEGIN IMMEDIATE espera as gravações de outros processos e bloqueia as
+        # seguintes até o commit; meta["chaves"] é gravado na mesma transação
+        # que as chaves, então difere de count só se outro processo gravou
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.conn.execute("SELECT valor FROM meta WHERE nome = 'chaves'").fetchone()
+            if row is not None and row[0] != self.count:
+                self._load()
+            yield
+            self.conn.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", [
+                ("versao", HISTORY_VERSION), ("chaves", self.count),
+                ("capacidade", self.capacity), ("bloom", bytes(self.bits))
+            ])
+            self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            self._load()
+            raise
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    # Posições do filtro por hash duplo: h1 + i * h2, com h1 e h2 tirados do hash de 64 bits.
+    # Os laços ficam em linha por serem executados uma vez por nota.
+    def _bloom_add_many(self, hashes) -> None:
+        bits = self.bits
+        nbits = self.nbits
+        for h in hashes:
+            pos = (h & 0xFFFFFFFF) % nbits
+            step = (h >> 32) | 1
+            for _ in range(BLOOM_HASHES):
+                bits[pos >> 3] |= 1 << (pos & 7)
+                pos = (pos + step) % nbits
+
+    def _bloom_contains(self, h: int) -> bool:
+        bits = self.bits
+        nbits = self.nbits
+        pos = (h & 0xFFFFFFFF) % nbits
+        step = (h >> 32) | 1
+        for _ in range(BLOOM_HASHES):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+            pos = (pos + step) % nbits
+        return True
+
+    def _rebuild_bloom(self, capacity: int) -> None:
+        self.capacity = capacity
+        self.bits = bytearray((capacity * BLOOM_BITS_PER_KEY + 7) // 8)
+        self.nbits = len(self.bits) * 8
+        mask = (1 << 64) - 1
+        self._bloom_add_many(h & mask for (h,) in self.conn.execute("SELECT hash FROM chaves"))
+        logging.info(f"Histórico de chaves '{self.path}': filtro refeito para {capacity} chaves ({self.count} gravadas).")
+
+    def lookup(self, key: tuple):
+        """
+        Arquivo em que a chave foi vista pela primeira vez, ou None se ela é nova.
+        """
+        h = _key_hash(*key)
+        if not self._bloom_contains(h):
+            return None
+        row = self.conn.execute(
+            "SELECT nNF, cNF, cnpj, origem FROM chaves WHERE hash = ?", (_signed(h),)
+        ).fetchone()
+        if row is None or tuple(row[:3]) != tuple(key):
+            return None
+        return row[3]
+
+    def _insert(self, keys: list, origem: str) -> int:
+        hashes = [_key_hash(*key) for key in keys]
+        self._bloom_add_many(hashes)
+        rows = [(_signed(h), key[0], key[1], key[2], origem) for h, key in zip(hashes, keys)]
+        # Em ordem de hash, a inserção percorre a tabela em sequência em vez de saltar entre páginas
+        rows.sort()
+        before = self.conn.total_changes
+        self.conn.executemany("INSERT OR IGNORE INTO chaves VALUES (?, ?, ?, ?, ?)", rows)
+        added = self.conn.total_changes - before
+        self.count += added
+        if self.count > self.capacity:
+            self._rebuild_bloom(2 * self.count)
+        return added
+
+    def record(self, keys: list, origem: str) -> int:
+        """
+        Grava as chaves ainda não vistas, associadas a origem; devolve quantas eram novas.
+        """
+        with self._write():
+            return self._insert(keys, origem)
+
+    def check_and_record(self, keys_by_origin: dict) -> tuple:
+        """
+        Confere e grava, numa única transação, as chaves de cada origem
+        ({origem: [chaves]}); devolve ([(chave, arquivo anterior)], quantas eram novas).
+        Com a transação exclusiva, análises simultâneas não deixam de ver as
+        chaves uma da outra: a que grava depois acusa as repetidas.
+        """
+        duplicates = []
+        added = 0
+        with self._write():
+            lookup = self.lookup
+            for origem, keys in keys_by_origin.items():
+                for key in keys:
+                    previous = lookup(key)
+                    if previous is not None and previous != origem:
+                        duplicates.append((key, previous))
+                added += self._insert(keys, origem)
+        return duplicates, added
+
+    def check(self, origem: str) -> "CrossArchiveCheck":
+        return CrossArchiveCheck(self, origem)
+
+class CrossArchiveCheck:
+    """
+    Conferência das notas de uma análise com o histórico: add() recebe cada
+    chave distinta durante o parsing, como na Reconciliation, e commit()
+    confere e grava todas de uma vez (KeyHistory.check_and_record), deixando
+    em duplicates (chave, arquivo anterior) das que já apareceram em outro
+    arquivo. Conferir só no commit, dentro da transação, faz o resultado não
+    depender de outras análises do mesmo histórico rodarem ao mesmo tempo
+    (cli -j). Reanalisar o mesmo arquivo não gera duplicadas. Numa análise de
+    várias entradas, add() recebe também a entrada de cada chave; sem ela,
+    vale a origem informada ao criar a conferência.
+    """
+
+    def __init__(self, history: KeyHistory, origem: str):
+        self.history = history
+        self.origem = origem
+        # origem -> chaves vistas nela
+        self.keys = {}
+        self.duplicates = []
+
+    def add(self, key: tuple, origem: str = None) -> None:
+        origem = origem or self.origem
+        keys = self.keys.get(origem)
+        if keys is None:
+            keys = self.keys[origem] = []
+        keys.append(key)
+
+    def commit(self) -> int:
+        duplicates, added = self.history.check_and_record(self.keys)
+        self.duplicates.extend(duplicates)
+        self.keys = {}
+        return added
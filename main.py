@@ -1,14 +1,15 @@
 import sys
+import multiprocessing
 from PyQt6.QtWidgets import QApplication
 from PyQt6.QtGui import QIcon
 
-# Crie o QApplication antes de importar módulos que usam qtawesome!
-app = QApplication(sys.argv)
+def main() -> None:
+    # Crie o QApplication antes de importar módulos que usam qtawesome!
+    app = QApplication(sys.argv)
 
-import qtawesome as qta  # Agora é seguro usar qtawesome
-from ui import NFCeAnalyzerApp
+    import qtawesome as qta  # Agora é seguro usar qtawesome
+    from ui import NFCeAnalyzerApp
 
-def main() -> None:
     # Cria um QIcon a partir do pixmap do ícone retornado pelo qtawesome
     icon = QIcon(qta.icon('fa.file-o').pixmap(64, 64))
     app.setWindowIcon(icon)
@@ -19,4 +20,7 @@ def main() -> None:
     sys.exit(app.exec())
 
 if __name__ == "__main__":
+    # Necessário para o pool de processos do parsing no executável congelado
+    # (os processos filhos reimportam este módulo e não devem abrir a janela).
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file
@@ -0,0 +1,157 @@
+import os
+import time
+import json
+import heapq
+import pstats
+import cProfile
+import logging
+import threading
+from array import array
+from contextlib import contextmanager
+
+SLOWEST_FILES = 10
+PERCENTILES = (50, 90, 95, 99)
+
+class AnalysisMetrics:
+    """
+    Tempos e contadores de uma análise, preenchidos por analyze_file e
+    process_xml_files e guardados em report["metrics"].
+
+    stages acumula o tempo (s) de cada etapa: count (listar os XMLs),
+    extract (ler do disco/ZIP), parse (restante do laço de leitura),
+    reconcile (conferir keys.csv) e export. As etapas podem se sobrepor (no
+    pipeline assíncrono, extract corre junto com parse), então a soma delas
+    (stages_seconds) pode passar do tempo real da análise, que é medido à
+    parte: total_seconds vai da criação até finish(). A latência de parsing é
+    medida por arquivo, dentro do processo que fez o parsing; arquivos vindos
+    do cache de parsing entram só em cache_hits. add_time (e stage,
+    timed_iter) pode ser chamado de várias threads ao mesmo tempo, como as de
+    leitura do pipeline assíncrono.
+    """
+
+    def __init__(self, slowest: int = SLOWEST_FILES):
+        self.stages = {}
+        self.counters = {"files": 0, "bytes": 0, "notes": 0, "products": 0, "errors": 0, "cache_hits": 0}
+        self.latencies = array("d")
+        self.slowest_n = slowest
+        self._slowest = []
+        self.started = time.time()
+        self._wall_start = time.perf_counter()
+        self.wall_seconds = None
+        self._lock = threading.Lock()
+
+    def finish(self) -> None:
+        """
+        Marca o fim da análise (ou da exportação, se chamado de novo) para total_seconds.
+        """
+        self.wall_seconds = time.perf_counter() - self._wall_start
+
+    def add_time(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def timed_iter(self, stage: str, items):
+        """
+        Repassa os itens de um iterável, somando em stage o tempo gasto para obtê-los.
+        """
+        items = iter(items)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(items)
+            except StopIteration:
+                self.add_time(stage, time.perf_counter() - start)
+                return
+            self.add_time(stage, time.perf_counter() - start)
+            yield item
+
+    def record_file(self, xml_file, seconds=None) -> None:
+        """
+        Registra um XML processado; xml_file é um item de iter_xml_sources.
+        seconds é None quando o resultado veio do cache.
+        """
+        self.counters["files"] += 1
+        if isinstance(xml_file, tuple):
+            name, size = xml_file[0], len(xml_file[1])
+        else:
+            name = xml_file
+            try:
+                size = os.path.getsize(xml_file)
+            except OSError:
+                size = 0
+        self.counters["bytes"] += size
+        if seconds is None:
+            self.counters["cache_hits"] += 1
+            return
+        self.latencies.append(seconds)
+        entry = (seconds, name)
+        if len(self._slowest) < self.slowest_n:
+            heapq.heappush(self._slowest, entry)
+        elif entry > self._slowest[0]:
+            heapq.heapreplace(self._slowest, entry)
+
+    def percentiles(self) -> dict:
+        if not self.latencies:
+            return {}
+        ordered = sorted(self.latencies)
+        last = len(ordered) - 1
+        return {f"p{p}": ordered[min(last, int(round(p / 100 * last)))] for p in PERCENTILES}
+
+    def slowest(self) -> list:
+        return [{"arquivo": name, "segundos": seconds} for seconds, name in sorted(self._slowest, reverse=True)]
+
+    def to_dict(self) -> dict:
+        wall = self.wall_seconds if self.wall_seconds is not None else time.perf_counter() - self._wall_start
+        with self._lock:
+            stages = dict(self.stages)
+        parse_time = stages.get("parse", 0.0) + stages.get("extract", 0.0)
+        return {
+            "inicio": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started)),
+            "stages": stages,
+            "total_seconds": wall,
+            "stages_seconds": sum(stages.values()),
+            "counters": dict(self.counters),
+            "files_per_second": self.counters["files"] / parse_time if parse_time > 0 else 0.0,
+            "parse_latency": self.percentiles(),
+            "slowest_files": self.slowest()
+        }
+
+    def write_json(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+
+    def log_summary(self) -> None:
+        data = self.to_dict()
+        stages = " | ".join(f"{name}: {seconds:.2f}s" for name, seconds in data["stages"].items())
+        latency = " | ".join(f"{name}: {seconds * 1000:.1f}ms" for name, seconds in data["parse_latency"].items())
+        logging.info(f"Tempos por etapa: {stages} | Tempo total: {data['total_seconds']:.2f}s")
+        logging.info(f"Arquivos: {data['counters']['files']} ({data['counters']['bytes']} bytes) | "
+                     f"{data['files_per_second']:.0f} arq/s | Latência de parsing: {latency}")
+
+@contextmanager
+def profiled(path: str = None):
+    """
+    Executa o bloco sob cProfile e grava as estatísticas em path (formato pstats);
+    sem path, não faz nada. Só o processo atual é perfilado: com workers > 1,
+    o parsing nos processos do pool aparece apenas como espera.
+    """
+    if not path:
+        yield None
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        stats = pstats.Stats(profiler)
+        logging.info(f"Perfil gravado em '{path}' ({stats.total_tt:.2f}s em {stats.total_calls} chamadas).")
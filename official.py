@@ -0,0 +1,267 @@
+import os
+import mmap
+import struct
+import logging
+from array import array
+from bisect import bisect_left
+from collections.abc import Sequence
+from hashlib import blake2b
+
+OFFICIAL_KEYS_FILE = "keys.csv"
+
+# Cabeçalho do índice: marca, versão, tamanho e mtime do keys.csv, quantidade de chaves
+_INDEX_HEADER = struct.Struct("<4sIqqq")
+_INDEX_MAGIC = b"XSKI"
+_INDEX_VERSION = 1
+
+def _key_hash(nNF: str, cNF: str, cnpj: str) -> int:
+    data = f"{nNF}\x1f{cNF}\x1f{cnpj}".encode("utf-8")
+    return int.from_bytes(blake2b(data, digest_size=8).digest(), "little")
+
+def _parse_line(line: bytes):
+    """
+    Devolve (nNF, cNF, cnpj) de uma linha do keys.csv, ou None se ela for ignorada
+    (mesmas regras do leitor original: vazia, sem vírgula ou com menos de 3 campos).
+    """
+    line = line.decode("utf-8").strip()
+    if not line or "," not in line:
+        return None
+    parts = line.split(",")
+    if len(parts) < 3:
+        return None
+    return parts[0].strip(), parts[1].strip(), parts[2].strip()
+
+class OfficialKeyIndex:
+    """
+    Índice compacto das chaves (nNF, cNF, cnpj) do keys.csv.
+
+    Guarda só um hash de 64 bits por chave (ordenado, consultado por bisect) e
+    o deslocamento da linha no arquivo: 16 bytes por chave, em vez de uma tupla
+    de strings. As chaves completas são lidas do keys.csv apenas quando
+    precisam ser listadas (chaves ausentes). O índice é gravado em
+    <keys.csv>.idx e mantido em memória; ambos são refeitos quando o tamanho
+    ou o mtime do keys.csv mudam.
+    """
+
+    _loaded = {}
+
+    def __init__(self, path: str, size: int, mtime_ns: int, hashes: array, offsets: array):
+        self.path = path
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.hashes = hashes
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def position(self, key: tuple) -> int:
+        """
+        Posição da chave no índice, ou -1 se ela não for oficial.
+        """
+        h = _key_hash(*key)
+        i = bisect_left(self.hashes, h)
+        if i < len(self.hashes) and self.hashes[i] == h:
+            return i
+        return -1
+
+    def __contains__(self, key: tuple) -> bool:
+        return self.position(key) >= 0
+
+    def keys_at(self, positions) -> list:
+        """
+        Lê do keys.csv as chaves das posições informadas, em ordem de arquivo.
+        Poucas chaves são lidas por deslocamento; muitas, numa leitura sequencial.
+        """
+        offsets = sorted(self.offsets[i] for i in positions)
+        if not offsets:
+            return []
+        keys = []
+        if len(offsets) > len(self) // 4:
+            wanted = iter(offsets)
+            next_offset = next(wanted)
+            offset = 0
+            with open(self.path, "rb") as f:
+                for line in f:
+                    if offset == next_offset:
+                        keys.append(_parse_line(line))
+                        next_offset = next(wanted, None)
+                        if next_offset is None:
+                            break
+                    offset += len(line)
+            return keys
+        with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for offset in offsets:
+                end = mm.find(b"\n", offset)
+                keys.append(_parse_line(mm[offset:end if end >= 0 else len(mm)]))
+        return keys
+
+    @classmethod
+    def build(cls, path: str, size: int, mtime_ns: int) -> "OfficialKeyIndex":
+        # Mesmas regras de _parse_line, repetidas aqui por ser o laço mais pesado
+        # (milhões de linhas). Hash e deslocamento vão num único int para ordenar.
+        packed = []
+        append = packed.append
+        offset = 0
+        with open(path, "rb") as f:
+            for raw in f:
+                line = raw.decode("utf-8")
+                if "," in line:
+                    parts = line.split(",")
+                    if len(parts) >= 3:
+                        data = f"{parts[0].strip()}\x1f{parts[1].strip()}\x1f{parts[2].strip()}".encode("utf-8")
+                        append(int.from_bytes(blake2b(data, digest_size=8).digest(), "little") << 64 | offset)
+                offset += len(raw)
+        packed.sort()
+        hashes = array("Q")
+        offsets = array("Q")
+        mask = (1 << 64) - 1
+        last = None
+        for value in packed:
+            h = value >> 64
+            # Linhas repetidas contam uma vez só, como no set de antes
+            if h != last:
+                hashes.append(h)
+                offsets.append(value & mask)
+                last = h
+        return cls(path, size, mtime_ns, hashes, offsets)
+
+    def save(self, index_path: str) -> None:
+        with open(index_path, "wb") as f:
+            f.write(_INDEX_HEADER.pack(_INDEX_MAGIC, _INDEX_VERSION, self.size, self.mtime_ns, len(self)))
+            self.hashes.tofile(f)
+            self.offsets.tofile(f)
+
+    @classmethod
+    def read(cls, path: str, index_path: str, size: int, mtime_ns: int):
+        """
+        Carrega <keys.csv>.idx se ele corresponder ao keys.csv atual; senão devolve None.
+        """
+        try:
+            with open(index_path, "rb") as f:
+                magic, version, idx_size, idx_mtime, count = _INDEX_HEADER.unpack(f.read(_INDEX_HEADER.size))
+                if (magic, version, idx_size, idx_mtime) != (_INDEX_MAGIC, _INDEX_VERSION, size, mtime_ns):
+                    return None
+                hashes = array("Q")
+                offsets = array("Q")
+                hashes.fromfile(f, count)
+                offsets.fromfile(f, count)
+        except (OSError, struct.error, EOFError):
+            return None
+        return cls(path, size, mtime_ns, hashes, offsets)
+
+    @classmethod
+    def load(cls, path: str = OFFICIAL_KEYS_FILE):
+        """
+        Devolve o índice do keys.csv (None se o arquivo não existir), reaproveitando
+        o que já estiver em memória ou em disco enquanto o arquivo não mudar.
+        """
+        path = os.path.abspath(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            cls._loaded.pop(path, None)
+            return None
+        index = cls._loaded.get(path)
+        if index is not None and (index.size, index.mtime_ns) == (st.st_size, st.st_mtime_ns):
+            return index
+
+        index_path = path + ".idx"
+        index = cls.read(path, index_path, st.st_size, st.st_mtime_ns)
+        if index is None:
+            index = cls.build(path, st.st_size, st.st_mtime_ns)
+            try:
+                index.save(index_path)
+            except OSError as e:
+                logging.warning(f"Não foi possível gravar o índice de chaves '{index_path}': {e}")
+            logging.info(f"Índice de chaves oficiais montado: {len(index)} chaves.")
+        cls._loaded[path] = index
+        return index
+
+class Reconciliation:
+    """
+    Conferência das notas lidas com o keys.csv, feita durante o parsing:
+    add() é chamado para cada nota e marca a chave como encontrada.
+    missing_keys() lista as chaves oficiais que não apareceram e
+    unofficial_keys as notas lidas que não constam no keys.csv.
+    Sem keys.csv (index None) não há conferência e ambas as listas ficam vazias.
+    """
+
+    def __init__(self, index: OfficialKeyIndex = None):
+        self.index = index
+        self.found = bytearray(len(index)) if index is not None else bytearray()
+        self.unofficial_keys = []
+
+    @property
+    def active(self) -> bool:
+        return self.index is not None and len(self.index) > 0
+
+    def add(self, key: tuple) -> bool:
+        """
+        Registra a chave de uma nota lida; devolve True se ela for oficial.
+        """
+        if not self.active:
+            return True
+        pos = self.index.position(key)
+        if pos < 0:
+            self.unofficial_keys.append(key)
+            return False
+        self.found[pos] = 1
+        return True
+
+    def missing_keys(self):
+        """
+        Chaves oficiais ainda não encontradas, como MissingKeys (lista preguiçosa).
+        """
+        if not self.active:
+            return []
+        return MissingKeys(self.index, bytes(self.found))
+
+class MissingKeys(Sequence):
+    """
+    Lista somente leitura das chaves oficiais não encontradas.
+
+    len() é imediato; as chaves só são lidas do keys.csv no primeiro acesso,
+    o que evita ler milhões de linhas quando só a contagem é usada (como na
+    linha de comando). Se o keys.csv mudar antes disso, a lista fica vazia e
+    um aviso vai para o log.
+    """
+
+    def __init__(self, index: OfficialKeyIndex, found: bytes):
+        self.index = index
+        self.found = found
+        self._count = found.count(0)
+        self._keys = None
+
+    def _load(self) -> list:
+        if self._keys is None:
+            try:
+                st = os.stat(self.index.path)
+                changed = (st.st_size, st.st_mtime_ns) != (self.index.size, self.index.mtime_ns)
+            except OSError:
+                changed = True
+            if changed:
+                logging.warning(f"'{self.index.path}' mudou desde a análise; chaves ausentes não listadas.")
+                self._keys = []
+                self._count = 0
+            else:
+                positions = []
+                found = self.found
+                pos = found.find(0)
+                while pos >= 0:
+                    positions.append(pos)
+                    pos = found.find(0, pos + 1)
+                self._keys = self.index.keys_at(positions)
+        return self._keys
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        return self._load()[i]
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __repr__(self):
+        return f"MissingKeys({self._count} chaves)"
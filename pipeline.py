@@ -0,0 +1,222 @@
+import time
+import asyncio
+import logging
+from itertools import islice
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+from metrics import AnalysisMetrics
+from processing import (
+    DEFAULT_CHUNKSIZE, SINK_BATCH, ReportBuilder, resolve_workers, resolve_parser,
+    open_parse_cache, _dispatch_chunk, _collect_chunk
+)
+
+# Lotes aguardando entre a leitura e o parsing e entre a montagem do relatório
+# e o sink; entre o parsing e a montagem ficam até 2 lotes por worker
+QUEUE_SIZE = 4
+
+# Entradas lidas ao mesmo tempo numa análise de várias entradas: a atual e as
+# seguintes, cada uma com sua fila de QUEUE_SIZE lotes
+READ_AHEAD_INPUTS = 2
+
+class IngestionPipeline:
+    """
+    Análise em etapas concorrentes ligadas por filas limitadas (asyncio.Queue):
+
+    - leitura: percorre os XMLs (iter_xml_sources) numa thread, em lotes de
+      chunksize; com várias entradas, até READ_AHEAD_INPUTS são lidas ao mesmo
+      tempo, cada uma em sua thread e sua fila;
+    - parsing: consulta o cache e envia os lotes aos processos do pool
+      (com um worker, a uma thread), sem esperar o resultado;
+    - montagem: recebe os resultados na ordem dos arquivos e monta o relatório
+      com ReportBuilder (duplicadas, keys.csv, histórico, resumo);
+    - sink: entrega as notas, em listas de até SINK_BATCH, a uma função
+      chamada numa thread própria (ex.: a tabela da interface ou
+      NoteWarehouse.ingest).
+
+    Quando uma etapa está mais lenta, as filas cheias fazem as anteriores
+    esperarem, então os arquivos lidos e ainda não processados ocupam memória
+    limitada qualquer que seja o tamanho da entrada. Com keep_notes=False as
+    notas vão só para o sink e report["notas"] fica vazio; o que cresce com a
+    entrada passa a ser apenas o conjunto de chaves usado para achar duplicadas.
+    O relatório é o mesmo de process_xml_files: as notas ficam na ordem das
+    entradas e dos arquivos, cada uma com a sua origem (NoteRecord.origem),
+    e as duplicadas são procuradas entre todas as entradas.
+    """
+
+    def __init__(self, workers=None, chunksize: int = DEFAULT_CHUNKSIZE, parser=None, cache=None,
+                 progress=None, progress_dialog=None, total=None, metrics=None, reconciliation=None,
+                 history_check=None, sink=None, keep_notes: bool = True, queue_size: int = QUEUE_SIZE):
+        self.workers = resolve_workers(workers)
+        self.chunksize = chunksize
+        self.parser = resolve_parser(parser)
+        self.cache = cache
+        self.progress = progress
+        self.progress_dialog = progress_dialog
+        self.total = total
+        self.metrics = metrics if metrics is not None else AnalysisMetrics()
+        self.builder = ReportBuilder(reconciliation, history_check, keep_notes)
+        self.sink = sink
+        self.queue_size = queue_size
+        self._upstream = []
+
+    async def _read(self, sources, reader, out: asyncio.Queue) -> None:
+        loop = asyncio.get_running_loop()
+        items = iter(sources)
+        chunksize = self.chunksize
+        try:
+            while True:
+                chunk = await loop.run_in_executor(reader, lambda: list(islice(items, chunksize)))
+                if not chunk:
+                    break
+                await out.put(chunk)
+        except Exception as e:
+            # Repassado pela fila: _parse, que espera por ela, levanta o erro
+            await out.put(e)
+            return
+        await out.put(None)
+
+    async def _parse(self, inputs: list, reader, executor, cache, out: asyncio.Queue) -> None:
+        queues = {}
+
+        def start_reading(i: int) -> None:
+            queue = queues[i] = asyncio.Queue(self.queue_size)
+            self._upstream.append(asyncio.create_task(self._read(inputs[i][1], reader, queue)))
+
+        for i, (origem, _) in enumerate(inputs):
+            for ahead in range(i, min(i + READ_AHEAD_INPUTS, len(inputs))):
+                if ahead not in queues:
+                    start_reading(ahead)
+            inp = queues.pop(i)
+            while True:
+                chunk = await inp.get()
+                if chunk is None:
+                    break
+                if isinstance(chunk, Exception):
+                    raise chunk
+                chunk, keys, cached, results = _dispatch_chunk(chunk, self.parser, executor, cache, True)
+                if isinstance(results, Future):
+                    results = asyncio.wrap_future(results)
+                await out.put((origem, chunk, keys, cached, results))
+        await out.put(None)
+
+    async def _build(self, cache, inp: asyncio.Queue, out) -> None:
+        builder = self.builder
+        progress = self.progress
+        progress_dialog = self.progress_dialog
+        total = self.total
+        batch = []
+        while True:
+            item = await inp.get()
+            if item is None:
+                break
+            origem, chunk, keys, cached, results = item
+            if isinstance(results, asyncio.Future):
+                results = await results
+            for nota_details, error in _collect_chunk(chunk, keys, cached, results, cache, self.metrics):
+                nota = builder.add(nota_details, error, origem)
+                if out is not None and nota is not None:
+                    batch.append(nota)
+                    if len(batch) >= SINK_BATCH:
+                        await out.put(batch)
+                        batch = []
+            if progress is not None:
+                progress.update(builder.files)
+            if progress_dialog and total:
+                progress_dialog.setValue(int(builder.files / total * 100))
+                if progress_dialog.wasCanceled():
+                    # Como em process_xml_files: para a leitura e fica com o que já foi processado
+                    for task in self._upstream:
+                        task.cancel()
+                    break
+        if out is not None:
+            if batch:
+                await out.put(batch)
+            await out.put(None)
+
+    async def _drain(self, writer, inp: asyncio.Queue) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await inp.get()
+            if batch is None:
+                break
+            await loop.run_in_executor(writer, self.sink, batch)
+
+    async def run(self, xml_files, origem: str = None) -> dict:
+        """
+        Processa os XMLs (lista ou gerador, ver iter_xml_sources) e devolve o relatório.
+        """
+        return await self.run_inputs([(origem, xml_files)])
+
+    async def run_inputs(self, inputs: list) -> dict:
+        """
+        Processa várias entradas, [(origem, XMLs)], num único relatório.
+        """
+        metrics = self.metrics
+        own_cache = self.cache is None
+        cache = open_parse_cache() if own_cache else self.cache
+        if self.progress is not None:
+            self.progress.set_phase("parse", self.total or 0)
+
+        if self.workers > 1:
+            executor = ProcessPoolExecutor(max_workers=self.workers)
+        else:
+            executor = ThreadPoolExecutor(max_workers=1)
+        reader = ThreadPoolExecutor(max_workers=min(len(inputs), READ_AHEAD_INPUTS) or 1)
+        writer = ThreadPoolExecutor(max_workers=1) if self.sink is not None else None
+        parsed = asyncio.Queue(2 * self.workers)
+        notes = asyncio.Queue(self.queue_size) if writer is not None else None
+
+        start = time.perf_counter()
+        inputs = [(origem, metrics.timed_iter("extract", xml_files)) for origem, xml_files in inputs]
+        # As tarefas de leitura entram em _upstream conforme _parse chega a cada entrada
+        self._upstream = [asyncio.create_task(self._parse(inputs, reader, executor, cache or None, parsed))]
+        tasks = [self._upstream[0], asyncio.create_task(self._build(cache or None, parsed, notes))]
+        if writer is not None:
+            tasks.append(asyncio.create_task(self._drain(writer, notes)))
+        wait = True
+        try:
+            _, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            for task in tasks:
+                if not task.cancelled() and task.exception() is not None:
+                    raise task.exception()
+        except BaseException:
+            # Erro ou cancelamento: não espera os lotes em andamento no pool
+            wait = False
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        finally:
+            for task in self._upstream:
+                task.cancel()
+            await asyncio.gather(*self._upstream, return_exceptions=True)
+            # A leitura pode estar no meio de um lote; os geradores só são fechados depois dela
+            reader.shutdown(wait=True)
+            for _, sources in inputs:
+                sources.close()
+            executor.shutdown(wait=wait, cancel_futures=True)
+            if writer is not None:
+                writer.shutdown(wait=True)
+            # As etapas se sobrepõem: parse é o tempo total do pipeline, extract corre em paralelo
+            metrics.add_time("parse", time.perf_counter() - start)
+            if own_cache and cache is not None:
+                logging.info(f"Cache de parsing: {cache.hits} reaproveitadas | {cache.misses} processadas.")
+                cache.close()
+
+        return self.builder.report(metrics)
+
+def run_pipeline(xml_files, origem: str = None, **options) -> dict:
+    """
+    Executa IngestionPipeline(**options).run(xml_files, origem) num loop de
+    eventos próprio; para uso fora de código assíncrono (analyze_file, interface, cli).
+    """
+    return asyncio.run(IngestionPipeline(**options).run(xml_files, origem))
+
+def run_pipeline_inputs(inputs: list, **options) -> dict:
+    """
+    Como run_pipeline, para várias entradas [(origem, XMLs)] num único relatório.
+    """
+    return asyncio.run(IngestionPipeline(**options).run_inputs(inputs))
@@ -1,10 +1,29 @@
 import os
+import io
+import mmap
 import zipfile
-import tempfile
 import shutil
 import xml.etree.ElementTree as ET
 import datetime
 import logging
+import configparser
+import copy
+import time
+from itertools import islice
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, Future
+
+from cache import ParseCache, DEFAULT_CACHE_FILE, DEFAULT_CACHE_MAX_MB
+from records import compact_note
+from metrics import AnalysisMetrics, profiled
+from official import OfficialKeyIndex, Reconciliation
+from summary import ReportSummary
+from history import KeyHistory, DEFAULT_HISTORY_FILE
+
+try:
+    from lxml import etree as LET
+except ImportError:
+    LET = None
 
 logging.basicConfig(
     filename="app.log",
@@ -13,54 +32,335 @@ logging.basicConfig(
     level=logging.INFO
 )
 
+SETTINGS_FILE = "settings.ini"
+
+# Quantidade de arquivos enviada de uma vez a cada processo do pool
+DEFAULT_CHUNKSIZE = 64
+
+# XMLs soltos a partir deste tamanho são lidos por mmap em _parse_xml_file
+MMAP_MIN_BYTES = 256 * 1024
+
+# Entradas contadas ao mesmo tempo numa análise de várias entradas
+COUNT_THREADS = 4
+
+def load_setting(name: str, fallback: str = "") -> str:
+    """
+    Lê uma opção da seção [DEFAULT] do settings.ini.
+    Retorna fallback se o arquivo ou a opção não existirem.
+    """
+    config = configparser.ConfigParser()
+    config.read(SETTINGS_FILE, encoding="utf-8")
+    value = config["DEFAULT"].get(name, "").strip()
+    return value or fallback
+
+def resolve_workers(workers=None) -> int:
+    """
+    Define quantos processos usar no parsing.
+    Se workers for None, usa a opção "workers" do settings.ini (padrão 1).
+    O valor 0 usa todos os núcleos disponíveis.
+    """
+    if workers is None:
+        try:
+            workers = int(load_setting("workers", "1"))
+        except ValueError:
+            logging.error("Valor inválido para 'workers' em %s", SETTINGS_FILE)
+            workers = 1
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    return workers
+
+def resolve_parser(parser=None) -> str:
+    """
+    Define o backend de parsing (ver EXTRACTORS).
+    Se parser for None, usa a opção "parser" do settings.ini (padrão
+    "iterparse", da biblioteca padrão). "lxml" é opcional: se não estiver
+    instalado, usa "iterparse".
+    """
+    if parser is None:
+        parser = load_setting("parser", "iterparse")
+    parser = parser.strip().lower()
+    if parser not in EXTRACTORS:
+        logging.error("Parser desconhecido '%s' em %s; usando 'iterparse'", parser, SETTINGS_FILE)
+        parser = "iterparse"
+    if parser == "lxml" and LET is None:
+        parser = "iterparse"
+    return parser
+
+def open_parse_cache():
+    """
+    Abre o cache de parsing conforme as opções "cache_file" e "cache_max_mb"
+    do settings.ini. Retorna None se cache_max_mb for 0 ou o cache não abrir.
+    """
+    try:
+        max_mb = int(load_setting("cache_max_mb", str(DEFAULT_CACHE_MAX_MB)))
+    except ValueError:
+        logging.error("Valor inválido para 'cache_max_mb' em %s", SETTINGS_FILE)
+        max_mb = DEFAULT_CACHE_MAX_MB
+    if max_mb <= 0:
+        return None
+    try:
+        return ParseCache(load_setting("cache_file", DEFAULT_CACHE_FILE), max_mb * 1024 * 1024)
+    except Exception as e:
+        logging.error("Não foi possível abrir o cache de parsing: %s", e)
+        return None
+
+def open_key_history():
+    """
+    Abre o histórico de chaves (history.KeyHistory) indicado pela opção
+    "history_file" do settings.ini. Retorna None se a opção estiver vazia
+    ou o histórico não abrir.
+    """
+    path = load_setting("history_file", DEFAULT_HISTORY_FILE)
+    if not path:
+        return None
+    try:
+        return KeyHistory(path)
+    except Exception as e:
+        logging.error("Não foi possível abrir o histórico de chaves: %s", e)
+        return None
+
+def clear_parse_cache() -> None:
+    """
+    Invalida o cache de parsing, forçando a releitura de todos os XMLs.
+    """
+    cache = open_parse_cache()
+    if cache is not None:
+        cache.clear()
+        cache.close()
+        logging.info("Cache de parsing limpo.")
+
+def note_key(nota: dict) -> tuple:
+    """
+    Chave (nNF, cNF, cnpj) usada para detectar duplicadas e conferir keys.csv.
+    """
+    nNF = nota.get("nNF", "N/A")
+    cNF = nota.get("cNF", "N/A")
+    cnpj = nota.get("emitente", {}).get("cnpj", "N/A")
+    return (nNF, cNF, cnpj)
+
 def load_official_keys() -> set:
-    filepath = "keys.csv"
-    if not os.path.exists(filepath):
+    """
+    Conjunto completo das chaves do keys.csv. A análise usa OfficialKeyIndex e
+    Reconciliation (official.py), que não materializam todas as chaves.
+    """
+    index = OfficialKeyIndex.load()
+    if index is None:
         return set()
-    oficial = set()
-    with open(filepath, "r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line or "," not in line:
-                continue
-            parts = line.split(",")
-            if len(parts) < 3:
-                continue
-            nNF, cNF, cnpj = parts[0].strip(), parts[1].strip(), parts[2].strip()
-            oficial.add((nNF, cNF, cnpj))
-    return oficial
+    return set(index.keys_at(range(len(index))))
+
+def resolve_pipeline(pipeline=None) -> str:
+    """
+    Define como a análise é executada: "serial" (process_xml_files, leitura,
+    parsing e montagem do relatório intercalados num só laço) ou "async"
+    (pipeline.IngestionPipeline, etapas concorrentes ligadas por filas).
+    Se pipeline for None, usa a opção "pipeline" do settings.ini (padrão "serial").
+    """
+    if pipeline is None:
+        pipeline = load_setting("pipeline", "serial")
+    pipeline = pipeline.strip().lower()
+    if pipeline not in ("serial", "async"):
+        logging.error("Pipeline desconhecido '%s' em %s; usando 'serial'", pipeline, SETTINGS_FILE)
+        pipeline = "serial"
+    return pipeline
+
+def analyze_file(file_path: str, progress_dialog=None, workers=None, parser=None, cache=None, progress=None,
+                 metrics_file=None, profile_file=None, history=None, pipeline=None, sink=None) -> dict:
+    """
+    Analisa uma única entrada (ZIP, XML ou diretório); ver analyze_files.
+    """
+    return analyze_files([file_path], progress_dialog, workers, parser, cache, progress,
+                         metrics_file, profile_file, history, pipeline, sink)
+
+def analyze_files(file_paths: list, progress_dialog=None, workers=None, parser=None, cache=None, progress=None,
+                  metrics_file=None, profile_file=None, history=None, pipeline=None, sink=None) -> dict:
+    """
+    Analisa várias entradas (ZIPs, XMLs ou diretórios) num único relatório:
+    as notas ficam na ordem das entradas, cada uma com a entrada de onde veio
+    (NoteRecord.origem, caminho absoluto), os totais são somados
+    (report["resumo"]["por_origem"] traz os de cada entrada) e as duplicadas
+    são procuradas entre todas elas.
+    progress é um ProgressChannel (ver progress.py) que recebe as fases
+    extract, parse e reconcile; se for cancelado, levanta AnalysisCancelled.
+    Os tempos e contadores ficam em report["metrics"] (AnalysisMetrics);
+    metrics_file grava-os em JSON e profile_file roda a análise sob cProfile
+    (se None, usam as opções de mesmo nome em settings.ini; vazio desativa).
+    As notas são conferidas com o keys.csv durante o parsing: report["missing_keys"]
+    traz as chaves oficiais não encontradas e report["unofficial_keys"] as
+    notas lidas que não constam no keys.csv.
+    Cada nota também é conferida com o histórico de chaves das análises
+    anteriores (history é um KeyHistory; se None, usa open_key_history();
+    False desativa): report["cross_duplicates"] traz (chave, arquivo anterior)
+    das notas já vistas em outro arquivo, e as chaves desta análise são
+    gravadas no histórico, cada uma com a sua entrada.
+    pipeline escolhe o modo de execução (ver resolve_pipeline); o relatório é
+    o mesmo nos dois. sink, se informado, recebe as notas em listas durante a
+    análise, para mostrar as primeiras antes do fim.
+    """
+    if not file_paths:
+        raise ValueError("Nenhuma entrada informada para análise.")
+    if metrics_file is None:
+        metrics_file = load_setting("metrics_file", "")
+    if profile_file is None:
+        profile_file = load_setting("profile_file", "")
+    with profiled(profile_file):
+        report = _analyze(file_paths, progress_dialog, workers, parser, cache, progress, history, pipeline, sink)
 
-def analyze_file(file_path: str, progress_dialog=None) -> dict:
-    import_path = os.path.abspath(file_path)
-    temp_dir = tempfile.mkdtemp()
+    metrics = report["metrics"]
+    metrics.finish()
+    metrics.log_summary()
+    if metrics_file:
+        metrics.write_json(metrics_file)
+    return report
 
+def _count_inputs(import_paths: list) -> list:
+    # Contagem de cada entrada em paralelo: listar um ZIP grande ou percorrer
+    # uma pasta é quase só espera de disco
+    if len(import_paths) == 1:
+        return [count_xml_sources(import_paths)]
+    with ThreadPoolExecutor(max_workers=min(len(import_paths), COUNT_THREADS)) as executor:
+        return list(executor.map(lambda path: count_xml_sources([path]), import_paths))
+
+def _analyze(file_paths: list, progress_dialog, workers, parser, cache, progress, history, pipeline, sink) -> dict:
+    import_paths = [os.path.abspath(file_path) for file_path in file_paths]
+    metrics = AnalysisMetrics()
+
+    own_history = history is None
+    if own_history:
+        history = open_key_history()
+    elif history is False:
+        history = None
+    history_check = history.check(import_paths[0]) if history is not None else None
     try:
-        xml_files = extract_files([import_path], temp_dir)
-        report = process_xml_files(xml_files, progress_dialog)
-
-        official = load_official_keys()
-        missing_keys = []
-        if official:
-            loaded_keys = set()
-            for nota in report["notas"]:
-                nNF = nota.get("nNF", "N/A")
-                cNF = nota.get("cNF", "N/A")
-                cnpj = nota.get("emitente", {}).get("cnpj", "N/A")
-                loaded_keys.add((nNF, cNF, cnpj))
-            missing_keys = list(official - loaded_keys)
-
-        report["missing_keys"] = missing_keys
-
-        logging.info(f"Arquivo '{file_path}' analisado.")
-        logging.info(f"Total XML lidos: {len(xml_files)} | Notas válidas: {report['resumo']['total_notas']} | Erros: {len(report['errors'])} | Duplicadas: {len(report['duplicates'])}")
-        if missing_keys:
-            logging.info(f"Chaves ausentes: {len(missing_keys)}")
-
-        return report
+        if progress is not None:
+            progress.set_phase("extract")
+        with metrics.stage("count"):
+            total_files = sum(_count_inputs(import_paths))
+        with metrics.stage("reconcile"):
+            reconciliation = Reconciliation(OfficialKeyIndex.load())
+        options = dict(
+            progress_dialog=progress_dialog, workers=workers, parser=parser, cache=cache, total=total_files,
+            progress=progress, metrics=metrics, sink=sink
+        )
+        if resolve_pipeline(pipeline) == "async":
+            from pipeline import run_pipeline_inputs
+            inputs = [(path, iter_xml_sources([path])) for path in import_paths]
+            report = run_pipeline_inputs(
+                inputs, reconciliation=reconciliation, history_check=history_check, **options
+            )
+        else:
+            builder = ReportBuilder(reconciliation, history_check)
+            for path in import_paths:
+                report = process_xml_files(iter_xml_sources([path]), origem=path, builder=builder, **options)
+                if progress_dialog and progress_dialog.wasCanceled():
+                    break
+
+        if progress is not None:
+            progress.set_phase("reconcile")
+        with metrics.stage("reconcile"):
+            missing_keys = reconciliation.missing_keys()
+        if history_check is not None:
+            with metrics.stage("history"):
+                history_check.commit()
     finally:
-        shutil.rmtree(temp_dir)
+        if own_history and history is not None:
+            history.close()
+
+    report["missing_keys"] = missing_keys
+    report["unofficial_keys"] = reconciliation.unofficial_keys
+    report["cross_duplicates"] = history_check.duplicates if history_check is not None else []
+
+    por_origem = report["resumo"]["por_origem"]
+    for path in import_paths:
+        logging.info(f"Arquivo '{path}' analisado: {por_origem.get(path, {}).get('notas', 0)} notas.")
+    logging.info(f"Total XML lidos: {total_files} | Notas válidas: {report['resumo']['total_notas']} | Erros: {len(report['errors'])} | Duplicadas: {len(report['duplicates'])}")
+    if missing_keys:
+        logging.info(f"Chaves ausentes: {len(missing_keys)}")
+    if reconciliation.unofficial_keys:
+        logging.info(f"Notas fora do keys.csv: {len(reconciliation.unofficial_keys)}")
+    if report["cross_duplicates"]:
+        logging.info(f"Notas já vistas em outros arquivos: {len(report['cross_duplicates'])}")
+
+    return report
+
+def _iter_zip_members(zip_ref: zipfile.ZipFile, prefix: str):
+    """
+    Gera (caminho, conteúdo) para cada .xml do ZIP, lendo direto do arquivo aberto.
+    ZIPs internos são abertos em memória e percorridos recursivamente;
+    o caminho exibido fica no formato "externo.zip/interno.zip/nota.xml".
+    """
+    for info in zip_ref.infolist():
+        if info.is_dir():
+            continue
+        name = info.filename.lower()
+        member_path = os.path.join(prefix, info.filename)
+        if name.endswith('.xml'):
+            yield member_path, zip_ref.read(info)
+        elif name.endswith('.zip'):
+            try:
+                with zipfile.ZipFile(io.BytesIO(zip_ref.read(info))) as nested:
+                    yield from _iter_zip_members(nested, member_path)
+            except zipfile.BadZipFile as e:
+                logging.error("ZIP interno inválido %s: %s", member_path, e)
+
+def _count_zip_members(zip_ref: zipfile.ZipFile) -> int:
+    total = 0
+    for info in zip_ref.infolist():
+        name = info.filename.lower()
+        if info.is_dir():
+            continue
+        if name.endswith('.xml'):
+            total += 1
+        elif name.endswith('.zip'):
+            try:
+                with zipfile.ZipFile(io.BytesIO(zip_ref.read(info))) as nested:
+                    total += _count_zip_members(nested)
+            except zipfile.BadZipFile:
+                pass
+    return total
+
+def iter_xml_sources(files: list):
+    """
+    Gera os XMLs de uma lista de arquivos XML, ZIPs ou diretórios, sem copiá-los
+    para disco. Arquivos soltos e diretórios geram o próprio caminho; membros de
+    ZIP geram a tupla (caminho, conteúdo) aceita por process_xml_files.
+    """
+    for file in files:
+        if os.path.isfile(file):
+            if zipfile.is_zipfile(file):
+                with zipfile.ZipFile(file, 'r') as zip_ref:
+                    yield from _iter_zip_members(zip_ref, file)
+            elif file.lower().endswith('.xml'):
+                yield file
+        elif os.path.isdir(file):
+            for root, _, filenames in os.walk(file):
+                for filename in filenames:
+                    if filename.lower().endswith('.xml'):
+                        yield os.path.join(root, filename)
+
+def count_xml_sources(files: list) -> int:
+    """
+    Conta quantos XMLs iter_xml_sources vai gerar, usando o índice dos ZIPs
+    (sem descompactar, exceto ZIPs internos).
+    """
+    total = 0
+    for file in files:
+        if os.path.isfile(file):
+            if zipfile.is_zipfile(file):
+                with zipfile.ZipFile(file, 'r') as zip_ref:
+                    total += _count_zip_members(zip_ref)
+            elif file.lower().endswith('.xml'):
+                total += 1
+        elif os.path.isdir(file):
+            for _, _, filenames in os.walk(file):
+                total += sum(1 for f in filenames if f.lower().endswith('.xml'))
+    return total
 
 def extract_files(files: list, destination: str) -> list:
+    """
+    Copia os XMLs para destination e devolve os caminhos copiados.
+    Mantida para quem precisa dos arquivos em disco; analyze_file usa
+    iter_xml_sources, que lê os XMLs direto dos ZIPs e diretórios.
+    """
     xml_files = []
     for file in files:
         if os.path.isfile(file):
@@ -79,57 +379,398 @@ def extract_files(files: list, destination: str) -> list:
     extracted_files = [os.path.join(destination, f) for f in os.listdir(destination) if f.lower().endswith('.xml')]
     return extracted_files
 
-def process_xml_files(xml_files: list, progress_dialog=None) -> dict:
-    notas = []
-    errors = []
-    duplicates = []
-    seen_keys = {}
+def _parse_xml_file(xml_file, parser: str = "iterparse") -> tuple:
+    """
+    Faz o parsing de um único XML e devolve (detalhes, erro).
+    xml_file é um caminho ou uma tupla (caminho, conteúdo) vinda de um ZIP;
+    parser é o nome do backend em EXTRACTORS. Arquivos soltos são lidos no
+    próprio local; os grandes (MMAP_MIN_BYTES) são mapeados em memória e
+    entregues ao parser sem cópia intermediária.
+    Fica em nível de módulo para poder ser enviada aos processos do pool.
+    """
+    content = None
+    if isinstance(xml_file, tuple):
+        xml_file, content = xml_file
+    try:
+        if content is None and os.path.getsize(xml_file) >= MMAP_MIN_BYTES:
+            with open(xml_file, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return EXTRACTORS[parser](xml_file, mm), None
+        return EXTRACTORS[parser](xml_file, content), None
+    except PARSE_ERRORS as e:
+        return None, f"Erro parse '{xml_file}': {str(e)}"
+    except Exception as e:
+        return None, f"Erro process '{xml_file}': {str(e)}"
+
+def _parse_xml_timed(xml_file, parser: str) -> tuple:
+    """
+    Como _parse_xml_file, mas devolve (detalhes, erro, segundos).
+    """
+    start = time.perf_counter()
+    nota_details, error = _parse_xml_file(xml_file, parser)
+    return nota_details, error, time.perf_counter() - start
 
-    total_files = len(xml_files)
+def _parse_xml_chunk(xml_files: list, parser: str, timed: bool = False) -> list:
+    parse = _parse_xml_timed if timed else _parse_xml_file
+    return [parse(xml_file, parser) for xml_file in xml_files]
 
-    for i, xml_file in enumerate(xml_files):
-        try:
-            nota_details = extract_note_details(xml_file)
-            if nota_details:
-                nNF = nota_details.get("nNF", "N/A")
-                cNF = nota_details.get("cNF", "N/A")
-                cnpj = nota_details.get("emitente", {}).get("cnpj", "N/A")
-                key = (nNF, cNF, cnpj)
-                if key in seen_keys:
-                    duplicates.append(key)
+def _dispatch_chunk(chunk: list, parser: str, executor, cache, timed: bool = False) -> tuple:
+    """
+    Consulta o cache para um lote e envia para parsing só os arquivos que faltam:
+    ao pool, se houver executor, ou de forma preguiçosa no próprio processo.
+    Com timed, cada resultado traz também o tempo de parsing do arquivo.
+    """
+    keys = [cache.key_for(xml_file) for xml_file in chunk] if cache else [None] * len(chunk)
+    cached = cache.get_many(keys) if cache else {}
+    misses = [xml_file for xml_file, key in zip(chunk, keys) if key not in cached]
+    parse = _parse_xml_timed if timed else _parse_xml_file
+    if executor is not None and misses:
+        results = executor.submit(_parse_xml_chunk, misses, parser, timed)
+    else:
+        results = (parse(xml_file, parser) for xml_file in misses)
+    return chunk, keys, cached, results
+
+def _collect_chunk(chunk: list, keys: list, cached: dict, results, cache, metrics=None):
+    """
+    Gera os resultados de um lote na ordem original, juntando os do cache
+    com os recém-processados, e grava estes no cache.
+    Com metrics, registra cada arquivo (tamanho e tempo de parsing).
+    """
+    if isinstance(results, Future):
+        results = results.result()
+    results = iter(results)
+    new_entries = []
+    used = set()
+    try:
+        for xml_file, key in zip(chunk, keys):
+            if key in cached:
+                detalhes = cached[key]
+                if key in used:
+                    detalhes = copy.deepcopy(detalhes)
+                used.add(key)
+                # O mesmo conteúdo pode vir com outro nome de arquivo
+                detalhes["nome"] = os.path.basename(xml_file[0] if isinstance(xml_file, tuple) else xml_file)
+                if metrics is not None:
+                    metrics.record_file(xml_file)
+                yield detalhes, None
+            else:
+                if metrics is not None:
+                    nota_details, error, seconds = next(results)
+                    metrics.record_file(xml_file, seconds)
                 else:
-                    seen_keys[key] = 1
-                notas.append(nota_details)
-        except ET.ParseError as e:
-            errors.append(f"Erro parse '{xml_file}': {str(e)}")
-        except Exception as e:
-            errors.append(f"Erro process '{xml_file}': {str(e)}")
+                    nota_details, error = next(results)
+                if cache and nota_details and key is not None:
+                    new_entries.append((key, nota_details))
+                yield nota_details, error
+    finally:
+        if cache:
+            cache.put_many(new_entries)
 
-        if progress_dialog:
-            progress_value = int((i + 1) / total_files * 100)
-            progress_dialog.setValue(progress_value)
-            if progress_dialog.wasCanceled():
-                break
+def _iter_parsed(xml_files, workers: int, chunksize: int, parser: str, cache=None, metrics=None):
+    """
+    Gera os resultados de _parse_xml_file na mesma ordem de xml_files.
+    Os arquivos são tratados em lotes de chunksize; arquivos presentes no cache
+    não são processados de novo. Com mais de um worker, os lotes vão para os
+    processos do pool e no máximo 2 lotes por worker ficam pendentes, o que
+    mantém limitada a memória quando xml_files é um gerador.
+    metrics (AnalysisMetrics) recebe o tamanho e o tempo de parsing de cada arquivo.
+    """
+    items = iter(xml_files)
+    chunks = iter(lambda: list(islice(items, chunksize)), [])
+    first_chunk = next(chunks, [])
+    executor = None
+    if workers > 1 and len(first_chunk) == chunksize:
+        executor = ProcessPoolExecutor(max_workers=workers)
+    max_pending = workers * 2 if executor is not None else 1
+    wait = True
+    try:
+        pending = deque()
+        chunk = first_chunk
+        while pending or chunk:
+            while chunk and len(pending) < max_pending:
+                pending.append(_dispatch_chunk(chunk, parser, executor, cache, metrics is not None))
+                chunk = next(chunks, [])
+            if pending:
+                yield from _collect_chunk(*pending.popleft(), cache, metrics)
+    except GeneratorExit:
+        # Consumidor parou antes do fim (ex.: cancelamento): não espera os lotes em andamento
+        wait = False
+        raise
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
 
-    resumo = {
-        "total_notas": len(notas),
-        "valor_total": sum(n.get("valor", 0.0) for n in notas)
-    }
+class ReportBuilder:
+    """
+    Monta o relatório a partir dos resultados de parsing (detalhes, erro), na
+    ordem dos arquivos: duplicadas por (nNF, cNF, cnpj), conferência com o
+    keys.csv (reconciliation) e com as análises anteriores (history_check),
+    resumo e notas compactas. Usado por process_xml_files e pelo pipeline
+    assíncrono (pipeline.py), que assim produzem o mesmo relatório; numa análise
+    de várias entradas, o mesmo ReportBuilder recebe os resultados de todas.
+    Com keep_notes=False as notas não são guardadas (só o resumo), para quem
+    as consome por um sink.
+    """
 
-    return {
-        "resumo": resumo,
-        "notas": notas,
-        "errors": errors,
-        "duplicates": duplicates
-    }
+    def __init__(self, reconciliation=None, history_check=None, keep_notes: bool = True):
+        self.reconciliation = reconciliation
+        self.history_check = history_check
+        self.keep_notes = keep_notes
+        self.notas = []
+        self.errors = []
+        self.duplicates = []
+        self.seen_keys = {}
+        self.summary = ReportSummary()
+        self.products = 0
+        self.files = 0
 
-def extract_note_details(xml_file: str) -> dict:
+    def add(self, nota_details: dict, error, origem: str = None):
+        """
+        Incorpora um resultado vindo da entrada origem; devolve o NoteRecord
+        da nota, ou None se houve erro.
+        """
+        self.files += 1
+        if error:
+            self.errors.append(error)
+            return None
+        if not nota_details:
+            return None
+        key = note_key(nota_details)
+        if key in self.seen_keys:
+            self.duplicates.append(key)
+        else:
+            self.seen_keys[key] = 1
+            if self.reconciliation is not None:
+                self.reconciliation.add(key)
+            if self.history_check is not None:
+                self.history_check.add(key, origem)
+        nota = compact_note(nota_details, origem)
+        if self.keep_notes:
+            self.notas.append(nota)
+        self.summary.add(nota)
+        self.products += len(nota_details["produtos"])
+        return nota
+
+    def report(self, metrics: AnalysisMetrics) -> dict:
+        metrics.counters["products"] = self.products
+        metrics.counters["notes"] = self.summary.total_notas
+        metrics.counters["errors"] = len(self.errors)
+        return {
+            "resumo": self.summary.to_dict(),
+            "notas": self.notas,
+            "errors": self.errors,
+            "duplicates": self.duplicates,
+            "metrics": metrics
+        }
+
+# Notas entregues por vez ao sink de process_xml_files e do pipeline
+SINK_BATCH = 1000
+
+def process_xml_files(xml_files, progress_dialog=None, workers=None, chunksize: int = DEFAULT_CHUNKSIZE, total=None, parser=None, cache=None, progress=None, metrics=None, reconciliation=None, history_check=None, sink=None, origem=None, builder=None) -> dict:
     """
-    Extrai os dados principais de uma nota a partir do XML.
-    Também extrai o modelo com base no elemento <mod>:
-      - Se <mod> for "55", define modelo como "NFE"
-      - Se <mod> for "65", define modelo como "NFC-E"
-    Se <mod> estiver ausente, usa o atributo Id de infNFe: se iniciar com "NFe", assume NFE; caso contrário, NFC-E.
+    Processa os XMLs (lista ou gerador, ver iter_xml_sources) e monta o relatório.
+    workers define quantos processos fazem o parsing (ver resolve_workers)
+    e parser, qual backend é usado (ver resolve_parser);
+    o resultado (ordem das notas, duplicadas e erros) é o mesmo do modo serial.
+    As notas são guardadas como NoteRecord (ver records.py), que ocupa bem menos
+    memória que o dict e oferece o mesmo acesso por chave.
+    total informa a quantidade de arquivos quando xml_files é um gerador.
+    cache é um ParseCache; se for None, usa open_parse_cache(); False desativa.
+    progress é um ProgressChannel (fase parse); o cancelamento levanta
+    AnalysisCancelled e encerra o pool sem esperar os lotes pendentes.
+    metrics é o AnalysisMetrics que recebe tempos e contadores (criado se None)
+    e fica em report["metrics"].
+    reconciliation (official.Reconciliation) recebe a chave de cada nota distinta;
+    history_check (history.CrossArchiveCheck) também, para a conferência com
+    as análises anteriores.
+    sink, se informado, recebe as notas já lidas em listas de até SINK_BATCH,
+    durante o processamento.
+    origem é gravada em cada nota (NoteRecord.origem). Para juntar várias
+    entradas num relatório, passe o mesmo builder (ReportBuilder, que substitui
+    reconciliation e history_check) em cada chamada: o relatório devolvido
+    acumula as anteriores e progress continua a contagem.
+    """
+    if builder is None:
+        builder = ReportBuilder(reconciliation, history_check)
+    pending_notes = []
+
+    total_files = total if total is not None else len(xml_files)
+    workers = resolve_workers(workers)
+    parser = resolve_parser(parser)
+    own_cache = cache is None
+    if own_cache:
+        cache = open_parse_cache()
+
+    if metrics is None:
+        metrics = AnalysisMetrics()
+    if progress is not None and not builder.files:
+        progress.set_phase("parse", total_files)
+    loop_start = time.perf_counter()
+    extract_before = metrics.stages.get("extract", 0.0)
+    sources = metrics.timed_iter("extract", xml_files)
+    parsed = _iter_parsed(sources, workers, chunksize, parser, cache or None, metrics)
+    try:
+        for nota_details, error in parsed:
+            nota = builder.add(nota_details, error, origem)
+            if sink is not None and nota is not None:
+                pending_notes.append(nota)
+                if len(pending_notes) >= SINK_BATCH:
+                    sink(pending_notes)
+                    pending_notes = []
+
+            if progress is not None:
+                progress.update(builder.files)
+            if progress_dialog and total_files:
+                progress_value = int(builder.files / total_files * 100)
+                progress_dialog.setValue(progress_value)
+                if progress_dialog.wasCanceled():
+                    break
+        if sink is not None and pending_notes:
+            sink(pending_notes)
+    finally:
+        parsed.close()
+        sources.close()
+        extract_time = metrics.stages.get("extract", 0.0) - extract_before
+        metrics.add_time("parse", time.perf_counter() - loop_start - extract_time)
+        if own_cache and cache is not None:
+            logging.info(f"Cache de parsing: {cache.hits} reaproveitadas | {cache.misses} processadas.")
+            cache.close()
+
+    return builder.report(metrics)
+
+class IncrementalAnalysis:
+    """
+    Análise incremental de um diretório que recebe XMLs continuamente.
+
+    Cada scan() processa apenas os arquivos ainda não vistos e os incorpora a
+    self.report, atualizando duplicadas, totais e chaves ausentes sem reler o
+    que já foi analisado. Arquivos que falharam (por exemplo, ainda sendo
+    gravados) são tentados de novo quando o tamanho ou a data mudam.
+    Arquivos já incorporados não são relidos mesmo que sejam alterados.
+
+    Para uso com interface, collect() (parsing, pode rodar em outra thread)
+    e merge() (atualização do relatório) podem ser chamados separadamente.
+    """
+
+    def __init__(self, directory: str, workers=None, parser=None):
+        self.directory = os.path.abspath(directory)
+        self.workers = workers
+        self.parser = parser
+        self.report = {
+            "resumo": ReportSummary().to_dict(),
+            "notas": [],
+            "errors": [],
+            "duplicates": [],
+            "missing_keys": []
+        }
+        self.seen_files = {}
+        self.failed_files = {}
+        self.seen_keys = {}
+        self.summary = ReportSummary()
+        self.reconciliation = Reconciliation(OfficialKeyIndex.load())
+        self.report["unofficial_keys"] = self.reconciliation.unofficial_keys
+
+    def find_new_files(self) -> list:
+        """
+        Lista (caminho, (tamanho, mtime)) dos XMLs que ainda precisam ser lidos.
+        """
+        novos = []
+        for root, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if not filename.lower().endswith('.xml'):
+                    continue
+                path = os.path.join(root, filename)
+                if path in self.seen_files:
+                    continue
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                stamp = (st.st_size, st.st_mtime_ns)
+                failed = self.failed_files.get(path)
+                if failed is not None and failed[0] == stamp:
+                    continue
+                novos.append((path, stamp))
+        novos.sort()
+        return novos
+
+    def collect(self) -> list:
+        """
+        Faz o parsing dos arquivos novos sem alterar o relatório.
+        Devolve [(caminho, (tamanho, mtime), detalhes, erro)] para merge().
+        """
+        novos = self.find_new_files()
+        if not novos:
+            return []
+        workers = resolve_workers(self.workers)
+        parser = resolve_parser(self.parser)
+        cache = open_parse_cache()
+        parsed = _iter_parsed([path for path, _ in novos], workers, DEFAULT_CHUNKSIZE, parser, cache)
+        try:
+            return [(path, stamp, detalhes, error) for (path, stamp), (detalhes, error) in zip(novos, parsed)]
+        finally:
+            parsed.close()
+            if cache is not None:
+                cache.close()
+
+    def merge(self, results: list) -> list:
+        """
+        Incorpora o resultado de collect() ao relatório e devolve as notas novas.
+        """
+        novas = []
+        for path, stamp, nota_details, error in results:
+            if error:
+                self.failed_files[path] = (stamp, error)
+                continue
+            self.failed_files.pop(path, None)
+            self.seen_files[path] = stamp
+            if not nota_details:
+                continue
+            key = note_key(nota_details)
+            if key in self.seen_keys:
+                self.report["duplicates"].append(key)
+            else:
+                self.seen_keys[key] = 1
+                self.reconciliation.add(key)
+            nota = compact_note(nota_details, self.directory)
+            self.report["notas"].append(nota)
+            self.summary.add(nota)
+            novas.append(nota)
+
+        self.report["resumo"] = self.summary.to_dict()
+        self.report["errors"] = [error for _, error in self.failed_files.values()]
+        if self.reconciliation.active:
+            self.report["missing_keys"] = self.reconciliation.missing_keys()
+        if results:
+            logging.info(f"Diretório '{self.directory}': {len(novas)} notas novas | Total: {self.summary.total_notas} | Erros: {len(self.report['errors'])} | Duplicadas: {len(self.report['duplicates'])}")
+        return novas
+
+    def scan(self) -> list:
+        """
+        Lê os arquivos novos e devolve as notas incorporadas ao relatório.
+        """
+        return self.merge(self.collect())
+
+NFE_NS = "http://www.portalfiscal.inf.br/nfe"
+
+# Campos da nota buscados em qualquer nível do documento (primeira ocorrência)
+_FIRST_FIELDS = ("vNF", "cStat", "dhRecbto", "dhEmi")
+# Campos filhos de <ide>
+_IDE_FIELDS = ("nNF", "cNF", "mod")
+# Campos filhos de <emit> e de <emit>/<enderEmit>
+_EMIT_FIELDS = ("xNome", "CNPJ")
+_ENDER_FIELDS = ("xLgr", "nro", "xBairro", "xMun", "UF")
+# Campos filhos de <det>/<prod>
+_PROD_FIELDS = ("xProd", "cProd", "CFOP", "qCom", "uCom", "vUnCom", "vProd")
+
+def _build_note_details(xml_file: str, campos: dict) -> dict:
+    """
+    Monta o dicionário de detalhes da nota a partir dos textos já localizados no XML.
+    campos traz apenas os elementos encontrados (o texto pode ser None):
+      - "infNFe": atributo Id de <infNFe>; "protNFe": True se houver <protNFe>;
+      - os campos de _FIRST_FIELDS e _IDE_FIELDS;
+      - "emit": dict com _EMIT_FIELDS e "enderEmit" (dict com _ENDER_FIELDS);
+      - "produtos": lista de dicts com _PROD_FIELDS, um por <det> com <prod>.
+    É compartilhada pelos extratores para que todos gerem o mesmo resultado.
     """
     detalhes = {
         "nome": os.path.basename(xml_file),
@@ -146,31 +787,23 @@ def extract_note_details(xml_file: str) -> dict:
         "chNFe": None
     }
 
-    namespace = {"nfe": "http://www.portalfiscal.inf.br/nfe"}
-    tree = ET.parse(xml_file)
-    root = tree.getroot()
-
-    infNFe = root.find(".//nfe:infNFe", namespace)
-    if infNFe is not None:
-        ch = infNFe.get("Id", "")
+    id_val = campos.get("infNFe")
+    if id_val is not None:
+        ch = id_val
         if ch.startswith("NFe"):
             ch = ch[3:]
         detalhes["chNFe"] = ch
 
-    protNFe = root.find(".//nfe:protNFe", namespace)
+    if "nNF" in campos:
+        detalhes["nNF"] = campos["nNF"]
 
-    nNF = root.find(".//nfe:ide/nfe:nNF", namespace)
-    if nNF is not None:
-        detalhes["nNF"] = nNF.text
-
-    cNF = root.find(".//nfe:ide/nfe:cNF", namespace)
-    if cNF is not None:
-        detalhes["cNF"] = cNF.text
+    if "cNF" in campos:
+        detalhes["cNF"] = campos["cNF"]
 
     # Extrai o modelo com base no elemento <mod>
-    mod_elem = root.find(".//nfe:ide/nfe:mod", namespace)
-    if mod_elem is not None and mod_elem.text:
-        mod_val = mod_elem.text.strip()
+    mod_text = campos.get("mod")
+    if mod_text:
+        mod_val = mod_text.strip()
         if mod_val == "55":
             detalhes["modelo"] = "NFE"
         elif mod_val == "65":
@@ -178,8 +811,7 @@ def extract_note_details(xml_file: str) -> dict:
         else:
             detalhes["modelo"] = mod_val
     else:
-        if infNFe is not None:
-            id_val = infNFe.get("Id", "")
+        if id_val is not None:
             if id_val.startswith("NFe"):
                 detalhes["modelo"] = "NFE"
             else:
@@ -187,109 +819,286 @@ def extract_note_details(xml_file: str) -> dict:
         else:
             detalhes["modelo"] = "NFC-E"
 
-    vNF = root.find(".//nfe:vNF", namespace)
-    if vNF is not None:
+    if "vNF" in campos:
         try:
-            detalhes["valor"] = float(vNF.text)
+            detalhes["valor"] = float(campos["vNF"])
         except Exception as e:
             logging.error("Erro ao interpretar vNF em %s: %s", xml_file, e)
             detalhes["valor"] = 0.0
 
-    cStat = root.find(".//nfe:cStat", namespace)
-    if cStat is not None:
-        detalhes["codigo_status"] = cStat.text
-        if cStat.text in ["100", "150"]:
-            if protNFe is not None:
+    if "cStat" in campos:
+        cStat = campos["cStat"]
+        detalhes["codigo_status"] = cStat
+        if cStat in ["100", "150"]:
+            if campos.get("protNFe"):
                 detalhes["status"] = "Autorizada"
             else:
                 detalhes["status"] = "Sem Protocolo"
-        elif cStat.text in ["101", "135", "151"]:
+        elif cStat in ["101", "135", "151"]:
             detalhes["status"] = "Cancelada"
             detalhes["cancelada"] = True
         else:
             detalhes["status"] = "Desconhecido"
 
-    dhRecbto = root.find(".//nfe:dhRecbto", namespace)
-    if dhRecbto is not None:
-        detalhes["autorizada"] = dhRecbto.text[:10]
+    if "dhRecbto" in campos:
+        detalhes["autorizada"] = campos["dhRecbto"][:10]
 
-    dhEmi = root.find(".//nfe:dhEmi", namespace)
-    if dhEmi is not None:
-        detalhes["emitida"] = dhEmi.text[:10]
-
-    emitente = root.find(".//nfe:emit", namespace)
-    if emitente is not None:
-        nome = emitente.find("nfe:xNome", namespace)
-        cnpj = emitente.find("nfe:CNPJ", namespace)
-        ender = emitente.find("nfe:enderEmit", namespace)
+    if "dhEmi" in campos:
+        detalhes["emitida"] = campos["dhEmi"][:10]
 
+    emit = campos.get("emit")
+    if emit is not None:
         def get_text(tag):
-            return tag.text if tag is not None else ""
+            return emit.get(tag, "")
 
         detalhes["emitente"] = {
-            "nome": get_text(nome),
-            "cnpj": get_text(cnpj),
+            "nome": get_text("xNome"),
+            "cnpj": get_text("CNPJ"),
             "endereco": ""
         }
+        ender = emit.get("enderEmit")
         if ender is not None:
-            xLgr = ender.find("nfe:xLgr", namespace)
-            nro = ender.find("nfe:nro", namespace)
-            bairro = ender.find("nfe:xBairro", namespace)
-            xMun = ender.find("nfe:xMun", namespace)
-            uf = ender.find("nfe:UF", namespace)
+            def get_ender(tag):
+                return ender.get(tag, "")
+
             detalhes["emitente"]["endereco"] = (
-                f"{get_text(xLgr)}, {get_text(nro)}, {get_text(bairro)}, "
-                f"{get_text(xMun)} - {get_text(uf)}"
+                f"{get_ender('xLgr')}, {get_ender('nro')}, {get_ender('xBairro')}, "
+                f"{get_ender('xMun')} - {get_ender('UF')}"
             )
 
+    for prod in campos.get("produtos", []):
+        p = {
+            "nome": "",
+            "codigo": "",
+            "cfop": "",
+            "quantidade": 0.0,
+            "unidade": "",
+            "valor_unitario": 0.0,
+            "valor_total": 0.0
+        }
+        if "xProd" in prod:
+            p["nome"] = prod["xProd"]
+        if "cProd" in prod:
+            p["codigo"] = prod["cProd"]
+        if "CFOP" in prod:
+            p["cfop"] = prod["CFOP"]
+
+        if "qCom" in prod:
+            try:
+                p["quantidade"] = float(prod["qCom"])
+            except Exception as e:
+                logging.error("Erro ao interpretar qCom em %s: %s", xml_file, e)
+                p["quantidade"] = 0.0
+        if "uCom" in prod:
+            p["unidade"] = prod["uCom"]
+        if "vUnCom" in prod:
+            try:
+                p["valor_unitario"] = float(prod["vUnCom"])
+            except Exception as e:
+                logging.error("Erro ao interpretar vUnCom em %s: %s", xml_file, e)
+                p["valor_unitario"] = 0.0
+        if "vProd" in prod:
+            try:
+                p["valor_total"] = float(prod["vProd"])
+            except Exception as e:
+                logging.error("Erro ao interpretar vProd em %s: %s", xml_file, e)
+                p["valor_total"] = 0.0
+
+        detalhes["produtos"].append(p)
+
+    return detalhes
+
+def _content_source(content):
+    """
+    Arquivo para o ElementTree ler content: um mmap já se comporta como
+    arquivo e é lido sem cópia; bytes vindos de ZIP passam por BytesIO.
+    """
+    if isinstance(content, mmap.mmap):
+        content.seek(0)
+        return content
+    return io.BytesIO(content)
+
+def extract_note_details(xml_file: str, content: bytes = None) -> dict:
+    """
+    Extrai os dados principais de uma nota a partir do XML.
+    Também extrai o modelo com base no elemento <mod>:
+      - Se <mod> for "55", define modelo como "NFE"
+      - Se <mod> for "65", define modelo como "NFC-E"
+    Se <mod> estiver ausente, usa o atributo Id de infNFe: se iniciar com "NFe", assume NFE; caso contrário, NFC-E.
+    Se content for informado (XML lido de um ZIP ou mmap do arquivo), ele é usado no lugar do arquivo.
+    """
+    namespace = {"nfe": NFE_NS}
+    tree = ET.parse(_content_source(content) if content is not None else xml_file)
+    root = tree.getroot()
+
+    campos = {}
+
+    infNFe = root.find(".//nfe:infNFe", namespace)
+    if infNFe is not None:
+        campos["infNFe"] = infNFe.get("Id", "")
+
+    campos["protNFe"] = root.find(".//nfe:protNFe", namespace) is not None
+
+    for tag in _IDE_FIELDS:
+        elem = root.find(f".//nfe:ide/nfe:{tag}", namespace)
+        if elem is not None:
+            campos[tag] = elem.text
+
+    for tag in _FIRST_FIELDS:
+        elem = root.find(f".//nfe:{tag}", namespace)
+        if elem is not None:
+            campos[tag] = elem.text
+
+    emitente = root.find(".//nfe:emit", namespace)
+    if emitente is not None:
+        emit = {}
+        for tag in _EMIT_FIELDS:
+            elem = emitente.find(f"nfe:{tag}", namespace)
+            if elem is not None:
+                emit[tag] = elem.text
+        ender = emitente.find("nfe:enderEmit", namespace)
+        if ender is not None:
+            emit["enderEmit"] = {}
+            for tag in _ENDER_FIELDS:
+                elem = ender.find(f"nfe:{tag}", namespace)
+                if elem is not None:
+                    emit["enderEmit"][tag] = elem.text
+        campos["emit"] = emit
+
+    produtos = []
     for det in root.findall(".//nfe:det", namespace):
         prod = det.find("nfe:prod", namespace)
         if prod is not None:
-            p = {
-                "nome": "",
-                "codigo": "",
-                "cfop": "",
-                "quantidade": 0.0,
-                "unidade": "",
-                "valor_unitario": 0.0,
-                "valor_total": 0.0
-            }
-            xProd = prod.find("nfe:xProd", namespace)
-            cProd = prod.find("nfe:cProd", namespace)
-            cfop_tag = prod.find("nfe:CFOP", namespace)
-            qCom = prod.find("nfe:qCom", namespace)
-            uCom = prod.find("nfe:uCom", namespace)
-            vUnCom = prod.find("nfe:vUnCom", namespace)
-            vProd = prod.find("nfe:vProd", namespace)
-
-            if xProd is not None:
-                p["nome"] = xProd.text
-            if cProd is not None:
-                p["codigo"] = cProd.text
-            if cfop_tag is not None:
-                p["cfop"] = cfop_tag.text
-
-            if qCom is not None:
-                try:
-                    p["quantidade"] = float(qCom.text)
-                except Exception as e:
-                    logging.error("Erro ao interpretar qCom em %s: %s", xml_file, e)
-                    p["quantidade"] = 0.0
-            if uCom is not None:
-                p["unidade"] = uCom.text
-            if vUnCom is not None:
-                try:
-                    p["valor_unitario"] = float(vUnCom.text)
-                except Exception as e:
-                    logging.error("Erro ao interpretar vUnCom em %s: %s", xml_file, e)
-                    p["valor_unitario"] = 0.0
-            if vProd is not None:
-                try:
-                    p["valor_total"] = float(vProd.text)
-                except Exception as e:
-                    logging.error("Erro ao interpretar vProd em %s: %s", xml_file, e)
-                    p["valor_total"] = 0.0
+            p = {}
+            for tag in _PROD_FIELDS:
+                elem = prod.find(f"nfe:{tag}", namespace)
+                if elem is not None:
+                    p[tag] = elem.text
+            produtos.append(p)
+    campos["produtos"] = produtos
 
-            detalhes["produtos"].append(p)
+    return _build_note_details(xml_file, campos)
 
-    return detalhes
+_NS = "{" + NFE_NS + "}"
+# Tag com namespace -> nome do campo, para cada grupo de campos
+_QUALIFIED = {
+    fields: {_NS + tag: tag for tag in fields}
+    for fields in (_FIRST_FIELDS, _IDE_FIELDS, _EMIT_FIELDS, _ENDER_FIELDS, _PROD_FIELDS)
+}
+
+def _read_children(elem, fields: tuple) -> dict:
+    """
+    Texto do primeiro filho direto de cada campo, como elem.find("nfe:campo").
+    """
+    wanted = _QUALIFIED[fields]
+    found = {}
+    for child in elem:
+        name = wanted.get(child.tag)
+        if name is not None and name not in found:
+            found[name] = child.text
+    return found
+
+def extract_note_details_streaming(xml_file: str, content: bytes = None) -> dict:
+    """
+    Mesmo resultado de extract_note_details, mas em uma única passada pelo
+    documento com ET.iterparse: cada elemento de interesse é tratado pela tag
+    quando termina, em vez de repetir buscas ".//" na árvore inteira.
+    Cada <det> é descartado logo após a leitura do produto, então a memória
+    não cresce com a quantidade de itens.
+    """
+    first_tags = _QUALIFIED[_FIRST_FIELDS]
+    tag_infNFe, tag_protNFe, tag_ide = _NS + "infNFe", _NS + "protNFe", _NS + "ide"
+    tag_emit, tag_ender, tag_det, tag_prod = _NS + "emit", _NS + "enderEmit", _NS + "det", _NS + "prod"
+
+    campos = {"protNFe": False}
+    produtos = []
+
+    source = _content_source(content) if content is not None else xml_file
+    for _, elem in ET.iterparse(source):
+        tag = elem.tag
+        if tag in first_tags:
+            campos.setdefault(first_tags[tag], elem.text)
+        elif tag == tag_det:
+            prod = elem.find(tag_prod)
+            if prod is not None:
+                produtos.append(_read_children(prod, _PROD_FIELDS))
+            elem.clear()
+        elif tag == tag_ide:
+            for name, text in _read_children(elem, _IDE_FIELDS).items():
+                campos.setdefault(name, text)
+        elif tag == tag_emit:
+            if "emit" not in campos:
+                emit = _read_children(elem, _EMIT_FIELDS)
+                ender = elem.find(tag_ender)
+                if ender is not None:
+                    emit["enderEmit"] = _read_children(ender, _ENDER_FIELDS)
+                campos["emit"] = emit
+        elif tag == tag_infNFe:
+            campos.setdefault("infNFe", elem.get("Id", ""))
+        elif tag == tag_protNFe:
+            campos["protNFe"] = True
+    campos["produtos"] = produtos
+
+    return _build_note_details(xml_file, campos)
+
+if LET is not None:
+    _LXML_PARSER = LET.XMLParser(resolve_entities=False, no_network=True)
+    _XP_INFNFE = LET.XPath("(//nfe:infNFe)[1]", namespaces={"nfe": NFE_NS})
+    _XP_PROTNFE = LET.XPath("boolean(//nfe:protNFe)", namespaces={"nfe": NFE_NS})
+    _XP_IDE = {
+        tag: LET.XPath(f"(//nfe:ide/nfe:{tag})[1]", namespaces={"nfe": NFE_NS})
+        for tag in _IDE_FIELDS
+    }
+    _XP_FIRST = {
+        tag: LET.XPath(f"(//nfe:{tag})[1]", namespaces={"nfe": NFE_NS})
+        for tag in _FIRST_FIELDS
+    }
+    _XP_EMIT = LET.XPath("(//nfe:emit)[1]", namespaces={"nfe": NFE_NS})
+    _XP_ENDER = LET.XPath("nfe:enderEmit[1]", namespaces={"nfe": NFE_NS})
+    _XP_PROD = LET.XPath("//nfe:det/nfe:prod[1]", namespaces={"nfe": NFE_NS})
+
+def extract_note_details_lxml(xml_file: str, content: bytes = None) -> dict:
+    """
+    Mesmo resultado de extract_note_details, usando o lxml com as expressões
+    XPath já compiladas no carregamento do módulo.
+    Requer o pacote lxml (ver resolve_parser).
+    """
+    if content is not None:
+        root = LET.fromstring(content, _LXML_PARSER)
+    else:
+        root = LET.parse(xml_file, _LXML_PARSER).getroot()
+
+    campos = {}
+
+    infNFe = _XP_INFNFE(root)
+    if infNFe:
+        campos["infNFe"] = infNFe[0].get("Id", "")
+
+    campos["protNFe"] = _XP_PROTNFE(root)
+
+    for fields in (_XP_IDE, _XP_FIRST):
+        for tag, xpath in fields.items():
+            elem = xpath(root)
+            if elem:
+                campos[tag] = elem[0].text
+
+    emitente = _XP_EMIT(root)
+    if emitente:
+        emit = _read_children(emitente[0], _EMIT_FIELDS)
+        ender = _XP_ENDER(emitente[0])
+        if ender:
+            emit["enderEmit"] = _read_children(ender[0], _ENDER_FIELDS)
+        campos["emit"] = emit
+
+    campos["produtos"] = [_read_children(prod, _PROD_FIELDS) for prod in _XP_PROD(root)]
+
+    return _build_note_details(xml_file, campos)
+
+# Backends de parsing disponíveis, escolhidos pela opção "parser" do settings.ini
+EXTRACTORS = {
+    "etree": extract_note_details,
+    "iterparse": extract_note_details_streaming,
+    "lxml": extract_note_details_lxml,
+}
+
+PARSE_ERRORS = (ET.ParseError, LET.XMLSyntaxError) if LET is not None else (ET.ParseError,)
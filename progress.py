@@ -0,0 +1,86 @@
+import time
+import threading
+
+PHASES = ("extract", "parse", "reconcile", "export")
+
+class AnalysisCancelled(Exception):
+    """
+    Levantada por ProgressChannel.update quando o cancelamento foi pedido.
+    """
+
+class ProgressChannel:
+    """
+    Canal de andamento e cancelamento entre a thread de trabalho e a interface.
+
+    A thread de trabalho chama set_phase() e update(); callback recebe um dict
+    {"phase", "done", "total", "rate", "eta", "elapsed"} no máximo a cada
+    interval segundos (e sempre na troca de fase e ao final de cada fase).
+    cancel() pode ser chamado de qualquer thread; o próximo update() levanta
+    AnalysisCancelled. Não depende de Qt: o worker da interface passa como
+    callback o emit de um sinal.
+    """
+
+    def __init__(self, callback=None, interval: float = 0.1):
+        self.callback = callback
+        self.interval = interval
+        self._cancel = threading.Event()
+        self.phase = None
+        self.total = 0
+        self.done = 0
+        self._phase_start = time.perf_counter()
+        self._last_emit = 0.0
+
+    def cancel(self) -> None:
+        self._cancel.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def check(self) -> None:
+        if self._cancel.is_set():
+            raise AnalysisCancelled("Análise cancelada.")
+
+    def set_phase(self, phase: str, total: int = 0) -> None:
+        self.check()
+        self.phase = phase
+        self.total = total or 0
+        self.done = 0
+        self._phase_start = time.perf_counter()
+        self._emit()
+
+    def update(self, done: int) -> None:
+        self.check()
+        self.done = done
+        now = time.perf_counter()
+        if now - self._last_emit >= self.interval or (self.total and done >= self.total):
+            self._emit(now)
+
+    def snapshot(self, now: float = None) -> dict:
+        now = now if now is not None else time.perf_counter()
+        elapsed = now - self._phase_start
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        eta = None
+        if self.total and rate > 0:
+            eta = max(self.total - self.done, 0) / rate
+        return {
+            "phase": self.phase,
+            "done": self.done,
+            "total": self.total,
+            "rate": rate,
+            "eta": eta,
+            "elapsed": elapsed
+        }
+
+    def _emit(self, now: float = None) -> None:
+        now = now if now is not None else time.perf_counter()
+        self._last_emit = now
+        if self.callback:
+            self.callback(self.snapshot(now))
+
+    # Mesma interface mínima de QProgressDialog usada por export_to_pdf (0 a 100)
+    def setValue(self, value: int) -> None:
+        self.update(value)
+
+    def wasCanceled(self) -> bool:
+        return self.cancelled
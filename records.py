@@ -0,0 +1,161 @@
+import sys
+import weakref
+from collections.abc import Mapping
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+class _Record(Mapping):
+    """
+    Registro compacto (com __slots__) que se comporta como um dict somente leitura:
+    aceita nota["campo"], nota.get("campo", padrão), keys(), items() e ==
+    com dicts, como esperado por export.py e ui.py.
+    """
+    __slots__ = ()
+    # Campos expostos como chaves, na ordem de __slots__ (sem __weakref__)
+    _keys = ()
+    _fields = frozenset()
+
+    def __getitem__(self, key):
+        if key in self._fields:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+    def to_dict(self) -> dict:
+        result = {}
+        for key in self._keys:
+            value = getattr(self, key)
+            if isinstance(value, _Record):
+                value = value.to_dict()
+            elif isinstance(value, list):
+                value = [v.to_dict() if isinstance(v, _Record) else v for v in value]
+            result[key] = value
+        return result
+
+class ProductRecord(_Record):
+    __slots__ = ("nome", "codigo", "cfop", "quantidade", "unidade", "valor_unitario", "valor_total")
+    _keys = __slots__
+    _fields = frozenset(__slots__)
+
+    def __init__(self, p: dict):
+        # Nome, código, CFOP e unidade se repetem muito entre notas: as strings são internadas
+        self.nome = _intern(p["nome"])
+        self.codigo = _intern(p["codigo"])
+        self.cfop = _intern(p["cfop"])
+        self.quantidade = p["quantidade"]
+        self.unidade = _intern(p["unidade"])
+        self.valor_unitario = p["valor_unitario"]
+        self.valor_total = p["valor_total"]
+
+    def to_row(self) -> list:
+        return [self.nome, self.codigo, self.cfop, self.quantidade, self.unidade, self.valor_unitario, self.valor_total]
+
+    @classmethod
+    def from_row(cls, row: list) -> "ProductRecord":
+        # _intern em linha: este construtor roda uma vez por item ao reabrir um relatório salvo
+        p = cls.__new__(cls)
+        nome, codigo, cfop, p.quantidade, unidade, p.valor_unitario, p.valor_total = row
+        p.nome = sys.intern(nome) if nome.__class__ is str else nome
+        p.codigo = sys.intern(codigo) if codigo.__class__ is str else codigo
+        p.cfop = sys.intern(cfop) if cfop.__class__ is str else cfop
+        p.unidade = sys.intern(unidade) if unidade.__class__ is str else unidade
+        return p
+
+class IssuerRecord(_Record):
+    _keys = ("nome", "cnpj", "endereco")
+    __slots__ = _keys + ("__weakref__",)
+    _fields = frozenset(_keys)
+
+    # Um único registro por emitente, compartilhado por todas as suas notas
+    # (fraco: some quando nenhuma nota em memória usa mais o emitente, para
+    # não acumular emitentes de análises anteriores numa sessão longa)
+    _shared = weakref.WeakValueDictionary()
+
+    def __init__(self, nome, cnpj, endereco):
+        self.nome = nome
+        self.cnpj = cnpj
+        self.endereco = endereco
+
+    @classmethod
+    def shared(cls, emitente: dict):
+        if not emitente:
+            return emitente
+        return cls.shared_row((emitente.get("nome"), emitente.get("cnpj"), emitente.get("endereco")))
+
+    @classmethod
+    def shared_row(cls, key: tuple):
+        record = cls._shared.get(key)
+        if record is None:
+            record = cls._shared[key] = cls(*key)
+        return record
+
+class NoteRecord(_Record):
+    __slots__ = (
+        "nome", "nNF", "cNF", "valor", "status", "codigo_status", "autorizada",
+        "emitida", "cancelada", "produtos", "emitente", "chNFe", "modelo", "origem"
+    )
+    _keys = __slots__
+    _fields = frozenset(__slots__)
+
+    def __init__(self, detalhes: dict, origem: str = None):
+        self.nome = detalhes["nome"]
+        self.nNF = detalhes["nNF"]
+        self.cNF = detalhes["cNF"]
+        self.valor = detalhes["valor"]
+        self.status = _intern(detalhes["status"])
+        self.codigo_status = _intern(detalhes["codigo_status"])
+        self.autorizada = _intern(detalhes["autorizada"])
+        self.emitida = _intern(detalhes["emitida"])
+        self.cancelada = detalhes["cancelada"]
+        self.produtos = [ProductRecord(p) for p in detalhes["produtos"]]
+        self.emitente = IssuerRecord.shared(detalhes["emitente"])
+        self.chNFe = detalhes["chNFe"]
+        self.modelo = _intern(detalhes["modelo"])
+        # Entrada (ZIP, pasta ou XML) de onde a nota veio; a mesma string para todas as notas dela
+        self.origem = origem
+
+    def to_row(self) -> list:
+        """
+        Valores na ordem de __slots__, com produtos e emitente também em listas;
+        forma mais compacta e rápida de serializar que to_dict (ver from_row).
+        """
+        emitente = self.emitente
+        if emitente:
+            emitente = [emitente.nome, emitente.cnpj, emitente.endereco]
+        return [
+            self.nome, self.nNF, self.cNF, self.valor, self.status, self.codigo_status, self.autorizada,
+            self.emitida, self.cancelada, [p.to_row() for p in self.produtos], emitente, self.chNFe, self.modelo,
+            self.origem
+        ]
+
+    @classmethod
+    def from_row(cls, row: list) -> "NoteRecord":
+        nota = cls.__new__(cls)
+        (nota.nome, nota.nNF, nota.cNF, nota.valor, status, codigo_status, autorizada,
+         emitida, nota.cancelada, produtos, emitente, nota.chNFe, modelo, *origem) = row
+        nota.status = _intern(status)
+        nota.codigo_status = _intern(codigo_status)
+        nota.autorizada = _intern(autorizada)
+        nota.emitida = _intern(emitida)
+        nota.produtos = [ProductRecord.from_row(p) for p in produtos]
+        nota.emitente = IssuerRecord.shared_row(tuple(emitente)) if emitente else emitente
+        nota.modelo = _intern(modelo)
+        # Linhas gravadas antes da origem existir não a trazem
+        nota.origem = _intern(origem[0]) if origem else None
+        return nota
+
+def compact_note(detalhes: dict, origem: str = None) -> NoteRecord:
+    """
+    Converte o dict de extract_note_details em um NoteRecord compacto.
+    origem é a entrada da análise de onde a nota veio.
+    """
+    return NoteRecord(detalhes, origem)
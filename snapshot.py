@@ -0,0 +1,189 @@
+import os
+import json
+import time
+import zlib
+import sqlite3
+from collections.abc import Sequence
+
+from records import NoteRecord, compact_note
+from summary import report_summary
+
+# Incrementar quando o formato do arquivo mudar
+SNAPSHOT_VERSION = 2
+# Versões que ainda podem ser abertas (a 1 não tem a origem das notas)
+SNAPSHOT_READABLE = (1, 2)
+
+# Notas (ou itens das listas) gravadas por bloco compactado
+SNAPSHOT_BATCH = 1000
+
+# Listas do relatório gravadas junto com as notas; as chaves são tuplas
+SNAPSHOT_LISTS = ("errors", "duplicates", "missing_keys", "unofficial_keys", "cross_duplicates")
+_KEY_LISTS = ("duplicates", "missing_keys", "unofficial_keys")
+
+def _pack(items: list) -> bytes:
+    return zlib.compress(json.dumps(items, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), 1)
+
+def _unpack(blob: bytes) -> list:
+    return json.loads(zlib.decompress(blob))
+
+def _note_row(nota) -> list:
+    # Relatórios montados fora de process_xml_files podem ter notas em dict
+    if not isinstance(nota, NoteRecord):
+        nota = compact_note(nota)
+    return nota.to_row()
+
+def save_snapshot(report: dict, output_file: str, progress_dialog=None) -> None:
+    """
+    Grava o relatório completo (resumo, notas com produtos, erros, duplicadas,
+    chaves ausentes e fora do keys.csv, notas já vistas em outros arquivos)
+    em um arquivo SQLite, para ser reaberto
+    com load_snapshot ou ReportSnapshot sem reler os XMLs.
+    As notas vão em blocos de SNAPSHOT_BATCH, como listas (NoteRecord.to_row)
+    em JSON compactado com zlib.
+    Se o arquivo já existir, é substituído.
+    Se progress_dialog for informado, recebe o andamento (0 a 100) via setValue.
+    """
+    if os.path.exists(output_file):
+        os.remove(output_file)
+    notas = report.get("notas", [])
+    lists = {name: report.get(name) or [] for name in SNAPSHOT_LISTS}
+    total_items = max(len(notas) + sum(len(items) for items in lists.values()), 1)
+    done = 0
+
+    conn = sqlite3.connect(output_file)
+    try:
+        conn.execute("CREATE TABLE meta (nome TEXT PRIMARY KEY, valor TEXT NOT NULL)")
+        conn.execute("CREATE TABLE notas (bloco INTEGER PRIMARY KEY, quantidade INTEGER NOT NULL, dados BLOB NOT NULL)")
+        conn.execute(
+            "CREATE TABLE listas (nome TEXT NOT NULL, bloco INTEGER NOT NULL, dados BLOB NOT NULL, "
+            "PRIMARY KEY (nome, bloco))"
+        )
+        for bloco, start in enumerate(range(0, len(notas), SNAPSHOT_BATCH)):
+            batch = [_note_row(n) for n in notas[start:start + SNAPSHOT_BATCH]]
+            conn.execute("INSERT INTO notas VALUES (?, ?, ?)", (bloco, len(batch), _pack(batch)))
+            done += len(batch)
+            if progress_dialog:
+                progress_dialog.setValue(int(done / total_items * 100))
+
+        counts = {}
+        for name, items in lists.items():
+            # MissingKeys só lê as chaves do keys.csv aqui, ao ser percorrida
+            items = list(items)
+            counts[name] = len(items)
+            for bloco, start in enumerate(range(0, len(items), SNAPSHOT_BATCH)):
+                batch = items[start:start + SNAPSHOT_BATCH]
+                conn.execute("INSERT INTO listas VALUES (?, ?, ?)", (name, bloco, _pack(batch)))
+                done += len(batch)
+                if progress_dialog:
+                    progress_dialog.setValue(int(done / total_items * 100))
+
+        meta = {
+            "versao": SNAPSHOT_VERSION,
+            "criado": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "total_notas": len(notas),
+            "resumo": report_summary(report),
+            "listas": counts,
+        }
+        conn.executemany("INSERT INTO meta VALUES (?, ?)", [(k, json.dumps(v, ensure_ascii=False)) for k, v in meta.items()])
+        conn.commit()
+    finally:
+        conn.close()
+    if progress_dialog:
+        progress_dialog.setValue(100)
+
+class SnapshotList(Sequence):
+    """
+    Lista somente leitura de um relatório salvo (erros, duplicadas, chaves).
+    len() vem do cabeçalho; os itens só são lidos do arquivo no primeiro acesso.
+    """
+
+    def __init__(self, path: str, name: str, count: int):
+        self.path = path
+        self.name = name
+        self._count = count
+        self._items = None
+
+    def _load(self) -> list:
+        if self._items is None:
+            items = []
+            if self._count:
+                conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+                try:
+                    rows = conn.execute("SELECT dados FROM listas WHERE nome = ? ORDER BY bloco", (self.name,))
+                    for (dados,) in rows:
+                        items.extend(_unpack(dados))
+                finally:
+                    conn.close()
+            if self.name in _KEY_LISTS:
+                items = [tuple(item) for item in items]
+            elif self.name == "cross_duplicates":
+                items = [(tuple(key), origem) for key, origem in items]
+            self._items = items
+        return self._items
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        return self._load()[i]
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __repr__(self):
+        return f"SnapshotList({self.name!r}, {self._count} itens)"
+
+class ReportSnapshot:
+    """
+    Relatório salvo por save_snapshot, aberto para leitura.
+
+    header() devolve o relatório sem as notas (resumo completo e listas
+    preguiçosas), disponível logo após abrir o arquivo; iter_batches() gera
+    as notas em blocos, na ordem original, para que a interface mostre as
+    primeiras linhas enquanto o restante é lido.
+    """
+
+    def __init__(self, path: str):
+        self.path = os.path.abspath(path)
+        if not os.path.isfile(self.path):
+            raise FileNotFoundError(f"Arquivo '{path}' não encontrado.")
+        self.conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        try:
+            rows = self.conn.execute("SELECT nome, valor FROM meta").fetchall()
+        except sqlite3.DatabaseError:
+            self.conn.close()
+            raise ValueError(f"'{path}' não é um relatório salvo.")
+        self.meta = {nome: json.loads(valor) for nome, valor in rows}
+        if self.meta.get("versao") not in SNAPSHOT_READABLE:
+            self.conn.close()
+            raise ValueError(f"'{path}' foi salvo em um formato incompatível (versão {self.meta.get('versao')}).")
+        self.total_notas = self.meta["total_notas"]
+
+    def header(self) -> dict:
+        report = {"resumo": self.meta["resumo"], "notas": []}
+        for name in SNAPSHOT_LISTS:
+            report[name] = SnapshotList(self.path, name, self.meta["listas"].get(name, 0))
+        return report
+
+    def iter_batches(self):
+        for (dados,) in self.conn.execute("SELECT dados FROM notas ORDER BY bloco"):
+            yield [NoteRecord.from_row(row) for row in _unpack(dados)]
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def load_snapshot(path: str) -> dict:
+    """
+    Reabre um relatório salvo por save_snapshot, com todas as notas.
+    """
+    with ReportSnapshot(path) as snapshot:
+        report = snapshot.header()
+        for batch in snapshot.iter_batches():
+            report["notas"].extend(batch)
+    return report
@@ -0,0 +1,91 @@
+AUTHORIZED_STATUS = "autorizada"
+
+class ReportSummary:
+    """
+    Totais de um conjunto de notas, acumulados nota a nota com add():
+    quantidade e valor no geral, por status, por modelo e por origem (a entrada
+    da análise de onde a nota veio, quando conhecida). É preenchido
+    durante o parsing (process_xml_files), no monitoramento de pasta e nos
+    filtros, e o resultado de to_dict() fica em report["resumo"], usado pela
+    interface e pelos exportadores sem percorrer as notas de novo.
+    """
+
+    def __init__(self):
+        self.total_notas = 0
+        self.valor_total = 0.0
+        # status/modelo -> [quantidade, valor]
+        self.by_status = {}
+        self.by_model = {}
+        self.by_origin = {}
+
+    def add(self, nota) -> None:
+        valor = nota.get("valor") or 0.0
+        self.total_notas += 1
+        self.valor_total += valor
+        for groups, name in ((self.by_status, nota.get("status") or ""), (self.by_model, nota.get("modelo") or "")):
+            acc = groups.get(name)
+            if acc is None:
+                acc = groups[name] = [0, 0.0]
+            acc[0] += 1
+            acc[1] += valor
+        origem = nota.get("origem")
+        if origem is not None:
+            acc = self.by_origin.get(origem)
+            if acc is None:
+                acc = self.by_origin[origem] = [0, 0.0]
+            acc[0] += 1
+            acc[1] += valor
+
+    def add_totals(self, status: str, modelo: str, count: int, valor: float, origem: str = None) -> None:
+        """
+        Soma totais já agrupados por status, modelo e origem (como os de um GROUP BY em SQL).
+        """
+        self.total_notas += count
+        self.valor_total += valor
+        groups = [(self.by_status, status or ""), (self.by_model, modelo or "")]
+        if origem is not None:
+            groups.append((self.by_origin, origem))
+        for group, name in groups:
+            acc = group.setdefault(name, [0, 0.0])
+            acc[0] += count
+            acc[1] += valor
+
+    @classmethod
+    def from_notas(cls, notas) -> "ReportSummary":
+        summary = cls()
+        for nota in notas:
+            summary.add(nota)
+        return summary
+
+    def status_totals(self, status: str) -> tuple:
+        """
+        (quantidade, valor) das notas com o status informado, sem diferenciar maiúsculas.
+        """
+        count, valor = 0, 0.0
+        for name, (n, v) in self.by_status.items():
+            if name.lower() == status:
+                count += n
+                valor += v
+        return count, valor
+
+    def to_dict(self) -> dict:
+        autorizadas, valor_autorizadas = self.status_totals(AUTHORIZED_STATUS)
+        return {
+            "total_notas": self.total_notas,
+            "valor_total": self.valor_total,
+            "notas_autorizadas": autorizadas,
+            "valor_autorizadas": valor_autorizadas,
+            "por_status": {name: {"notas": n, "valor": v} for name, (n, v) in self.by_status.items()},
+            "por_modelo": {name: {"notas": n, "valor": v} for name, (n, v) in self.by_model.items()},
+            "por_origem": {name: {"notas": n, "valor": v} for name, (n, v) in self.by_origin.items()}
+        }
+
+def report_summary(report: dict) -> dict:
+    """
+    report["resumo"] completo; relatórios sem os totais por status (montados
+    fora de process_xml_files) são resumidos a partir das notas.
+    """
+    resumo = report.get("resumo") or {}
+    if "por_status" in resumo and resumo.get("total_notas") == len(report.get("notas", [])):
+        return resumo
+    return ReportSummary.from_notas(report.get("notas", [])).to_dict()
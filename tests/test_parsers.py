@@ -0,0 +1,67 @@
+"""
+Paridade entre os backends de parsing (EXTRACTORS) e entre os modos de
+execução de process_xml_files: serial, pool de processos e pipeline assíncrono.
+"""
+import os
+import shutil
+
+import pytest
+
+from processing import EXTRACTORS, LET, PARSE_ERRORS, _parse_xml_file, process_xml_files
+from pipeline import run_pipeline
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+NOTAS = ["nfce_autorizada.xml", "nfe_cancelada.xml", "sem_protocolo.xml", "nao_nfe.xml"]
+INVALIDOS = ["malformado.xml", "vazio.xml"]
+BACKENDS = [name for name in EXTRACTORS if name != "lxml" or LET is not None]
+
+
+def _fixture(name: str) -> str:
+    return os.path.join(FIXTURES, name)
+
+
+def _resultado(report: dict) -> tuple:
+    return report["notas"], report["duplicates"], report["errors"]
+
+
+@pytest.fixture
+def corpus(tmp_path) -> list:
+    for name in NOTAS + INVALIDOS:
+        shutil.copy(_fixture(name), tmp_path / name)
+    # A mesma nota com outro nome: continua em notas e aparece em duplicates
+    shutil.copy(_fixture("nfce_autorizada.xml"), tmp_path / "nfce_autorizada_copia.xml")
+    return sorted(str(path) for path in tmp_path.iterdir())
+
+
+@pytest.mark.parametrize("name", NOTAS)
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_backends_extraem_os_mesmos_detalhes(backend, name):
+    path = _fixture(name)
+    esperado = EXTRACTORS["etree"](path)
+    assert EXTRACTORS[backend](path) == esperado
+    with open(path, "rb") as f:
+        assert EXTRACTORS[backend](path, f.read()) == esperado
+
+
+@pytest.mark.parametrize("name", INVALIDOS)
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_backends_tratam_erros_de_parse_igual(backend, name):
+    path = _fixture(name)
+    with pytest.raises(PARSE_ERRORS):
+        EXTRACTORS[backend](path)
+    details, error = _parse_xml_file(path, backend)
+    assert details is None
+    assert error.startswith(f"Erro parse '{path}':")
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_serial_pool_e_pipeline_dao_o_mesmo_relatorio(corpus, backend):
+    serial = process_xml_files(corpus, workers=1, parser=backend, cache=False)
+    assert len(serial["notas"]) == len(NOTAS) + 1 and serial["duplicates"]
+    assert len(serial["errors"]) == len(INVALIDOS)
+    assert serial["notas"] == process_xml_files(corpus, workers=1, parser="etree", cache=False)["notas"]
+
+    esperado = _resultado(serial)
+    pool = process_xml_files(corpus, workers=2, chunksize=2, parser=backend, cache=False)
+    assert _resultado(pool) == esperado
+    assert _resultado(run_pipeline(corpus, workers=2, chunksize=2, parser=backend, cache=False)) == esperado
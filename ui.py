@@ -2,16 +2,24 @@ import qtawesome as qta
 from PyQt6.QtWidgets import (
     QMainWindow, QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QWidget,
     QFileDialog, QMessageBox, QProgressDialog, QFormLayout, QGroupBox, QDateEdit,
-    QLineEdit, QDialog, QScrollArea, QComboBox, QTextEdit, QTableView
+    QLineEdit, QDialog, QScrollArea, QComboBox, QTextEdit, QTableView, QCheckBox, QListWidget
 )
-from PyQt6.QtCore import Qt, QDate, QRegularExpression, QObject, pyqtSignal, QRunnable, QThreadPool, QModelIndex, QAbstractTableModel
+from PyQt6.QtCore import Qt, QDate, QRegularExpression, QObject, pyqtSignal, QRunnable, QThreadPool, QModelIndex, QAbstractTableModel, QTimer
 from PyQt6.QtGui import QRegularExpressionValidator, QBrush, QColor
-import datetime
 import os
+import sys
 import locale
-
-from processing import analyze_file
-from export import export_to_pdf, export_to_txt, export_to_csv, export_to_excel
+from array import array
+from collections import deque
+
+from processing import analyze_files, clear_parse_cache, load_setting, IncrementalAnalysis
+from export import export_to_pdf, export_to_txt, export_to_csv, export_to_excel, export_product_summary, snapshot_report
+from analytics import GROUPINGS, aggregate_products, cached_product_aggregates, store_product_aggregates
+from summary import ReportSummary, report_summary
+from snapshot import ReportSnapshot, save_snapshot
+from warehouse import open_warehouse
+from filters import NoteIndex, subset_report
+from progress import ProgressChannel, AnalysisCancelled
 
 locale.setlocale(locale.LC_ALL, '')
 
@@ -24,81 +32,491 @@ def format_currency(value: float) -> str:
     except Exception:
         return f"R$ {value:,.2f}"
 
+PHASE_LABELS = {
+    "extract": "Localizando XMLs",
+    "parse": "Lendo XMLs",
+    "reconcile": "Conferindo chaves oficiais",
+    "export": "Exportando",
+}
+
+def format_progress(info: dict) -> str:
+    """
+    Texto do diálogo de progresso: fase, quantidade, arquivos/s e tempo restante.
+    """
+    text = PHASE_LABELS.get(info["phase"], "Processando")
+    if info["total"]:
+        text += f": {info['done']} de {info['total']}"
+        if info["rate"]:
+            text += f" ({info['rate']:.0f} arq/s"
+            if info["eta"] is not None:
+                text += f", restam ~{int(info['eta']) + 1}s"
+            text += ")"
+    return text + "..."
+
 class WorkerSignals(QObject):
     finished = pyqtSignal(dict)
+    collected = pyqtSignal(list)
     error = pyqtSignal(str)
+    progress = pyqtSignal(dict)
+    cancelled = pyqtSignal()
+    opened = pyqtSignal(dict)
+    notes = pyqtSignal(list)
 
 class AnalyzeWorker(QRunnable):
-    def __init__(self, file_path: str):
+    """
+    Roda analyze_files fora da thread da interface. O andamento chega pelo sinal
+    progress, as notas já lidas pelo sinal notes (em listas, durante a análise)
+    e cancel() pode ser chamado da interface a qualquer momento.
+    """
+    def __init__(self, file_paths: list):
         super().__init__()
-        self.file_path = file_path
+        self.file_paths = file_paths
         self.signals = WorkerSignals()
+        self.channel = ProgressChannel(self.signals.progress.emit)
+
+    def cancel(self):
+        self.channel.cancel()
 
     def run(self):
         try:
-            report = analyze_file(self.file_path, progress_dialog=None)
+            report = analyze_files(self.file_paths, progress=self.channel, sink=self.signals.notes.emit)
             self.signals.finished.emit(report)
+        except AnalysisCancelled:
+            self.signals.cancelled.emit()
+        except Exception as e:
+            self.signals.error.emit(str(e))
+
+EXPORTERS = {
+    "pdf": export_to_pdf,
+    "txt": export_to_txt,
+    "csv": export_to_csv,
+    "xlsx": export_to_excel,
+    "produtos": export_product_summary,
+    "snapshot": save_snapshot,
+}
+
+class ExportWorker(QRunnable):
+    """
+    Gera um arquivo de exportação fora da thread da interface, a partir de uma
+    cópia do relatório (snapshot_report), para que os filtros possam continuar
+    em uso. Se for cancelado ou falhar, o arquivo parcial é removido.
+    """
+    def __init__(self, format_type: str, report: dict, output_file: str, by_product: bool = False):
+        super().__init__()
+        self.format_type = format_type
+        self.report = report
+        self.output_file = output_file
+        self.by_product = by_product
+        self.signals = WorkerSignals()
+        self.channel = ProgressChannel(self.signals.progress.emit)
+
+    def cancel(self):
+        self.channel.cancel()
+
+    def _remove_partial(self):
+        try:
+            os.remove(self.output_file)
+        except OSError:
+            pass
+
+    def run(self):
+        try:
+            self.channel.set_phase("export", 100)
+            options = {"by_product": True} if self.by_product else {}
+            EXPORTERS[self.format_type](self.report, self.output_file, progress_dialog=self.channel, **options)
+            self.signals.finished.emit({"file": self.output_file})
+        except AnalysisCancelled:
+            self._remove_partial()
+            self.signals.cancelled.emit()
+        except Exception as e:
+            self._remove_partial()
+            self.signals.error.emit(str(e))
+
+class AggregateWorker(QRunnable):
+    """
+    Calcula os totais de produtos (analytics.aggregate_products) fora da
+    interface, sobre uma cópia da lista de notas: o relatório não é tocado
+    nesta thread, e o resultado é guardado nele pela interface.
+    """
+    def __init__(self, notas: list):
+        super().__init__()
+        self.notas = notas
+        self.signals = WorkerSignals()
+
+    def run(self):
+        try:
+            self.signals.finished.emit({"aggregates": aggregate_products(self.notas)})
         except Exception as e:
             self.signals.error.emit(str(e))
 
+class SnapshotLoadWorker(QRunnable):
+    """
+    Reabre um relatório salvo: emite opened com o cabeçalho (resumo e listas)
+    e depois notes a cada bloco de notas lido, para a tabela ser preenchida
+    aos poucos.
+    """
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self.signals = WorkerSignals()
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        try:
+            with ReportSnapshot(self.path) as snapshot:
+                self.signals.opened.emit(snapshot.header())
+                for batch in snapshot.iter_batches():
+                    if self.cancelled:
+                        self.signals.cancelled.emit()
+                        return
+                    self.signals.notes.emit(batch)
+            self.signals.finished.emit({"file": self.path})
+        except Exception as e:
+            self.signals.error.emit(str(e))
+
+class WarehouseIngestWorker(QRunnable):
+    """
+    Inclui as notas de um relatório na base de notas (warehouse.py).
+    """
+    def __init__(self, report: dict, origem: str):
+        super().__init__()
+        self.notas = list(report.get("notas", []))
+        self.origem = origem
+        self.signals = WorkerSignals()
+
+    def run(self):
+        try:
+            with open_warehouse() as warehouse:
+                inserted, existing = warehouse.ingest(self.notas, self.origem)
+                total = len(warehouse)
+            self.signals.finished.emit({"inserted": inserted, "existing": existing, "total": total})
+        except Exception as e:
+            self.signals.error.emit(str(e))
+
+class WarehouseQueryWorker(QRunnable):
+    """
+    Aplica os filtros como consulta SQL na base de notas; só as notas
+    selecionadas são carregadas.
+    """
+    def __init__(self, criteria: dict, seq: int):
+        super().__init__()
+        self.criteria = criteria
+        self.seq = seq
+        self.signals = WorkerSignals()
+
+    def run(self):
+        try:
+            with open_warehouse() as warehouse:
+                report = warehouse.report(**self.criteria)
+            self.signals.finished.emit({"seq": self.seq, "report": report})
+        except Exception as e:
+            self.signals.error.emit(str(e))
+
+class ScanWorker(QRunnable):
+    """
+    Lê os XMLs novos de uma IncrementalAnalysis; o merge é feito na thread da interface.
+    """
+    def __init__(self, analysis: IncrementalAnalysis):
+        super().__init__()
+        self.analysis = analysis
+        self.signals = WorkerSignals()
+
+    def run(self):
+        try:
+            results = self.analysis.collect()
+            self.signals.collected.emit(results)
+        except Exception as e:
+            self.signals.error.emit(str(e))
+
+class FilterWorker(QRunnable):
+    """
+    Aplica os filtros fora da thread da interface. O NoteIndex é montado na
+    primeira execução para cada relatório e devolvido para ser reaproveitado.
+    """
+    def __init__(self, report: dict, index, criteria: dict, seq: int):
+        super().__init__()
+        self.report = report
+        self.notas = list(report.get("notas", []))
+        self.index = index
+        self.criteria = criteria
+        self.seq = seq
+        self.signals = WorkerSignals()
+
+    def run(self):
+        try:
+            index = self.index if self.index is not None else NoteIndex(self.notas)
+            ids = index.query_ids(**self.criteria)
+            filtered = subset_report(self.report, index, ids)
+            self.signals.finished.emit({"seq": self.seq, "index": index, "report": filtered, "ids": ids})
+        except Exception as e:
+            self.signals.error.emit(str(e))
+
+def _nnf_sort_key(nota) -> int:
+    # Números em ordem numérica; valores não numéricos ("N/A") ficam no fim, na ordem de leitura
+    nNF = nota.get("nNF") or ""
+    return int(nNF) if nNF.isdigit() else sys.maxsize
+
 class NotasTableModel(QAbstractTableModel):
+    """
+    Modelo da tabela de notas, pensado para relatórios com milhões de linhas:
+      - os textos de cada linha são formatados uma vez, na primeira exibição;
+      - os QBrush de status são compartilhados por todas as linhas;
+      - as linhas chegam à view em lotes de FETCH_BATCH (canFetchMore/fetchMore);
+      - a ordenação usa chaves calculadas uma vez por coluna e guarda a
+        permutação resultante, reaproveitada por filtros seguintes.
+    A view mostra self._rows, posições em self._notas; um filtro só troca
+    essas posições (setRows), sem refazer os caches.
+    """
+    FETCH_BATCH = 1000
+
+    STATUS_BRUSHES = {
+        "autorizada": QBrush(QColor(200, 255, 200)),
+        "cancelada": QBrush(QColor(255, 200, 200)),
+        "sem protocolo": QBrush(QColor(255, 255, 200)),
+    }
+
+    SORT_KEYS = (
+        _nnf_sort_key,
+        lambda nota: nota.get("chNFe") or "",
+        lambda nota: nota.get("valor", 0),
+        lambda nota: nota.get("status") or "",
+        lambda nota: nota.get("emitida") or "",
+        lambda nota: nota.get("autorizada") or "",
+    )
+
     def __init__(self, notas: list, parent=None):
         super().__init__(parent)
-        self._notas = notas
         # Cabeçalho padrão; será atualizado em display_report conforme o modelo
         self._headers = ["Número NFC-e", "Chave", "Valor (R$)", "Status", "Data de Emissão", "Data de Autorização"]
+        self._sort_column = -1
+        self._sort_order = Qt.SortOrder.AscendingOrder
+        self._set_notas(notas)
+
+    def _set_notas(self, notas: list):
+        # Listas são copiadas, pois appendData estende a do modelo; sequências
+        # somente leitura (ex.: warehouse.WarehouseNotes) são lidas conforme exibidas
+        self._notas = list(notas) if isinstance(notas, list) else notas
+        self._display = [None] * len(self._notas)
+        self._perms = {}
+        self._subset = None
+        self._rows = self._ordered_rows()
+        self._loaded = min(len(self._rows), self.FETCH_BATCH)
+
+    def _format_row(self, pos: int) -> tuple:
+        nota = self._notas[pos]
+        row = (
+            nota.get("nNF", "N/A"),
+            nota.get("chNFe") or "N/A",
+            format_currency(nota.get("valor", 0)),
+            nota.get("status", ""),
+            nota.get("emitida", ""),
+            nota.get("autorizada", ""),
+            self.STATUS_BRUSHES.get((nota.get("status") or "").lower()),
+        )
+        self._display[pos] = row
+        return row
+
+    def _permutation(self, column: int) -> array:
+        perm = self._perms.get(column)
+        if perm is None:
+            key = self.SORT_KEYS[column]
+            keys = [key(nota) for nota in self._notas]
+            perm = self._perms[column] = array("l", sorted(range(len(keys)), key=keys.__getitem__))
+        return perm
+
+    def _ordered_rows(self) -> array:
+        """
+        Posições visíveis (todas ou só as de setRows) na ordem atual.
+        """
+        if 0 <= self._sort_column < len(self.SORT_KEYS):
+            order = self._permutation(self._sort_column)
+            if self._sort_order == Qt.SortOrder.DescendingOrder:
+                order = order[::-1]
+            if self._subset is None:
+                return order
+            mask = self._subset
+            return array("l", [pos for pos in order if mask[pos]])
+        if self._subset is None:
+            return array("l", range(len(self._notas)))
+        mask = self._subset
+        return array("l", [pos for pos in range(len(self._notas)) if mask[pos]])
 
     def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
-        return len(self._notas)
+        if parent.isValid():
+            return 0
+        return self._loaded
 
     def columnCount(self, parent: QModelIndex = QModelIndex()) -> int:
         return len(self._headers)
 
+    def canFetchMore(self, parent: QModelIndex = QModelIndex()) -> bool:
+        return not parent.isValid() and self._loaded < len(self._rows)
+
+    def fetchMore(self, parent: QModelIndex = QModelIndex()):
+        if parent.isValid():
+            return
+        count = min(self.FETCH_BATCH, len(self._rows) - self._loaded)
+        if count <= 0:
+            return
+        self.beginInsertRows(QModelIndex(), self._loaded, self._loaded + count - 1)
+        self._loaded += count
+        self.endInsertRows()
+
+    def data(self, index: QModelIndex, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        if role != Qt.ItemDataRole.DisplayRole and role != Qt.ItemDataRole.BackgroundRole:
+            return None
+        pos = self._rows[index.row()]
+        row = self._display[pos] or self._format_row(pos)
+        if role == Qt.ItemDataRole.DisplayRole:
+            return row[index.column()]
+        return row[6]
+
+    def headerData(self, section: int, orientation: Qt.Orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return self._headers[section]
+        return None
+
+    def sort(self, column: int, order=Qt.SortOrder.AscendingOrder):
+        self.layoutAboutToBeChanged.emit()
+        self._sort_column = column
+        self._sort_order = order
+        self._rows = self._ordered_rows()
+        self.layoutChanged.emit()
+
+    def note_count(self) -> int:
+        """
+        Quantidade de notas no modelo, visíveis ou não (ver setRows).
+        """
+        return len(self._notas)
+
+    def nota_at(self, row: int):
+        """
+        Nota exibida na linha row da view (considerando ordenação e filtro).
+        """
+        return self._notas[self._rows[row]]
+
+    def updateData(self, notas: list):
+        self.beginResetModel()
+        self._set_notas(notas)
+        self.endResetModel()
+
+    def setRows(self, positions=None):
+        """
+        Mostra só as notas nas posições informadas (None = todas), mantendo os caches.
+        """
+        self.beginResetModel()
+        if positions is None:
+            self._subset = None
+        else:
+            self._subset = bytearray(len(self._notas))
+            for pos in positions:
+                self._subset[pos] = 1
+        self._rows = self._ordered_rows()
+        self._loaded = min(len(self._rows), self.FETCH_BATCH)
+        self.endResetModel()
+
+    def appendData(self, notas: list):
+        """
+        Acrescenta notas ao final (modo de monitoramento). Sob um filtro (setRows)
+        elas ficam ocultas até o filtro ser reaplicado.
+        """
+        if not notas:
+            return
+        first_pos = len(self._notas)
+        self._notas.extend(notas)
+        self._display.extend([None] * len(notas))
+        if self._subset is not None:
+            self._subset.extend(bytes(len(notas)))
+            return
+        if self._sort_column >= 0:
+            # Com ordenação, as notas novas podem cair em qualquer posição
+            self.beginResetModel()
+            self._perms = {}
+            self._rows = self._ordered_rows()
+            self._loaded = min(len(self._rows), max(self._loaded, self.FETCH_BATCH))
+            self.endResetModel()
+            return
+        all_loaded = self._loaded == len(self._rows)
+        self._rows.extend(range(first_pos, len(self._notas)))
+        # Se tudo já estava carregado, as linhas novas aparecem direto; senão, via fetchMore
+        if all_loaded:
+            self.beginInsertRows(QModelIndex(), self._loaded, len(self._rows) - 1)
+            self._loaded = len(self._rows)
+            self.endInsertRows()
+
+class ProductSummaryModel(QAbstractTableModel):
+    """
+    Linhas de um agrupamento de ProductAggregates (ver analytics.py).
+    """
+    HEADERS = ["Chave", "Descrição", "Itens", "Quantidade", "Valor Total"]
+
+    def __init__(self, rows: list, parent=None):
+        super().__init__(parent)
+        self._rows = rows
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self._rows)
+
+    def columnCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return len(self.HEADERS)
+
     def data(self, index: QModelIndex, role=Qt.ItemDataRole.DisplayRole):
         if not index.isValid():
             return None
-        nota = self._notas[index.row()]
+        row = self._rows[index.row()]
         col = index.column()
         if role == Qt.ItemDataRole.DisplayRole:
             if col == 0:
-                return nota.get("nNF", "N/A")
+                return row["chave"] or "(vazio)"
             elif col == 1:
-                return nota.get("chNFe") or "N/A"
+                return row["descricao"]
             elif col == 2:
-                return format_currency(nota.get("valor", 0))
+                return str(row["itens"])
             elif col == 3:
-                return nota.get("status", "")
+                return f"{row['quantidade']:,.4f}"
             elif col == 4:
-                return nota.get("emitida", "")
-            elif col == 5:
-                return nota.get("autorizada", "")
-        elif role == Qt.ItemDataRole.BackgroundRole:
-            status_lower = (nota.get("status") or "").lower()
-            if status_lower == "autorizada":
-                return QBrush(QColor(200, 255, 200))
-            elif status_lower == "cancelada":
-                return QBrush(QColor(255, 200, 200))
-            elif status_lower == "sem protocolo":
-                return QBrush(QColor(255, 255, 200))
+                return format_currency(row["valor_total"])
+        elif role == Qt.ItemDataRole.TextAlignmentRole and col >= 2:
+            return Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter
         return None
 
     def headerData(self, section: int, orientation: Qt.Orientation, role=Qt.ItemDataRole.DisplayRole):
         if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
-            return self._headers[section]
+            return self.HEADERS[section]
         return None
 
-    def updateData(self, notas: list):
+    def updateData(self, rows: list):
         self.beginResetModel()
-        self._notas = notas
+        self._rows = rows
         self.endResetModel()
 
 class NFCeAnalyzerApp(QMainWindow):
     def __init__(self):
         super().__init__()
-        self.last_file_path = None
+        # Entradas (ZIPs, XMLs, pastas) da última análise, para reanalisar
+        self.last_inputs = []
         self.last_report = None
         self.filtered_report = None
         self.threadpool = QThreadPool()
+        self.analysis_worker = None
+        self.streamed_summary = None
+        self.snapshot_worker = None
+        # Exportações em andamento ou na fila: id -> {"worker", "dialog", "name"}
+        self.export_jobs = {}
+        self.export_queue = deque()
+        self.export_seq = 0
+        self.exports_running = 0
+        self.watch_analysis = None
+        self.watch_running = False
+        self.watch_timer = QTimer(self)
+        self.watch_timer.timeout.connect(self.watch_tick)
+        self.filter_index = None
+        self.filter_seq = 0
         self.initUI()
 
     def initUI(self):
@@ -113,18 +531,50 @@ class NFCeAnalyzerApp(QMainWindow):
 
         button_layout = QHBoxLayout()
 
-        analyze_button = QPushButton(" Analisar Arquivo")
+        analyze_button = QPushButton(" Analisar Arquivos")
         analyze_button.setIcon(qta.icon('fa.file-o'))
         analyze_button.clicked.connect(self.on_analyze)
         button_layout.addWidget(analyze_button)
 
-        reanalyze_button = QPushButton(" Reanalisar Arquivo")
+        analyze_many_button = QPushButton(" Analisar Várias Entradas")
+        analyze_many_button.setIcon(qta.icon('fa.files-o'))
+        analyze_many_button.clicked.connect(self.on_analyze_many)
+        button_layout.addWidget(analyze_many_button)
+
+        reanalyze_button = QPushButton(" Reanalisar")
         reanalyze_button.setIcon(qta.icon('fa.refresh'))
         reanalyze_button.clicked.connect(self.on_reanalyze)
         reanalyze_button.setEnabled(False)
         self.reanalyze_button = reanalyze_button
         button_layout.addWidget(reanalyze_button)
 
+        open_snapshot_button = QPushButton(" Abrir Análise")
+        open_snapshot_button.setIcon(qta.icon('fa.folder-open'))
+        open_snapshot_button.clicked.connect(self.on_open_snapshot)
+        button_layout.addWidget(open_snapshot_button)
+
+        save_snapshot_button = QPushButton(" Salvar Análise")
+        save_snapshot_button.setIcon(qta.icon('fa.save'))
+        save_snapshot_button.clicked.connect(self.on_save_snapshot)
+        button_layout.addWidget(save_snapshot_button)
+
+        ingest_button = QPushButton(" Incluir na Base")
+        ingest_button.setIcon(qta.icon('fa.database'))
+        ingest_button.clicked.connect(self.on_ingest_warehouse)
+        button_layout.addWidget(ingest_button)
+
+        watch_button = QPushButton(" Monitorar Pasta")
+        watch_button.setIcon(qta.icon('fa.eye'))
+        watch_button.setCheckable(True)
+        watch_button.toggled.connect(self.on_watch_toggled)
+        self.watch_button = watch_button
+        button_layout.addWidget(watch_button)
+
+        clear_cache_button = QPushButton(" Limpar Cache")
+        clear_cache_button.setIcon(qta.icon('fa.trash'))
+        clear_cache_button.clicked.connect(self.on_clear_cache)
+        button_layout.addWidget(clear_cache_button)
+
         compare_pdf_button = QPushButton(" Comparar PDF")
         compare_pdf_button.setIcon(qta.icon('fa.file-pdf-o'))
         compare_pdf_button.clicked.connect(self.on_compare_pdf)
@@ -177,6 +627,10 @@ class NFCeAnalyzerApp(QMainWindow):
         self.max_value_filter.setValidator(QRegularExpressionValidator(QRegularExpression(r"^\d+(\.\d{1,2})?$")))
         filters_layout.addRow("Valor Máximo (R$):", self.max_value_filter)
 
+        self.warehouse_checkbox = QCheckBox("Consultar a base de notas (todas as análises incluídas)")
+        self.warehouse_checkbox.toggled.connect(self.on_warehouse_toggled)
+        filters_layout.addRow(self.warehouse_checkbox)
+
         apply_filters_button = QPushButton("Aplicar Filtros")
         apply_filters_button.setIcon(qta.icon('fa.filter'))
         apply_filters_button.clicked.connect(self.apply_filters)
@@ -188,6 +642,9 @@ class NFCeAnalyzerApp(QMainWindow):
         self.table_view = QTableView()
         self.model = NotasTableModel([])
         self.table_view.setModel(self.model)
+        # Sem indicador inicial: a tabela abre na ordem de leitura dos arquivos
+        self.table_view.horizontalHeader().setSortIndicator(-1, Qt.SortOrder.AscendingOrder)
+        self.table_view.setSortingEnabled(True)
         self.table_view.doubleClicked.connect(self.on_note_double_click)
         main_layout.addWidget(self.table_view)
 
@@ -221,6 +678,11 @@ class NFCeAnalyzerApp(QMainWindow):
         btn_csv_excel.clicked.connect(self.export_csv_or_excel)
         export_layout.addWidget(btn_csv_excel)
 
+        btn_products = QPushButton(" Resumo de Produtos")
+        btn_products.setIcon(qta.icon('fa.bar-chart'))
+        btn_products.clicked.connect(self.on_product_summary)
+        export_layout.addWidget(btn_products)
+
         main_layout.addLayout(export_layout)
 
         container = QWidget()
@@ -228,34 +690,290 @@ class NFCeAnalyzerApp(QMainWindow):
         self.setCentralWidget(container)
 
     def on_analyze(self):
-        file_path, _ = QFileDialog.getOpenFileName(
-            self, "Selecionar Arquivo XML ou ZIP", "", "Arquivos (*.xml *.zip)"
+        file_paths, _ = QFileDialog.getOpenFileNames(
+            self, "Selecionar Arquivos XML ou ZIP", "", "Arquivos (*.xml *.zip)"
         )
-        if not file_path:
+        if not file_paths:
             return
-        self.last_file_path = file_path
-        self.start_analysis(file_path)
+        self.watch_button.setChecked(False)
+        self.last_inputs = file_paths
+        self.start_analysis(file_paths)
+
+    def on_analyze_many(self):
+        file_paths = self.select_inputs()
+        if not file_paths:
+            return
+        self.watch_button.setChecked(False)
+        self.last_inputs = file_paths
+        self.start_analysis(file_paths)
+
+    def select_inputs(self) -> list:
+        """
+        Diálogo para montar a lista de entradas (ZIPs, XMLs e pastas) de uma
+        análise conjunta. Devolve a lista, ou [] se for cancelado.
+        """
+        dlg = QDialog(self)
+        dlg.setWindowTitle("Entradas da Análise")
+        dlg.resize(600, 400)
+        ly = QVBoxLayout(dlg)
+        ly.addWidget(QLabel("As notas de todas as entradas são analisadas juntas, com duplicadas procuradas entre elas."))
+        inputs = QListWidget()
+        for path in self.last_inputs:
+            inputs.addItem(path)
+        ly.addWidget(inputs)
+
+        def add_paths(paths):
+            present = {inputs.item(i).text() for i in range(inputs.count())}
+            for path in paths:
+                if path and path not in present:
+                    inputs.addItem(path)
+                    present.add(path)
+
+        def add_files():
+            paths, _ = QFileDialog.getOpenFileNames(dlg, "Adicionar Arquivos XML ou ZIP", "", "Arquivos (*.xml *.zip)")
+            add_paths(paths)
+
+        def add_folder():
+            add_paths([QFileDialog.getExistingDirectory(dlg, "Adicionar Pasta")])
+
+        def remove_selected():
+            for item in inputs.selectedItems():
+                inputs.takeItem(inputs.row(item))
+
+        btn_ly = QHBoxLayout()
+        for text, slot in (("Adicionar Arquivos", add_files), ("Adicionar Pasta", add_folder), ("Remover", remove_selected)):
+            btn = QPushButton(text)
+            btn.clicked.connect(slot)
+            btn_ly.addWidget(btn)
+        btn_ly.addStretch()
+        btn_ok = QPushButton("Analisar")
+        btn_ok.clicked.connect(dlg.accept)
+        btn_ly.addWidget(btn_ok)
+        btn_cancel = QPushButton("Cancelar")
+        btn_cancel.clicked.connect(dlg.reject)
+        btn_ly.addWidget(btn_cancel)
+        ly.addLayout(btn_ly)
+
+        if dlg.exec() != QDialog.DialogCode.Accepted:
+            return []
+        return [inputs.item(i).text() for i in range(inputs.count())]
 
     def on_reanalyze(self):
-        if self.last_file_path:
-            self.start_analysis(self.last_file_path)
+        if self.last_inputs:
+            self.start_analysis(self.last_inputs)
         else:
             QMessageBox.warning(self, "Aviso", "Nenhum arquivo para reanalisar.")
 
-    def start_analysis(self, file_path: str):
-        self.progress_dialog = QProgressDialog("Analisando arquivo...", "Cancelar", 0, 0, self)
+    def on_watch_toggled(self, checked: bool):
+        if not checked:
+            self.watch_timer.stop()
+            self.watch_analysis = None
+            # Uma leitura em andamento é descartada ao terminar (ver watch_collected)
+            self.watch_running = False
+            return
+        directory = QFileDialog.getExistingDirectory(self, "Selecionar Pasta para Monitorar")
+        if not directory:
+            self.watch_button.setChecked(False)
+            return
+        self.cancel_snapshot_load()
+        self.watch_analysis = IncrementalAnalysis(directory)
+        self.last_inputs = []
+        self.reanalyze_button.setEnabled(False)
+        self.last_report = self.watch_analysis.report
+        self.filtered_report = self.last_report
+        self.filter_index = None
+        self.filter_seq += 1
+        self.display_report(self.last_report)
+        try:
+            interval = int(load_setting("watch_interval", "10"))
+        except ValueError:
+            interval = 10
+        self.watch_timer.start(max(interval, 1) * 1000)
+        self.watch_tick()
+
+    def watch_tick(self):
+        if self.watch_analysis is None or self.watch_running:
+            return
+        self.watch_running = True
+        analysis = self.watch_analysis
+        worker = ScanWorker(analysis)
+        worker.signals.collected.connect(lambda results, a=analysis: self.watch_collected(a, results))
+        worker.signals.error.connect(lambda msg, a=analysis: self.watch_error(a, msg))
+        self.threadpool.start(worker)
+
+    def watch_collected(self, analysis, results: list):
+        # Resultado de uma pasta que deixou de ser monitorada
+        if analysis is not self.watch_analysis:
+            return
+        self.watch_running = False
+        if not results:
+            return
+        showing_all = self.filtered_report is self.last_report
+        novas = self.watch_analysis.merge(results)
+        if novas:
+            self.filter_index = None
+            self.filter_seq += 1
+        # O modelo acompanha last_report["notas"]; com filtros aplicados, as
+        # notas novas ficam ocultas até os filtros serem reaplicados. Com a base
+        # de notas na tela, o relatório é recarregado ao desmarcá-la.
+        if not self.warehouse_checkbox.isChecked():
+            self.model.appendData(novas)
+        if showing_all:
+            self.update_summary(self.last_report)
+
+    def watch_error(self, analysis, error_msg: str):
+        if analysis is not self.watch_analysis:
+            return
+        self.watch_running = False
+        self.watch_button.setChecked(False)
+        QMessageBox.critical(self, "Erro", f"Erro ao monitorar a pasta: {error_msg}")
+
+    def on_save_snapshot(self):
+        if not self.last_report:
+            QMessageBox.warning(self, "Aviso", "Nenhum relatório para salvar.")
+            return
+        filename, _ = QFileDialog.getSaveFileName(self, "Salvar Análise", "", "Análises salvas (*.db)")
+        if filename:
+            # Salva o relatório completo, não só o resultado dos filtros
+            self.queue_export("snapshot", filename, report=self.last_report)
+
+    def on_open_snapshot(self):
+        file_path, _ = QFileDialog.getOpenFileName(self, "Abrir Análise", "", "Análises salvas (*.db)")
+        if not file_path:
+            return
+        self.watch_button.setChecked(False)
+        self.cancel_snapshot_load()
+        worker = SnapshotLoadWorker(file_path)
+        worker.signals.opened.connect(lambda report, w=worker: self.snapshot_opened(w, report))
+        worker.signals.notes.connect(lambda batch, w=worker: self.snapshot_notes(w, batch))
+        worker.signals.finished.connect(lambda result, w=worker: self.snapshot_finished(w))
+        worker.signals.error.connect(lambda msg, w=worker: self.snapshot_error(w, msg))
+        self.snapshot_worker = worker
+        self.threadpool.start(worker)
+
+    def cancel_snapshot_load(self):
+        if self.snapshot_worker is not None:
+            self.snapshot_worker.cancel()
+            self.snapshot_worker = None
+
+    def snapshot_opened(self, worker, report: dict):
+        if worker is not self.snapshot_worker:
+            return
+        self.last_inputs = []
+        self.reanalyze_button.setEnabled(False)
+        self.last_report = report
+        self.filtered_report = report
+        self.filter_index = None
+        self.filter_seq += 1
+        self.display_report(report)
+        # Até o fim da leitura, mostra os totais gravados no arquivo
+        self.show_summary(report["resumo"])
+
+    def snapshot_notes(self, worker, batch: list):
+        if worker is not self.snapshot_worker:
+            return
+        showing_all = self.filtered_report is self.last_report
+        first = not self.last_report["notas"]
+        self.last_report["notas"].extend(batch)
+        self.filter_index = None
+        self.filter_seq += 1
+        if showing_all and first:
+            # display_report ajusta o cabeçalho ao modelo (NF-e/NFC-e) das notas
+            self.display_report(self.last_report)
+            self.show_summary(self.last_report["resumo"])
+        else:
+            # Com filtros aplicados, appendData as mantém ocultas
+            self.model.appendData(batch)
+
+    def snapshot_finished(self, worker):
+        if worker is not self.snapshot_worker:
+            return
+        self.snapshot_worker = None
+        self.update_summary(self.filtered_report)
+
+    def snapshot_error(self, worker, error_msg: str):
+        if worker is not self.snapshot_worker:
+            return
+        self.snapshot_worker = None
+        QMessageBox.critical(self, "Erro", f"Erro ao abrir a análise: {error_msg}")
+
+    def on_clear_cache(self):
+        clear_parse_cache()
+        QMessageBox.information(self, "Cache", "Cache de leitura dos XMLs limpo. A próxima análise relerá todos os arquivos.")
+
+    def start_analysis(self, file_paths: list):
+        self.cancel_snapshot_load()
+        label = "Analisando arquivo..." if len(file_paths) == 1 else f"Analisando {len(file_paths)} entradas..."
+        self.progress_dialog = QProgressDialog(label, "Cancelar", 0, 0, self)
         self.progress_dialog.setWindowModality(Qt.WindowModality.WindowModal)
-        self.progress_dialog.show()
+        # O diálogo atravessa várias fases: não deve fechar ao atingir o máximo de uma delas
+        self.progress_dialog.setAutoReset(False)
+        self.progress_dialog.setAutoClose(False)
 
-        worker = AnalyzeWorker(file_path)
+        worker = AnalyzeWorker(file_paths)
+        worker.signals.progress.connect(self.analysis_progress)
         worker.signals.finished.connect(self.analysis_finished)
         worker.signals.error.connect(self.analysis_error)
+        worker.signals.cancelled.connect(self.analysis_cancelled)
+        worker.signals.notes.connect(lambda batch, w=worker: self.analysis_notes(w, batch))
+        self.analysis_worker = worker
+        self.streamed_summary = None
+        self.progress_dialog.canceled.connect(self.cancel_analysis)
+        self.progress_dialog.show()
         self.threadpool.start(worker)
 
+    def cancel_analysis(self):
+        # O worker continua referenciado aqui: o sinal não mantém vivo o método de um QRunnable
+        if self.analysis_worker is not None:
+            self.analysis_worker.cancel()
+
+    def analysis_progress(self, info: dict):
+        dialog = self.progress_dialog
+        if dialog.wasCanceled():
+            dialog.setLabelText("Cancelando...")
+            return
+        # total 0 = fase sem tamanho conhecido: barra indeterminada
+        dialog.setMaximum(info["total"])
+        dialog.setValue(min(info["done"], info["total"]))
+        dialog.setLabelText(format_progress(info))
+
+    def analysis_notes(self, worker, batch: list):
+        # Notas chegando durante a análise: aparecem na tabela antes do fim,
+        # mas filtros e exportação só passam a usá-las em analysis_finished
+        if worker is not self.analysis_worker:
+            return
+        if self.streamed_summary is None:
+            self.streamed_summary = ReportSummary()
+            self.display_report({"notas": batch})
+        else:
+            self.model.appendData(batch)
+        for nota in batch:
+            self.streamed_summary.add(nota)
+        self.show_summary(self.streamed_summary.to_dict())
+
+    def discard_streamed_notes(self):
+        # Análise interrompida: volta a mostrar o relatório anterior
+        if self.streamed_summary is None:
+            return
+        self.streamed_summary = None
+        if self.filtered_report is not None:
+            self.display_report(self.filtered_report)
+        else:
+            self.display_report({"notas": []})
+
+    def analysis_cancelled(self):
+        self.analysis_worker = None
+        self.progress_dialog.close()
+        self.discard_streamed_notes()
+
     def analysis_finished(self, report: dict):
+        self.streamed_summary = None
+        self.analysis_worker = None
         self.progress_dialog.close()
         self.last_report = report
         self.filtered_report = report
+        self.filter_index = None
+        self.filter_seq += 1
         self.display_report(report)
         errors = report.get("errors", [])
         if errors:
@@ -266,14 +984,55 @@ class NFCeAnalyzerApp(QMainWindow):
         missing = report.get("missing_keys", [])
         if missing:
             self.show_missing_keys_dialog(missing)
+        unofficial = report.get("unofficial_keys", [])
+        if unofficial:
+            self.show_unofficial_keys_dialog(unofficial)
+        cross = report.get("cross_duplicates", [])
+        if cross:
+            self.show_cross_duplicates_dialog(cross)
         self.reanalyze_button.setEnabled(True)
 
     def analysis_error(self, error_msg: str):
+        self.analysis_worker = None
         self.progress_dialog.close()
+        self.discard_streamed_notes()
         QMessageBox.critical(self, "Erro", f"Erro ao analisar: {error_msg}")
 
+    def on_ingest_warehouse(self):
+        if not self.last_report or not self.last_report.get("notas"):
+            QMessageBox.warning(self, "Aviso", "Nenhum relatório para incluir na base.")
+            return
+        # As notas analisadas trazem a própria origem; esta vale para as que não têm
+        origem = self.watch_analysis.directory if self.watch_analysis else ""
+        worker = WarehouseIngestWorker(self.last_report, origem)
+        worker.signals.finished.connect(self.warehouse_ingested)
+        worker.signals.error.connect(lambda msg: QMessageBox.critical(self, "Erro", f"Erro ao incluir na base: {msg}"))
+        self.threadpool.start(worker)
+
+    def warehouse_ingested(self, result: dict):
+        QMessageBox.information(
+            self, "Base de notas",
+            f"{result['inserted']} notas incluídas ({result['existing']} já estavam na base). "
+            f"Total na base: {result['total']}."
+        )
+
+    def on_warehouse_toggled(self, checked: bool):
+        # Ao desmarcar, volta a mostrar o relatório carregado
+        self.filter_seq += 1
+        if not checked and self.last_report is not None:
+            self.filtered_report = self.last_report
+            self.display_report(self.last_report)
+
+    def warehouse_query_finished(self, result: dict):
+        if result["seq"] != self.filter_seq or not self.warehouse_checkbox.isChecked():
+            return
+        self.filtered_report = result["report"]
+        self.display_report(self.filtered_report)
+        if not self.filtered_report["notas"]:
+            QMessageBox.information(self, "Sem resultados", "Nenhuma nota da base atende a esses filtros.")
+
     def apply_filters(self):
-        if not self.last_report:
+        if not self.last_report and not self.warehouse_checkbox.isChecked():
             QMessageBox.warning(self, "Aviso", "Nenhum relatório carregado.")
             return
 
@@ -287,49 +1046,46 @@ class NFCeAnalyzerApp(QMainWindow):
         min_val = float(self.min_value_filter.text()) if self.min_value_filter.text() else None
         max_val = float(self.max_value_filter.text()) if self.max_value_filter.text() else None
 
-        filtered_notas = []
-        for nota in self.last_report.get("notas", []):
-            if sel_status != "todos" and sel_status != (nota.get("status") or "").lower():
-                continue
-            if cfop_filter:
-                if not any(cfop_filter == p.get("cfop", "").lower() for p in nota.get("produtos", [])):
-                    continue
-            if nNF_filter:
-                if nNF_filter not in (nota.get("nNF") or "").lower():
-                    continue
-            if nota.get("autorizada"):
-                try:
-                    auth_date = datetime.datetime.strptime(nota["autorizada"], "%Y-%m-%d").date()
-                    if not (start_date <= auth_date <= end_date):
-                        continue
-                except:
-                    pass
-            val = nota.get("valor", 0)
-            if min_val is not None and val < min_val:
-                continue
-            if max_val is not None and val > max_val:
-                continue
-            if product_filter:
-                if not any(product_filter in p.get("nome", "").lower() for p in nota.get("produtos", [])):
-                    continue
-            filtered_notas.append(nota)
-
-        filtered_resumo = {
-            "total_notas": len(filtered_notas),
-            "valor_total": sum(n.get("valor", 0) for n in filtered_notas)
+        criteria = {
+            "status": sel_status if sel_status != "todos" else None,
+            "cfop": cfop_filter or None,
+            "nNF": nNF_filter or None,
+            "start_date": start_date,
+            "end_date": end_date,
+            "min_val": min_val,
+            "max_val": max_val,
+            "product": product_filter or None,
         }
+        self.filter_seq += 1
+        if self.warehouse_checkbox.isChecked():
+            worker = WarehouseQueryWorker(criteria, self.filter_seq)
+            worker.signals.finished.connect(self.warehouse_query_finished)
+            worker.signals.error.connect(self.filters_error)
+            self.threadpool.start(worker)
+            return
+        worker = FilterWorker(self.last_report, self.filter_index, criteria, self.filter_seq)
+        worker.signals.finished.connect(self.filters_finished)
+        worker.signals.error.connect(self.filters_error)
+        self.threadpool.start(worker)
 
-        self.filtered_report = {
-            "resumo": filtered_resumo,
-            "notas": filtered_notas,
-            "errors": self.last_report.get("errors", []),
-            "duplicates": self.last_report.get("duplicates", []),
-            "missing_keys": self.last_report.get("missing_keys", [])
-        }
-        self.display_report(self.filtered_report)
-        if not filtered_notas:
+    def filters_finished(self, result: dict):
+        # Ignora resultados de filtros antigos se o usuário já pediu outro
+        if result["seq"] != self.filter_seq:
+            return
+        self.filter_index = result["index"]
+        self.filtered_report = result["report"]
+        # As posições se referem a last_report["notas"]; se o modelo mostra
+        # outras notas (ex.: análise interrompida), é recarregado antes
+        if self.model.note_count() != len(self.last_report["notas"]):
+            self.display_report(self.last_report)
+        self.model.setRows(result["ids"])
+        self.update_summary(self.filtered_report)
+        if not self.filtered_report["notas"]:
             QMessageBox.information(self, "Sem resultados", "Nenhuma nota encontrada com esses filtros.")
 
+    def filters_error(self, error_msg: str):
+        QMessageBox.critical(self, "Erro", f"Erro ao aplicar filtros: {error_msg}")
+
     def display_report(self, report: dict):
         notas = report.get("notas", [])
         if notas:
@@ -338,65 +1094,206 @@ class NFCeAnalyzerApp(QMainWindow):
         else:
             self.model._headers[0] = "Número NFC-e"
         self.model.updateData(notas)
-    
-        total_notas = len(notas)
-        total_geral = sum(n.get("valor", 0) for n in notas)
-        notas_autorizadas = [n for n in notas if (n.get("status") or "").lower() == "autorizada"]
-        total_autorizadas = len(notas_autorizadas)
-        valor_autorizadas = sum(n.get("valor", 0) for n in notas_autorizadas)
+        self.update_summary(report)
+
+    def update_summary(self, report: dict):
+        self.show_summary(report_summary(report))
+
+    def show_summary(self, resumo: dict):
+        por_modelo = " | ".join(
+            f"{modelo or 'Sem modelo'}: {totais['notas']}" for modelo, totais in sorted(resumo["por_modelo"].items())
+        )
         txt = (
-            f"<b>Total de Notas:</b> {total_notas} "
-            f"| <b>Valor Total:</b> {format_currency(total_geral)}<br>"
-            f"<b>Notas Autorizadas:</b> {total_autorizadas} "
-            f"| <b>Valor Autorizadas:</b> {format_currency(valor_autorizadas)}"
+            f"<b>Total de Notas:</b> {resumo['total_notas']} "
+            f"| <b>Valor Total:</b> {format_currency(resumo['valor_total'])}<br>"
+            f"<b>Notas Autorizadas:</b> {resumo['notas_autorizadas']} "
+            f"| <b>Valor Autorizadas:</b> {format_currency(resumo['valor_autorizadas'])}"
         )
+        if por_modelo:
+            txt += f"<br><b>Por modelo:</b> {por_modelo}"
+        por_origem = resumo.get("por_origem") or {}
+        if len(por_origem) > 1:
+            txt += "<br><b>Por entrada:</b> " + " | ".join(
+                f"{os.path.basename(origem) or origem}: {totais['notas']}" for origem, totais in sorted(por_origem.items())
+            )
         self.summary_label.setText(txt)
 
     def export_report(self, format_type: str):
         if not self.filtered_report:
             QMessageBox.warning(self, "Aviso", "Nenhum relatório para exportar.")
             return
-        if format_type.lower() == "pdf":
-            filename, _ = QFileDialog.getSaveFileName(self, "Salvar PDF", "", "Arquivos PDF (*.pdf)")
-            if filename:
-                export_to_pdf(self.filtered_report, filename)
-        elif format_type.lower() == "txt":
-            filename, _ = QFileDialog.getSaveFileName(self, "Salvar TXT", "", "Arquivos TXT (*.txt)")
-            if filename:
-                export_to_txt(self.filtered_report, filename)
-        elif format_type.lower() == "csv":
-            filename, _ = QFileDialog.getSaveFileName(self, "Salvar CSV", "", "Arquivos CSV (*.csv)")
-            if filename:
-                export_to_csv(self.filtered_report, filename)
-        elif format_type.lower() == "xlsx":
-            filename, _ = QFileDialog.getSaveFileName(self, "Salvar Excel", "", "Arquivos Excel (*.xlsx)")
-            if filename:
-                export_to_excel(self.filtered_report, filename)
-        QMessageBox.information(self, "Sucesso", f"Relatório exportado como {format_type.upper()}.")
+        captions = {
+            "pdf": ("Salvar PDF", "Arquivos PDF (*.pdf)"),
+            "txt": ("Salvar TXT", "Arquivos TXT (*.txt)"),
+            "csv": ("Salvar CSV", "Arquivos CSV (*.csv)"),
+            "xlsx": ("Salvar Excel", "Arquivos Excel (*.xlsx)"),
+        }
+        format_type = format_type.lower()
+        caption, file_filter = captions[format_type]
+        filename, _ = QFileDialog.getSaveFileName(self, caption, "", file_filter)
+        if filename:
+            self.queue_export(format_type, filename)
 
     def export_csv_or_excel(self):
         if not self.filtered_report:
             QMessageBox.warning(self, "Aviso", "Nenhum relatório para exportar.")
             return
-        file_filter = "CSV/Excel (*.csv *.xlsx);;Todos Arquivos (*.*)"
-        out_file, _ = QFileDialog.getSaveFileName(self, "Salvar CSV ou Excel", "", file_filter)
+        file_filter = "CSV/Excel (*.csv *.xlsx);;CSV/Excel por produto (*.csv *.xlsx);;Todos Arquivos (*.*)"
+        out_file, selected_filter = QFileDialog.getSaveFileName(self, "Salvar CSV ou Excel", "", file_filter)
         if not out_file:
             return
-        import os
+        by_product = "por produto" in selected_filter
         _, ext = os.path.splitext(out_file)
         ext = ext.lower()
-        if ext == ".csv":
-            export_to_csv(self.filtered_report, out_file)
-            QMessageBox.information(self, "Sucesso", "Exportado como CSV.")
-        elif ext == ".xlsx":
-            export_to_excel(self.filtered_report, out_file)
-            QMessageBox.information(self, "Sucesso", "Exportado como Excel.")
+        if ext in (".csv", ".xlsx"):
+            self.queue_export(ext[1:], out_file, by_product=by_product)
         else:
             QMessageBox.warning(self, "Extensão inválida", "Escolha .csv ou .xlsx.")
 
+    def max_concurrent_exports(self) -> int:
+        # Deixa ao menos uma thread do pool livre para análise e filtros
+        return max(1, self.threadpool.maxThreadCount() - 1)
+
+    def queue_export(self, format_type: str, output_file: str, by_product: bool = False, report: dict = None):
+        """
+        Enfileira a exportação do relatório filtrado atual (ou de report). Cada
+        exportação tem seu próprio diálogo de progresso (não modal) com botão de cancelar.
+        """
+        self.export_seq += 1
+        job = self.export_seq
+        name = os.path.basename(output_file)
+        report = report if report is not None else self.filtered_report
+        worker = ExportWorker(format_type, snapshot_report(report), output_file, by_product)
+        worker.signals.progress.connect(lambda info, job=job: self.export_progress(job, info))
+        worker.signals.finished.connect(lambda result, job=job: self.export_finished(job, result))
+        worker.signals.error.connect(lambda msg, job=job: self.export_error(job, msg))
+        worker.signals.cancelled.connect(lambda job=job: self.export_done(job))
+
+        dialog = QProgressDialog(f"Na fila: {name}", "Cancelar", 0, 100, self)
+        dialog.setWindowTitle("Exportação")
+        dialog.setWindowModality(Qt.WindowModality.NonModal)
+        dialog.setAutoClose(False)
+        dialog.setAutoReset(False)
+        dialog.setMinimumDuration(0)
+        dialog.setValue(0)
+        dialog.canceled.connect(lambda job=job: self.cancel_export(job))
+        dialog.show()
+
+        self.export_jobs[job] = {"worker": worker, "dialog": dialog, "name": name}
+        self.export_queue.append(job)
+        self.start_queued_exports()
+
+    def start_queued_exports(self):
+        while self.export_queue and self.exports_running < self.max_concurrent_exports():
+            job = self.export_queue.popleft()
+            info = self.export_jobs[job]
+            info["dialog"].setLabelText(f"Exportando {info['name']}...")
+            self.exports_running += 1
+            self.threadpool.start(info["worker"])
+
+    def cancel_export(self, job: int):
+        info = self.export_jobs.get(job)
+        if info is None:
+            return
+        if job in self.export_queue:
+            self.export_queue.remove(job)
+            info["dialog"].close()
+            del self.export_jobs[job]
+        else:
+            info["worker"].cancel()
+
+    def export_progress(self, job: int, info: dict):
+        job_info = self.export_jobs.get(job)
+        if job_info is None or job_info["dialog"].wasCanceled():
+            return
+        job_info["dialog"].setValue(min(info["done"], 100))
+        text = f"Exportando {job_info['name']}: {info['done']}%"
+        if info["eta"] is not None and info["done"] < 100:
+            text += f" (restam ~{int(info['eta']) + 1}s)"
+        job_info["dialog"].setLabelText(text)
+
+    def export_done(self, job: int):
+        info = self.export_jobs.pop(job, None)
+        if info is not None:
+            info["dialog"].close()
+        self.exports_running -= 1
+        self.start_queued_exports()
+
+    def export_finished(self, job: int, result: dict):
+        self.export_done(job)
+        QMessageBox.information(self, "Sucesso", f"Relatório exportado em {os.path.basename(result['file'])}.")
+
+    def export_error(self, job: int, error_msg: str):
+        self.export_done(job)
+        QMessageBox.critical(self, "Erro", f"Erro ao exportar: {error_msg}")
+
+    def on_product_summary(self):
+        if not self.filtered_report:
+            QMessageBox.warning(self, "Aviso", "Nenhum relatório carregado.")
+            return
+        report = self.filtered_report
+        aggregates = cached_product_aggregates(report)
+        if aggregates is not None:
+            self.show_product_summary_dialog(aggregates)
+            return
+        notas = report.get("notas", [])
+        # Cópia das listas, que o monitoramento de pasta pode estender;
+        # as notas da base (WarehouseNotes) não mudam
+        worker = AggregateWorker(list(notas) if isinstance(notas, list) else notas)
+        worker.signals.finished.connect(
+            lambda result, r=report, n=notas: self.product_summary_ready(r, n, result["aggregates"])
+        )
+        worker.signals.error.connect(lambda msg: QMessageBox.critical(self, "Erro", f"Erro ao agregar produtos: {msg}"))
+        self.threadpool.start(worker)
+
+    def product_summary_ready(self, report: dict, notas: list, aggregates):
+        store_product_aggregates(report, notas, aggregates)
+        self.show_product_summary_dialog(aggregates)
+
+    def show_product_summary_dialog(self, aggregates):
+        dlg = QDialog(self)
+        dlg.setWindowTitle("Resumo de Produtos")
+        dlg.resize(800, 500)
+        ly = QVBoxLayout(dlg)
+        top_ly = QHBoxLayout()
+        top_ly.addWidget(QLabel("Agrupar por:"))
+        grouping_combo = QComboBox()
+        for key, title in GROUPINGS.items():
+            grouping_combo.addItem(title, key)
+        top_ly.addWidget(grouping_combo)
+        top_ly.addStretch()
+        ly.addLayout(top_ly)
+
+        model = ProductSummaryModel(aggregates.rows("cfop"), dlg)
+        view = QTableView()
+        view.setModel(model)
+        ly.addWidget(view)
+        grouping_combo.currentIndexChanged.connect(
+            lambda: model.updateData(aggregates.rows(grouping_combo.currentData()))
+        )
+        ly.addWidget(QLabel(f"Notas consideradas: {aggregates.total_notas}"))
+
+        buttons = QHBoxLayout()
+        btn_export = QPushButton("Exportar")
+        btn_export.clicked.connect(self.export_product_summary)
+        buttons.addWidget(btn_export)
+        btn_close = QPushButton("Fechar")
+        btn_close.clicked.connect(dlg.close)
+        buttons.addWidget(btn_close)
+        ly.addLayout(buttons)
+        dlg.exec()
+
+    def export_product_summary(self):
+        if not self.filtered_report:
+            return
+        out_file, _ = QFileDialog.getSaveFileName(
+            self, "Salvar Resumo de Produtos", "", "CSV (*.csv);;Excel (*.xlsx)"
+        )
+        if out_file:
+            self.queue_export("produtos", out_file)
+
     def on_note_double_click(self, index: QModelIndex):
-        row = index.row()
-        nota = self.filtered_report.get("notas", [])[row]
+        nota = self.model.nota_at(index.row())
         self.show_note_details(nota)
 
     def show_note_details(self, nota: dict):
@@ -414,6 +1311,8 @@ class NFCeAnalyzerApp(QMainWindow):
             f"<b>Emissão:</b> {nota.get('emitida','N/A')}<br>"
             f"<b>Autorização:</b> {nota.get('autorizada','N/A')}<br>"
         )
+        if nota.get("origem"):
+            info.setText(info.text() + f"<b>Arquivo de origem:</b> {nota['origem']}<br>")
         ly.addWidget(info)
         scroll = QScrollArea()
         scroll.setWidgetResizable(True)
@@ -476,17 +1375,27 @@ class NFCeAnalyzerApp(QMainWindow):
         dlg.exec()
 
     def show_missing_keys_dialog(self, missing: list):
+        self.show_keys_dialog("Chaves Oficiais Ausentes", "Algumas chaves oficiais não foram encontradas:", missing)
+
+    def show_unofficial_keys_dialog(self, unofficial: list):
+        self.show_keys_dialog("Notas Fora do keys.csv", "(nNF, cNF, cnpj) lidos que não constam no keys.csv:", unofficial)
+
+    def show_cross_duplicates_dialog(self, cross: list):
+        lines = [f"{key} - já vista em {os.path.basename(origem) or origem}" for key, origem in cross]
+        self.show_keys_dialog("Notas de Outros Arquivos", "Notas já vistas em análises de outros arquivos:", lines)
+
+    def show_keys_dialog(self, title: str, label: str, keys: list):
         dlg = QDialog(self)
-        dlg.setWindowTitle("Chaves Oficiais Ausentes")
+        dlg.setWindowTitle(title)
         dlg.resize(600, 400)
         ly = QVBoxLayout(dlg)
-        lbl = QLabel("<b>Algumas chaves oficiais não foram encontradas:</b>")
+        lbl = QLabel(f"<b>{label}</b>")
         ly.addWidget(lbl)
         txt = QTextEdit()
         txt.setReadOnly(True)
         ly.addWidget(txt)
-        for m in missing:
-            txt.append(str(m))
+        for k in keys:
+            txt.append(str(k))
         btn = QPushButton("Fechar")
         btn.clicked.connect(dlg.close)
         ly.addWidget(btn, alignment=Qt.AlignmentFlag.AlignRight)
@@ -499,6 +1408,12 @@ class NFCeAnalyzerApp(QMainWindow):
             QMessageBox.StandardButton.No
         )
         if reply == QMessageBox.StandardButton.Yes:
+            # Sem isso, o pool de processos da análise continuaria lendo os XMLs
+            self.cancel_analysis()
+            self.export_queue.clear()
+            self.cancel_snapshot_load()
+            for info in self.export_jobs.values():
+                info["worker"].cancel()
             event.accept()
         else:
             event.ignore()
@@ -0,0 +1,298 @@
+import json
+import sqlite3
+import datetime
+import logging
+import threading
+from array import array
+from collections import OrderedDict
+from collections.abc import Sequence
+
+from processing import load_setting
+from records import NoteRecord, compact_note
+from summary import ReportSummary
+
+DEFAULT_WAREHOUSE_FILE = "notas.db"
+
+# Notas gravadas por transação em ingest() e buscadas por consulta em fetch()
+INGEST_BATCH = 5000
+FETCH_BATCH = 500
+
+# Blocos de FETCH_BATCH notas mantidos em memória por thread em WarehouseNotes
+NOTES_CACHE_BLOCKS = 16
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS notas ("
+    "id INTEGER PRIMARY KEY, chave TEXT NOT NULL UNIQUE, cnpj TEXT, nNF TEXT, valor REAL, "
+    "status TEXT, modelo TEXT, emitida TEXT, autorizada TEXT, data_autorizacao TEXT, "
+    "origem TEXT, dados TEXT NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS nomes (id INTEGER PRIMARY KEY, nome TEXT NOT NULL UNIQUE)",
+    "CREATE TABLE IF NOT EXISTS produtos (nota_id INTEGER NOT NULL, cfop TEXT, nome_id INTEGER)",
+    "CREATE INDEX IF NOT EXISTS idx_notas_cnpj ON notas (cnpj)",
+    "CREATE INDEX IF NOT EXISTS idx_notas_status ON notas (status)",
+    "CREATE INDEX IF NOT EXISTS idx_notas_emitida ON notas (emitida)",
+    "CREATE INDEX IF NOT EXISTS idx_notas_data ON notas (data_autorizacao)",
+    "CREATE INDEX IF NOT EXISTS idx_notas_valor ON notas (valor)",
+    "CREATE INDEX IF NOT EXISTS idx_produtos_cfop ON produtos (cfop, nota_id)",
+    "CREATE INDEX IF NOT EXISTS idx_produtos_nome ON produtos (nome_id, nota_id)",
+)
+
+def _auth_date(autorizada):
+    # Mesma regra de NoteIndex: data inválida conta como nota sem data
+    if not autorizada:
+        return None
+    try:
+        return datetime.datetime.strptime(autorizada, "%Y-%m-%d").date().isoformat()
+    except Exception:
+        return None
+
+def _read_notes(conn: sqlite3.Connection, ids) -> list:
+    # NoteRecords dos ids (no máximo FETCH_BATCH), na mesma ordem
+    marks = ",".join("?" * len(ids))
+    rows = dict(conn.execute(f"SELECT id, dados FROM notas WHERE id IN ({marks})", list(ids)).fetchall())
+    return [NoteRecord.from_row(json.loads(rows[nota_id])) for nota_id in ids]
+
+class NoteWarehouse:
+    """
+    Base local (SQLite) de notas de várias análises, para consultas que não
+    cabem em um único relatório em memória (por exemplo, um ano de ZIPs).
+
+    Cada nota é gravada uma vez, pela chave de acesso (chNFe; sem ela, por
+    nNF|cNF|CNPJ), com colunas indexadas para os filtros da interface
+    (status, CFOP, data de autorização, valor, produto) e para CNPJ e emissão,
+    além da nota completa em JSON (NoteRecord.to_row) para remontar o NoteRecord.
+    query_ids() aplica os mesmos filtros de NoteIndex.query_ids em SQL, e
+    summary() e fetch() leem só as notas selecionadas; report() não lê
+    nenhuma, as notas são buscadas conforme forem usadas (WarehouseNotes).
+    """
+
+    def __init__(self, path: str = DEFAULT_WAREHOUSE_FILE, timeout: float = 60.0):
+        self.path = path
+        # timeout: várias análises (cli.py -j) podem gravar na mesma base
+        self.conn = sqlite3.connect(path, timeout=timeout)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        for statement in _SCHEMA:
+            self.conn.execute(statement)
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM notas").fetchone()[0]
+
+    def _name_ids(self, names: set) -> dict:
+        names = list(names)
+        for i in range(0, len(names), FETCH_BATCH):
+            self.conn.executemany("INSERT OR IGNORE INTO nomes (nome) VALUES (?)", [(n,) for n in names[i:i + FETCH_BATCH]])
+        ids = {}
+        for i in range(0, len(names), FETCH_BATCH):
+            batch = names[i:i + FETCH_BATCH]
+            marks = ",".join("?" * len(batch))
+            ids.update(self.conn.execute(f"SELECT nome, id FROM nomes WHERE nome IN ({marks})", batch).fetchall())
+        return ids
+
+    def _ingest_batch(self, notas: list, origem: str) -> int:
+        inserted = 0
+        produtos = []
+        cur = self.conn.cursor()
+        for nota in notas:
+            if not isinstance(nota, NoteRecord):
+                nota = compact_note(nota)
+            emitente = nota.emitente or {}
+            cnpj = emitente.get("cnpj") or ""
+            chave = nota.chNFe or f"{nota.nNF}|{nota.cNF}|{cnpj}"
+            cur.execute(
+                "INSERT OR IGNORE INTO notas (chave, cnpj, nNF, valor, status, modelo, emitida, autorizada, "
+                "data_autorizacao, origem, dados) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (chave, cnpj, nota.nNF, nota.valor, (nota.status or "").lower(), nota.modelo, nota.emitida,
+                 nota.autorizada, _auth_date(nota.autorizada), nota.origem or origem,
+                 json.dumps(nota.to_row(), ensure_ascii=False, separators=(",", ":")))
+            )
+            if cur.rowcount:
+                inserted += 1
+                nota_id = cur.lastrowid
+                for p in nota.produtos:
+                    produtos.append((nota_id, (p.cfop or "").lower(), (p.nome or "").lower()))
+        name_ids = self._name_ids({nome for _, _, nome in produtos})
+        cur.executemany(
+            "INSERT INTO produtos (nota_id, cfop, nome_id) VALUES (?, ?, ?)",
+            [(nota_id, cfop, name_ids[nome]) for nota_id, cfop, nome in produtos]
+        )
+        return inserted
+
+    def ingest(self, notas, origem: str = "", progress=None) -> tuple:
+        """
+        Grava as notas (lista de NoteRecord ou dicts, ou um relatório com "notas"),
+        em transações de INGEST_BATCH notas. Notas já presentes na base são ignoradas.
+        origem é gravada nas notas que não trazem a sua (NoteRecord.origem).
+        Devolve (incluídas, já existentes).
+        progress, se informado, recebe a quantidade de notas processadas via update().
+        """
+        if isinstance(notas, dict):
+            notas = notas.get("notas", [])
+        notas = list(notas)
+        inserted = 0
+        for start in range(0, len(notas), INGEST_BATCH):
+            batch = notas[start:start + INGEST_BATCH]
+            with self.conn:
+                inserted += self._ingest_batch(batch, origem)
+            if progress is not None:
+                progress.update(start + len(batch))
+        logging.info(f"Base de notas '{self.path}': {inserted} notas incluídas, {len(notas) - inserted} já existentes ({origem}).")
+        return inserted, len(notas) - inserted
+
+    def _where(self, status=None, cfop=None, nNF=None, start_date=None, end_date=None,
+               min_val=None, max_val=None, product=None) -> tuple:
+        # Mesma semântica de NoteIndex.query_ids (notas sem data de autorização
+        # passam pelo filtro de datas)
+        clauses = []
+        params = []
+        if status:
+            clauses.append("status = ?")
+            params.append(status.lower())
+        if cfop:
+            clauses.append("id IN (SELECT nota_id FROM produtos WHERE cfop = ?)")
+            params.append(cfop.lower())
+        if product:
+            clauses.append(
+                "id IN (SELECT nota_id FROM produtos WHERE nome_id IN "
+                "(SELECT id FROM nomes WHERE instr(nome, ?) > 0))"
+            )
+            params.append(product.lower())
+        if start_date is not None:
+            clauses.append("(data_autorizacao IS NULL OR data_autorizacao >= ?)")
+            params.append(start_date.isoformat())
+        if end_date is not None:
+            clauses.append("(data_autorizacao IS NULL OR data_autorizacao <= ?)")
+            params.append(end_date.isoformat())
+        if min_val is not None:
+            clauses.append("valor >= ?")
+            params.append(min_val)
+        if max_val is not None:
+            clauses.append("valor <= ?")
+            params.append(max_val)
+        if nNF:
+            clauses.append("instr(lower(nNF), ?) > 0")
+            params.append(nNF.lower())
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def query_ids(self, **criteria) -> list:
+        """
+        ids das notas que atendem aos filtros (mesmos parâmetros de
+        NoteIndex.query_ids), na ordem em que foram incluídas na base.
+        """
+        where, params = self._where(**criteria)
+        return [row[0] for row in self.conn.execute(f"SELECT id FROM notas{where} ORDER BY id", params)]
+
+    def summary(self, **criteria) -> dict:
+        """
+        report["resumo"] (ver summary.py) das notas filtradas, calculado em SQL.
+        """
+        where, params = self._where(**criteria)
+        summary = ReportSummary()
+        rows = self.conn.execute(
+            f"SELECT status, modelo, origem, COUNT(*), SUM(valor) FROM notas{where} GROUP BY status, modelo, origem",
+            params
+        )
+        for status, modelo, origem, count, valor in rows:
+            summary.add_totals(status, modelo, count, valor or 0.0, origem or None)
+        resumo = summary.to_dict()
+        # O status é gravado em minúsculas para a busca; os totais usam o nome exibido
+        resumo["por_status"] = {name.title(): totais for name, totais in resumo["por_status"].items()}
+        return resumo
+
+    def fetch(self, ids: list):
+        """
+        Gera os NoteRecords dos ids informados, na mesma ordem.
+        """
+        for i in range(0, len(ids), FETCH_BATCH):
+            yield from _read_notes(self.conn, ids[i:i + FETCH_BATCH])
+
+    def report(self, **criteria) -> dict:
+        """
+        Relatório (mesmo formato de process_xml_files) com as notas filtradas
+        da base. report["notas"] é uma WarehouseNotes: só os ids ficam em
+        memória, então a seleção pode ser maior que a memória disponível.
+        """
+        ids = self.query_ids(**criteria)
+        return {
+            "resumo": self.summary(**criteria),
+            "notas": WarehouseNotes(self.path, ids),
+            "errors": [],
+            "duplicates": [],
+            "missing_keys": [],
+            "unofficial_keys": [],
+            "cross_duplicates": []
+        }
+
+class WarehouseNotes(Sequence):
+    """
+    Lista somente leitura das notas de uma consulta à base (NoteWarehouse.report),
+    na ordem dos ids. Guarda só os ids; as notas são lidas em blocos de
+    FETCH_BATCH no acesso por posição (a tabela da interface busca só as
+    linhas exibidas), com os NOTES_CACHE_BLOCKS blocos mais recentes em
+    memória, e percorrê-la lê a base bloco a bloco, sem acumular as notas.
+    Cada thread usa a sua conexão, então a interface e as exportações em
+    segundo plano podem lê-la ao mesmo tempo.
+    """
+
+    def __init__(self, path: str, ids: list):
+        self.path = path
+        self._ids = array("q", ids)
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+
+    def _block(self, number: int) -> list:
+        local = self._local
+        if not hasattr(local, "blocks"):
+            local.conn = self._connect()
+            local.blocks = OrderedDict()
+        block = local.blocks.get(number)
+        if block is None:
+            start = number * FETCH_BATCH
+            block = local.blocks[number] = _read_notes(local.conn, self._ids[start:start + FETCH_BATCH])
+            if len(local.blocks) > NOTES_CACHE_BLOCKS:
+                local.blocks.popitem(last=False)
+        else:
+            local.blocks.move_to_end(number)
+        return block
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self._ids)))]
+        if i < 0:
+            i += len(self._ids)
+        if not 0 <= i < len(self._ids):
+            raise IndexError("índice fora da lista de notas")
+        return self._block(i // FETCH_BATCH)[i % FETCH_BATCH]
+
+    def __iter__(self):
+        conn = self._connect()
+        try:
+            for start in range(0, len(self._ids), FETCH_BATCH):
+                yield from _read_notes(conn, self._ids[start:start + FETCH_BATCH])
+        finally:
+            conn.close()
+
+    def __repr__(self):
+        return f"WarehouseNotes({len(self._ids)} notas)"
+
+def open_warehouse(path: str = None) -> NoteWarehouse:
+    """
+    Abre a base de notas indicada pela opção "warehouse_file" do settings.ini.
+    """
+    if path is None:
+        path = load_setting("warehouse_file", DEFAULT_WAREHOUSE_FILE) or DEFAULT_WAREHOUSE_FILE
+    return NoteWarehouse(path)